@@ -1,8 +1,19 @@
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
+
 from eats.models import Authority, Calendar, DatePeriod, DateType, \
-    EntityRelationshipType, EntityTypeList, Language, NamePartType, \
+    Entity, EntityRelationshipType, EntityTypeList, Language, NamePartType, \
     NameRelationshipType, NameType, Script, SystemNamePartType, \
-    UserProfile
+    UserProfile, delete_entities
+
+
+def format_deletion_counts(counts):
+    """Return a string summarising the counts returned by
+    delete_entities."""
+    parts = ['%d %s' % (count, model_name) for model_name, count
+             in sorted(counts.items()) if count]
+    return ', '.join(parts) or 'nothing'
 
 
 class AuthorityAdmin (admin.ModelAdmin):
@@ -21,6 +32,54 @@ class DateTypeAdmin (admin.ModelAdmin):
     pass
 
 
+class EntityAdmin (admin.ModelAdmin):
+    list_display = ('id', 'last_modified')
+    actions = ['delete_selected_entities', 'report_selected_entities_deletion']
+
+    def get_actions(self, request):
+        actions = super(EntityAdmin, self).get_actions(request)
+        # The standard deletion action loads every related object
+        # into memory, which is impractical for large numbers of
+        # entities.
+        actions.pop('delete_selected', None)
+        return actions
+
+    def delete_selected_entities(self, request, queryset):
+        entity_ids = list(queryset.values_list('pk', flat=True))
+        # The deletion is made only once confirmed, from a page showing
+        # what it would delete.
+        if request.POST.get('post'):
+            counts = delete_entities(entity_ids)
+            self.message_user(request, 'Deleted %s.'
+                              % format_deletion_counts(counts))
+            return None
+        counts = delete_entities(entity_ids, dry_run=True)
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Are you sure?',
+            counts=format_deletion_counts(counts),
+            entity_ids=entity_ids,
+            opts=self.model._meta,
+            action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+            media=self.media)
+        request.current_app = self.admin_site.name
+        return TemplateResponse(
+            request,
+            'admin/eats/entity/delete_selected_entities_confirmation.html',
+            context)
+    delete_selected_entities.allowed_permissions = ('delete',)
+    delete_selected_entities.short_description = \
+        'Delete selected entities and all of their properties'
+
+    def report_selected_entities_deletion(self, request, queryset):
+        counts = delete_entities(queryset.values_list('pk', flat=True),
+                                 dry_run=True)
+        self.message_user(request, 'Deleting the selected entities would '
+                          'delete %s.' % format_deletion_counts(counts))
+    report_selected_entities_deletion.short_description = \
+        'Report what deleting the selected entities would delete'
+
+
 class EntityRelationshipTypeAdmin (admin.ModelAdmin):
     pass
 
@@ -61,6 +120,7 @@ admin.site.register(Authority, AuthorityAdmin)
 admin.site.register(Calendar, CalendarAdmin)
 admin.site.register(DatePeriod, DatePeriodAdmin)
 admin.site.register(DateType, DateTypeAdmin)
+admin.site.register(Entity, EntityAdmin)
 admin.site.register(EntityRelationshipType, EntityRelationshipTypeAdmin)
 admin.site.register(EntityTypeList, EntityTypeListAdmin)
 admin.site.register(Language, LanguageAdmin)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class EatsConfig (AppConfig):
+
+    name = 'eats'
+
+    def ready(self):
+        # Connect the signal handlers.
+        import eats.signals  # noqa
@@ -0,0 +1,244 @@
+"""This module implements a benchmark of the round trip of a synthetic
+EATSML corpus (see eats.eatsml.corpus) through Importer.import_file
+and Exporter.export_entities.
+
+Each phase of the import and export is timed, and the database
+queries it runs are counted. The import phases are those reported by
+the importer to its progress function, preceded by the parsing,
+validation and prefetching of the document; the export phases are
+the export of the entities and of the infrastructure they reference,
+the validation of the document and its serialisation.
+
+The peak resident memory of the process is recorded at the end of
+each phase. Since it never falls, it shows in which phase the peak
+was reached rather than how much each phase used; for that, the
+Python allocations of each phase may be traced with tracemalloc, at
+a cost in speed (the memory used by libxml2 is not traced). The
+traces are cleared at the start of each phase, so that its peak
+counts only the memory allocated during it, and the memory still
+allocated at its end is recorded along with that peak.
+
+The import is made in a transaction that is rolled back once the
+export is complete, so that a benchmark leaves the database as it
+found it."""
+
+import datetime
+import os
+from os.path import abspath, dirname, getsize, join
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from lxml import etree
+from django.db import connection, transaction
+
+from eats.models import Entity
+from eats.eatsml.corpus import generate_corpus, get_existing_ids
+from eats.eatsml.exporter import Exporter
+from eats.eatsml.importer import NSMAP, Importer
+
+# Full path to this directory.
+PATH = abspath(dirname(__file__))
+
+# Name of the import phase before the importer reports progress.
+PARSE_PHASE = 'parse'
+
+# Names of the export phases.
+EXPORT_ENTITIES_PHASE = 'entities'
+EXPORT_INFRASTRUCTURE_PHASE = 'infrastructure'
+VALIDATION_PHASE = 'validation'
+SERIALISATION_PHASE = 'serialisation'
+
+
+def run_benchmarks(user, entity_counts, seed=0, trace_memory=False,
+                   corpus_directory=None):
+    """Return the results of a benchmark of a corpus of each of
+    entity_counts entities, with the details of the environment they
+    were run in, suitable for serialising as JSON.
+
+    Arguments:
+    user -- User object to make the imports as, which must be able
+            to add infrastructure
+    entity_counts -- list of the numbers of entities to benchmark
+    seed -- optional seed for the generation of each corpus
+    trace_memory -- optional Boolean of whether to trace the Python
+                    memory allocated in each phase
+    corpus_directory -- optional path of a directory to keep the
+                        generated corpora in
+
+    """
+    runs = []
+    directory = corpus_directory or tempfile.mkdtemp(prefix='eats-corpus-')
+    try:
+        for entity_count in entity_counts:
+            path = join(directory, 'corpus-%d-%d.xml' % (entity_count, seed))
+            generate_corpus(path, entity_count, seed, get_existing_ids())
+            runs.append(Benchmark(user, trace_memory).run(path))
+    finally:
+        if corpus_directory is None:
+            shutil.rmtree(directory)
+    return {
+        'created': datetime.datetime.now().isoformat(),
+        'revision': get_revision(),
+        'database': connection.vendor,
+        'seed': seed,
+        'trace_memory': trace_memory,
+        'runs': runs,
+    }
+
+
+def get_revision():
+    """Return the git commit of the code being benchmarked, or None if
+    it cannot be determined."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=PATH,
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class PhaseRecorder (object):
+
+    """Class recording the time taken, the number of queries run and
+    the memory used by each of a succession of phases."""
+
+    def __init__(self, trace_memory=False):
+        self._trace_memory = trace_memory
+        self._phase = None
+        self.phases = []
+
+    def __call__(self, execute, sql, params, many, context):
+        """Count a query run in the current phase; this is a database
+        execute wrapper."""
+        if self._phase is not None:
+            self._phase['queries'] += 1
+        return execute(sql, params, many, context)
+
+    def start(self, name):
+        """End the current phase, if any, and start the phase name."""
+        self.stop()
+        self._phase = {'phase': name, 'queries': 0}
+        if self._trace_memory:
+            # Clearing the traces also resets the peak, which
+            # tracemalloc.reset_peak does only from Python 3.9.
+            tracemalloc.clear_traces()
+        self._start_time = time.perf_counter()
+
+    def stop(self):
+        """End the current phase, if any."""
+        if self._phase is None:
+            return
+        self._phase['seconds'] = round(
+            time.perf_counter() - self._start_time, 6)
+        self._phase['max_rss_kb'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+        if self._trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            self._phase['traced_kb'] = current // 1024
+            self._phase['peak_traced_kb'] = peak // 1024
+        self.phases.append(self._phase)
+        self._phase = None
+
+    def get_totals(self):
+        """Return a dictionary of the phases recorded, with their
+        total time and number of queries."""
+        return {
+            'phases': self.phases,
+            'seconds': round(sum(phase['seconds'] for phase in self.phases),
+                             6),
+            'queries': sum(phase['queries'] for phase in self.phases),
+        }
+
+
+class BenchmarkExporter (Exporter):
+
+    """Exporter recording the phases of an export."""
+
+    def __init__(self, recorder):
+        super(BenchmarkExporter, self).__init__()
+        self._recorder = recorder
+
+    def _export_entities(self, entity_objects, parent_element):
+        self._recorder.start(EXPORT_ENTITIES_PHASE)
+        super(BenchmarkExporter, self)._export_entities(entity_objects,
+                                                        parent_element)
+
+    def _export_infrastructure(self, parent_element):
+        self._recorder.start(EXPORT_INFRASTRUCTURE_PHASE)
+        super(BenchmarkExporter, self)._export_infrastructure(parent_element)
+
+    def _validate(self, root):
+        self._recorder.start(VALIDATION_PHASE)
+        super(BenchmarkExporter, self)._validate(root)
+
+
+class Benchmark (object):
+
+    """Class implementing a benchmark of the import and export of an
+    EATSML document."""
+
+    def __init__(self, user, trace_memory=False):
+        self._user = user
+        self._trace_memory = trace_memory
+
+    def run(self, path):
+        """Return the results of importing the EATSML document at path
+        and exporting the entities imported, without keeping them."""
+        if self._trace_memory:
+            tracemalloc.start()
+        try:
+            with transaction.atomic():
+                results = self._run(path)
+                transaction.set_rollback(True)
+        finally:
+            if self._trace_memory:
+                tracemalloc.stop()
+        return results
+
+    def _run(self, path):
+        import_recorder = PhaseRecorder(self._trace_memory)
+        with connection.execute_wrapper(import_recorder):
+            processed_root = self._import(path, import_recorder)
+        entity_ids = [int(eats_id) for eats_id in processed_root.xpath(
+            '/e:collection/e:entities/e:entity/@eats_id', namespaces=NSMAP)]
+        del processed_root
+        export_recorder = PhaseRecorder(self._trace_memory)
+        with connection.execute_wrapper(export_recorder):
+            root = self._export(entity_ids, export_recorder)
+        exported_count = len(root.xpath(
+            '/e:collection/e:entities/e:entity', namespaces=NSMAP))
+        return {
+            'entities': len(entity_ids),
+            'exported_entities': exported_count,
+            'document_bytes': getsize(path),
+            'import': import_recorder.get_totals(),
+            'export': export_recorder.get_totals(),
+        }
+
+    def _import(self, path, recorder):
+        """Import the document at path, recording its phases with
+        recorder, and return the annotated root element."""
+        def progress(phase, count, total):
+            if not count:
+                recorder.start(phase)
+        recorder.start(PARSE_PHASE)
+        processed_root = Importer(self._user, progress).import_file(path)[1]
+        recorder.stop()
+        return processed_root
+
+    def _export(self, entity_ids, recorder):
+        """Export the entities with entity_ids, recording its phases
+        with recorder, and return the root element of the export."""
+        exporter = BenchmarkExporter(recorder)
+        root = exporter.export_entities(
+            Entity.objects.filter(pk__in=entity_ids))
+        recorder.start(SERIALISATION_PHASE)
+        with open(os.devnull, 'wb') as null_file:
+            etree.ElementTree(root).write(null_file, encoding='utf-8',
+                                          xml_declaration=True)
+        recorder.stop()
+        return root
@@ -0,0 +1,554 @@
+"""This module implements an import of an EATSML XML document into
+EATS that creates the entities and their properties in bulk.
+
+Where Importer saves each object as it is read, BulkImporter first
+resolves every XML ID in the document, and then creates the objects
+of each model together, in dependency order, within a single
+transaction. The invariants of the property assertions are validated
+together before they are created, and the search names of the new
+names are generated together at the end. The infrastructure
+elements, of which there are few, are imported as by Importer.
+
+Objects are created with bulk_create. Those whose IDs are needed,
+either to annotate the processed document or to be referenced by
+other objects, can only be created this way on databases that
+return the IDs of bulk inserted rows (such as PostgreSQL); on others
+they are inserted one at a time, though still without the work done
+by the models' save methods.
+
+An import may instead be made in a transaction for the infrastructure
+followed by one for each batch of entities, each recording a
+checkpoint of the XML ID to EATS ID mappings it made and of the last
+entity imported. An import that fails may then be resumed from the
+merge of its checkpoints, once the document has been fixed, without
+importing again the infrastructure or the entities already imported.
+A new entity related to from a batch before its own is created with
+that batch."""
+
+import logging
+
+from lxml import etree
+from django.db import connection, models, transaction
+
+from eats.models import Date, Entity, EntityNote, EntityReference, \
+    EntityRelationship, EntityRelationshipNote, EntityRelationshipType, \
+    EntityType, EntityTypeList, Existence, Name, NamePart, NamePartType, \
+    NameRelationship, NameRelationshipType, NameType, PropertyAssertion, \
+    SearchName, record_entity_changes
+import eats.names as namehandler
+from eats.eatsml.cache import increment_entity_versions
+from eats.eatsml.importer import ASSERTION_PATHS, EATS, ENTITIES_PHASE, \
+    NSMAP, RELATIONSHIPS_PHASE, EATSImportError, Importer
+
+# Number of objects to insert in a single query.
+BULK_BATCH_SIZE = 500
+
+
+def merge_checkpoints(checkpoints):
+    """Return the checkpoint to resume an import from, merging the
+    maps of checkpoints, the list of the checkpoints it saved, in the
+    order they were saved."""
+    maps = {}
+    for checkpoint in checkpoints:
+        for map_name, object_map in checkpoint['maps'].items():
+            maps.setdefault(map_name, {}).update(object_map)
+    checkpoint = dict(checkpoints[-1])
+    checkpoint['maps'] = maps
+    return checkpoint
+
+
+class BulkImporter (Importer):
+
+    """Class implementing a bulk import of an EATSML XML document
+    into EATS."""
+
+    def __init__(self, user, progress=None, batch_size=None,
+                 checkpoint=None, save_checkpoint=None):
+        """Initialise the importer.
+
+        Arguments:
+        user -- User object performing the import
+        progress -- optional function to call with the phase of the
+                    import, the number of items of it imported and
+                    the total number of them
+        batch_size -- optional number of entities to import in each
+                      transaction; if None, the whole import is made
+                      in a single transaction
+        checkpoint -- optional checkpoint of an earlier, failed,
+                      import of the document to resume from, merged
+                      from those it saved (see merge_checkpoints)
+        save_checkpoint -- optional function to call with the
+                           checkpoint, a JSON serialisable dictionary,
+                           within each transaction; its maps hold only
+                           the mappings made since the previous
+                           checkpoint
+
+        """
+        super(BulkImporter, self).__init__(user, progress)
+        self._batch_size = batch_size
+        self._checkpoint = checkpoint
+        self._save_checkpoint_function = save_checkpoint
+        # XML ID to EATS ID mappings made since the last checkpoint,
+        # keyed by map name.
+        self._new_mappings = {}
+
+    def _import_tree(self, tree):
+        if self._batch_size:
+            self._import_batches(tree)
+        else:
+            # The batches are savepoints within a single transaction.
+            with transaction.atomic():
+                self._import_batches(tree)
+
+    def _import_batches(self, tree):
+        """Import the infrastructure of XML tree, and then its
+        entities in batches, each in its own transaction."""
+        entity_elements = tree.xpath('/e:collection/e:entities/e:entity',
+                                     namespaces=NSMAP)
+        start = self._restore_checkpoint(tree, entity_elements)
+        total = len(entity_elements)
+        batch_size = self._batch_size or max(total, 1)
+        # IDs of the new Name objects, keyed by the XML ID of their
+        # assertion.
+        self._name_ids = {}
+        self._new_mappings = {}
+        with transaction.atomic():
+            self._import_infrastructure(tree)
+            self._save_checkpoint(entity_elements, start)
+        for batch_start in range(start, total, batch_size):
+            batch = entity_elements[batch_start:batch_start + batch_size]
+            with transaction.atomic():
+                self._changed_entity_ids = set()
+                self._import_entity_objects(batch)
+                self._import_related_entity_objects(
+                    batch, entity_elements[batch_start + batch_size:])
+                self._import_assertions(batch, batch_start, total)
+                # bulk_create does not send the signals that mark the
+                # cached EATSML of entities as stale and record them
+                # as changed, so do both here.
+                increment_entity_versions(self._changed_entity_ids)
+                record_entity_changes(self._changed_entity_ids)
+                self._save_checkpoint(entity_elements,
+                                      batch_start + len(batch))
+        # The entity relationships are created with the other
+        # assertions.
+        relationship_count = len(tree.xpath(
+            '/e:collection/e:entities/e:entity/'
+            'e:entity_relationship_assertions/'
+            'e:entity_relationship_assertion', namespaces=NSMAP))
+        self._report_progress(RELATIONSHIPS_PHASE, relationship_count,
+                              relationship_count)
+
+    def _restore_checkpoint(self, tree, entity_elements):
+        """Restore the maps of the checkpoint being resumed from, if
+        any, annotating the elements of XML tree that they map, and
+        return the index in entity_elements of the first entity not
+        yet imported."""
+        if self._checkpoint is None:
+            return 0
+        for map_name, object_map in self._checkpoint['maps'].items():
+            self._xml_object_map[map_name].update(object_map)
+        for element in tree.xpath('//*[@xml:id][not(@eats_id)]'):
+            map_name = etree.QName(element).localname
+            if map_name == 'name_assertion':
+                map_name = 'name'
+            eats_id = self._xml_object_map.get(
+                map_name.replace('_', ' '), {}).get(
+                    self._get_element_id(element))
+            if eats_id is not None:
+                self._add_eats_id(element, eats_id)
+        self._prefetch_objects(tree.getroot())
+        last_xml_id = self._checkpoint['entity']
+        if last_xml_id is None:
+            return 0
+        for index, entity_element in enumerate(entity_elements):
+            if self._get_element_id(entity_element) == last_xml_id:
+                return index + 1
+        raise EATSImportError(
+            'The last entity imported before the checkpoint, with XML ID '
+            '%s, is not in the document' % (last_xml_id))
+
+    def _save_checkpoint(self, entity_elements, count):
+        """Pass a checkpoint of the import, with count of
+        entity_elements imported, to the save_checkpoint function, if
+        any."""
+        if self._save_checkpoint_function is None:
+            return
+        last_xml_id = None
+        if count:
+            last_xml_id = self._get_element_id(entity_elements[count - 1])
+        # Passing only the new mappings keeps the cost of each
+        # checkpoint to that of its batch.
+        self._save_checkpoint_function({'maps': self._new_mappings,
+                                        'entity': last_xml_id,
+                                        'count': count})
+        self._new_mappings = {}
+
+    def _create_mapping(self, map_name, xml_id, object_id):
+        super(BulkImporter, self)._create_mapping(map_name, xml_id,
+                                                  object_id)
+        self._new_mappings.setdefault(map_name, {})[xml_id] = object_id
+
+    def _import_related_entity_objects(self, entity_elements,
+                                       later_elements):
+        """Create the new entities of later_elements that are related
+        to from entity_elements, so that the relationships may be
+        created with their batch."""
+        related_xml_ids = set()
+        for entity_element in entity_elements:
+            related_xml_ids.update(entity_element.xpath(
+                'e:entity_relationship_assertions/'
+                'e:entity_relationship_assertion/@related_entity',
+                namespaces=NSMAP))
+        related_elements = [
+            entity_element for entity_element in later_elements
+            if self._get_element_id(entity_element) in related_xml_ids]
+        related_elements = [
+            entity_element for entity_element in related_elements
+            if not self._get_element_eats_id(entity_element)]
+        if related_elements:
+            self._import_entity_objects(related_elements)
+
+    def _import_entity_objects(self, entity_elements):
+        """Create the new entities of entity_elements, and map the XML
+        IDs of all of them."""
+        item_name = 'entity'
+        self._log_start_items(item_name)
+        new_elements = []
+        for entity_element in entity_elements:
+            xml_id = self._get_element_id(entity_element)
+            eats_id = self._get_element_eats_id(entity_element)
+            if eats_id:
+                self._check_object_exists(Entity, eats_id, xml_id)
+                self._create_mapping(item_name, xml_id, eats_id)
+            else:
+                new_elements.append(entity_element)
+        entity_objects = [Entity() for entity_element in new_elements]
+        self._insert(Entity, entity_objects)
+        for entity_element, entity_object in zip(new_elements,
+                                                 entity_objects):
+            self._add_eats_id(entity_element, entity_object.id)
+            self._changed_entity_ids.add(entity_object.id)
+            self._create_mapping(item_name,
+                                 self._get_element_id(entity_element),
+                                 entity_object.id)
+
+    def _import_assertions(self, entity_elements, start=0, total=None):
+        """Create the new property assertions of entity_elements, with
+        their properties, name parts, notes and dates.
+
+        Arguments:
+        entity_elements -- list of entity elements
+        start -- number of the document's entities preceding
+                 entity_elements, for the report of progress
+        total -- total number of the document's entities, if not
+                 those of entity_elements
+
+        """
+        # Each new assertion, as a tuple of its element, the name of
+        # its property field, its property object and the assertion
+        # object.
+        new_assertions = []
+        # Elements of the assertions that already exist, with the
+        # assertion objects.
+        existing_assertions = []
+        # Progress is reported as the entities are read, and they are
+        # only complete once their objects have been created.
+        if total is None:
+            total = len(entity_elements)
+        for count, entity_element in enumerate(entity_elements, start):
+            self._report_progress(ENTITIES_PHASE, count, total)
+            entity_id = self._get_element_eats_id(entity_element)
+            for field, path in ASSERTION_PATHS:
+                for element in entity_element.xpath(path, namespaces=NSMAP):
+                    self._log_xml(field, element)
+                    xml_id = self._get_element_id(element)
+                    eats_id = self._get_element_eats_id(element)
+                    if eats_id:
+                        assertion_object = self._check_object_exists(
+                            PropertyAssertion, eats_id, xml_id, entity_id,
+                            field)
+                        existing_assertions.append((element,
+                                                    assertion_object))
+                        if field == 'name':
+                            self._create_mapping('name', xml_id, eats_id)
+                        continue
+                    authority_record_id = self._get_referenced_eats_id(
+                        element, 'authority_record')
+                    self._check_add_permission(record=authority_record_id)
+                    property_object = getattr(self, '_get_%s' % (field))(
+                        element, authority_record_id, xml_id)
+                    assertion_object = PropertyAssertion(
+                        entity_id=entity_id,
+                        authority_record_id=authority_record_id,
+                        is_preferred=self._get_boolean(element,
+                                                       'is_preferred'))
+                    new_assertions.append((element, field, property_object,
+                                           assertion_object))
+        # The objects are created together, so a failure cannot be
+        # attributed to the last element read.
+        self._current_element = None
+        self._insert_properties(new_assertions)
+        self._insert_assertions(new_assertions)
+        self._import_dependent_objects(new_assertions)
+        assertions = [(element, assertion_object) for element, field,
+                      property_object, assertion_object in new_assertions]
+        self._import_date_objects(assertions + existing_assertions)
+        self._create_search_names([
+            property_object for element, field, property_object,
+            assertion_object in new_assertions if field == 'name'])
+        self._report_progress(ENTITIES_PHASE, start + len(entity_elements),
+                              total)
+
+    def _insert_properties(self, new_assertions):
+        """Create the property objects of new_assertions, a model at a
+        time, and relate the assertion objects to them."""
+        for field, path in ASSERTION_PATHS:
+            assertions = [(element, property_object, assertion_object)
+                          for element, assertion_field, property_object,
+                          assertion_object in new_assertions
+                          if assertion_field == field]
+            if not assertions:
+                continue
+            if field == 'name_relationship':
+                # The names are now all known.
+                for element, property_object, assertion_object in assertions:
+                    property_object.name_id = self._get_name_id(
+                        element, 'name')
+                    property_object.related_name_id = self._get_name_id(
+                        element, 'related_name')
+            property_objects = [property_object for element,
+                                property_object, assertion_object
+                                in assertions]
+            self._insert(type(property_objects[0]), property_objects)
+            for element, property_object, assertion_object in assertions:
+                setattr(assertion_object, field + '_id', property_object.id)
+                if field == 'name':
+                    self._name_ids[self._get_element_id(element)] = \
+                        property_object.id
+
+    def _insert_assertions(self, new_assertions):
+        """Validate and create the assertion objects of
+        new_assertions, and annotate their elements."""
+        assertion_objects = [assertion_object for element, field,
+                             property_object, assertion_object
+                             in new_assertions]
+        invalid = self._assertion_validator.get_invalid_assertions(
+            assertion_objects)
+        if invalid:
+            for element, field, property_object, assertion_object in \
+                    new_assertions:
+                if assertion_object is invalid[0]:
+                    raise EATSImportError(
+                        'Could not save %s assertion %s' % (
+                            field.replace('_', ' '),
+                            self._get_element_id(element)))
+        self._insert(PropertyAssertion, assertion_objects)
+        for element, field, property_object, assertion_object in \
+                new_assertions:
+            self._add_eats_id(element, assertion_object.id)
+            if field == 'name':
+                self._create_mapping('name', self._get_element_id(element),
+                                     assertion_object.id)
+            self._changed_entity_ids.add(assertion_object.entity_id)
+            if field == 'entity_relationship':
+                # The related entity's EATSML records which entities
+                # relate to it.
+                self._changed_entity_ids.add(property_object.related_entity_id)
+
+    def _import_dependent_objects(self, new_assertions):
+        """Create the name parts of the new names, and the notes of
+        the new entity relationships, of new_assertions."""
+        part_objects = []
+        note_objects = []
+        for element, field, property_object, assertion_object in \
+                new_assertions:
+            if field == 'name':
+                part_objects.extend(self._get_name_parts(
+                    element, property_object.id,
+                    assertion_object.authority_record_id))
+            elif field == 'entity_relationship':
+                note_objects.extend(self._get_entity_relationship_notes(
+                    element, property_object.id))
+        NamePart.objects.bulk_create(part_objects, batch_size=BULK_BATCH_SIZE)
+        EntityRelationshipNote.objects.bulk_create(
+            note_objects, batch_size=BULK_BATCH_SIZE)
+
+    def _import_date_objects(self, assertions):
+        """Create the new dates of assertions, a list of tuples of
+        assertion element and PropertyAssertion object."""
+        item_name = 'date'
+        date_elements = []
+        date_objects = []
+        for assertion_element, assertion_object in assertions:
+            for date_element in assertion_element.xpath('e:dates/e:date',
+                                                        namespaces=NSMAP):
+                self._log_xml(item_name, date_element)
+                xml_id = self._get_element_id(date_element)
+                eats_id = self._get_element_eats_id(date_element)
+                if eats_id:
+                    self._check_object_exists(Date, eats_id, xml_id)
+                    continue
+                date_elements.append(date_element)
+                date_objects.append(self._get_date(date_element,
+                                                   assertion_object.id))
+                self._changed_entity_ids.add(assertion_object.entity_id)
+        self._insert(Date, date_objects)
+        for date_element, date_object in zip(date_elements, date_objects):
+            self._add_eats_id(date_element, date_object.id)
+
+    def _create_search_names(self, name_objects):
+        """Create the search names of the new name_objects."""
+        name_objects = Name.objects.filter(
+            pk__in=[name_object.id for name_object in name_objects])\
+            .select_related('assertion', 'language', 'script')\
+            .prefetch_related(models.Prefetch(
+                'name_parts', queryset=NamePart.objects.select_related(
+                    'name_part_type__system_name_part_type').order_by('pk')))
+        search_names = []
+        for name_object in name_objects:
+            for search_form in name_object.get_search_forms():
+                search_names.append(SearchName(
+                    entity_id=name_object.assertion.entity_id,
+                    name=name_object, name_form=search_form))
+        SearchName.objects.bulk_create(search_names,
+                                       batch_size=BULK_BATCH_SIZE)
+
+    def _get_existence(self, element, authority_record_id, xml_id):
+        return Existence()
+
+    def _get_entity_type(self, element, authority_record_id, xml_id):
+        entity_type_id = self._get_referenced_eats_id(element, 'entity_type')
+        self._check_type_authority(entity_type_id, EntityTypeList,
+                                   authority_record_id, xml_id)
+        return EntityType(entity_type_id=entity_type_id)
+
+    def _get_note(self, element, authority_record_id, xml_id):
+        return EntityNote(note=self._get_text_from_XML(element, 'e:note'),
+                          is_internal=self._get_boolean(element,
+                                                        'is_internal'))
+
+    def _get_reference(self, element, authority_record_id, xml_id):
+        return EntityReference(
+            url=self._get_text_from_XML(element, 'e:url'),
+            label=self._get_text_from_XML(element, 'e:label'))
+
+    def _get_name(self, element, authority_record_id, xml_id):
+        name_type_id = self._get_referenced_eats_id(element, 'type',
+                                                    'name type')
+        self._check_type_authority(name_type_id, NameType,
+                                   authority_record_id, xml_id)
+        display_form = self._get_text_from_XML(element, 'e:display_form')
+        return Name(name_type_id=name_type_id,
+                    language_id=self._get_referenced_eats_id(element,
+                                                             'language'),
+                    script_id=self._get_referenced_eats_id(element, 'script'),
+                    display_form=namehandler.clean_name(display_form))
+
+    def _get_entity_relationship(self, element, authority_record_id,
+                                 xml_id):
+        relationship_type_id = self._get_referenced_eats_id(
+            element, 'type', 'entity relationship type')
+        self._check_type_authority(relationship_type_id,
+                                   EntityRelationshipType,
+                                   authority_record_id, xml_id)
+        return EntityRelationship(
+            related_entity_id=self._get_referenced_eats_id(
+                element, 'related_entity', 'entity'),
+            entity_relationship_type_id=relationship_type_id)
+
+    def _get_name_relationship(self, element, authority_record_id, xml_id):
+        relationship_type_id = self._get_referenced_eats_id(
+            element, 'type', 'name relationship type')
+        self._check_type_authority(relationship_type_id,
+                                   NameRelationshipType,
+                                   authority_record_id, xml_id)
+        # The names are set once they have been created.
+        return NameRelationship(name_relationship_type_id=relationship_type_id)
+
+    def _get_name_id(self, element, attribute_name):
+        """Return the ID of the Name object of the name assertion
+        referenced in attribute_name on element."""
+        xml_id = element.get(attribute_name)
+        if xml_id in self._name_ids:
+            return self._name_ids[xml_id]
+        assertion_id = self._get_referenced_eats_id(element, attribute_name,
+                                                    'name')
+        return self._get_name_id_from_assertion_id(assertion_id)
+
+    def _get_name_parts(self, name_element, name_id, authority_record_id):
+        """Return a list of the unsaved NamePart objects of the name
+        with name_id from name_element."""
+        item_name = 'name part'
+        part_objects = []
+        for part_element in name_element.xpath('e:name_parts/e:name_part',
+                                               namespaces=NSMAP):
+            self._log_xml(item_name, part_element)
+            type_id = self._get_referenced_eats_id(part_element, 'type',
+                                                   'name part type')
+            self._check_type_authority(type_id, NamePartType,
+                                       authority_record_id, '')
+            name_part = self._get_text_from_XML(part_element, '.')
+            part_objects.append(NamePart(
+                name_id=name_id, name_part_type_id=type_id,
+                language_id=self._get_referenced_eats_id(part_element,
+                                                         'language'),
+                script_id=self._get_referenced_eats_id(part_element,
+                                                       'script'),
+                name_part=namehandler.clean_name(name_part)))
+        return part_objects
+
+    def _get_entity_relationship_notes(self, relationship_element,
+                                       relationship_id):
+        """Return a list of the unsaved EntityRelationshipNote objects
+        of the relationship with relationship_id from
+        relationship_element."""
+        item_name = 'entity relationship note'
+        note_objects = []
+        for note_element in relationship_element.xpath(
+                'e:entity_relationship_notes/e:entity_relationship_note',
+                namespaces=NSMAP):
+            self._log_xml(item_name, note_element)
+            note_objects.append(EntityRelationshipNote(
+                is_internal=self._get_boolean(note_element, 'is_internal'),
+                note=note_element.text,
+                entity_relationship_id=relationship_id))
+        return note_objects
+
+    def _get_date(self, date_element, assertion_id):
+        """Return an unsaved Date object for assertion_id from
+        date_element."""
+        date_data = {'assertion_id': assertion_id}
+        date_data['date_period_id'] = self._get_referenced_eats_id(
+            date_element, 'period', 'date period')
+        for child in date_element:
+            if child.tag == EATS + 'assembled_form':
+                continue
+            date_type = child.get('type')
+            date_data[date_type] = child.xpath(
+                'e:raw', namespaces=NSMAP)[0].text
+            date_data[date_type + '_normalised'] = child.xpath(
+                'e:normalised', namespaces=NSMAP)[0].text
+            date_data[date_type + '_calendar_id'] = \
+                self._get_referenced_eats_id(child, 'calendar')
+            date_data[date_type + '_type_id'] = \
+                self._get_referenced_eats_id(child, 'date_type')
+            date_data[date_type + '_confident'] = self._get_boolean(
+                child, 'confident')
+        return Date(**date_data)
+
+    @staticmethod
+    def _insert(model, model_objects):
+        """Insert the unsaved model_objects, setting their IDs.
+
+        On databases that cannot return the IDs of bulk inserted
+        rows, the objects are inserted one at a time, bypassing the
+        model's save method."""
+        if connection.features.can_return_ids_from_bulk_insert:
+            model.objects.bulk_create(model_objects,
+                                      batch_size=BULK_BATCH_SIZE)
+        else:
+            for model_object in model_objects:
+                models.Model.save(model_object, force_insert=True)
+        logging.debug('Created %d %s objects'
+                      % (len(model_objects), model._meta.object_name))
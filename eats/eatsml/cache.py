@@ -0,0 +1,246 @@
+"""This module implements the versioning of the cached EATSML of
+individual entities, and of the infrastructure elements.
+
+The EATSML of an entity is cached under a key that includes a version
+number for the entity and a version number for EATS as a whole.
+Changing an entity's data increments the entity's version; changing
+data that is shared between entities, or changing data in bulk,
+increments the global version. The versions are incremented only once
+the transaction making the change is committed, so that EATSML built
+by a reader from the data before the commit is not cached under the
+new version. Nor is anything cached by a transaction that has changed
+data whose versions are yet to be incremented, since the transaction
+may yet be rolled back. Stale EATSML is therefore never read, and is
+left to expire from the cache.
+
+The infrastructure elements are cached under a key that includes a
+version number of their own, incremented whenever an infrastructure
+object is changed.
+
+A document built from the EATSML of a set of entities, such as a
+transform, includes their infrastructure, and so is cached under a
+key that includes the versions of the entities, the global version
+and the infrastructure version.
+
+A dataset version, incremented once a transaction changing any of the
+entities or infrastructure is committed, identifies the data as a
+whole, so that an export of unchanged data may be reused. Like the
+cached EATSML, it relies on the cache being shared by every process
+that changes the data."""
+
+import hashlib
+import time
+import weakref
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+KEY_PREFIX = 'eats-eatsml'
+GLOBAL_VERSION_KEY = '%s-version' % (KEY_PREFIX)
+ENTITY_VERSION_KEY = '%s-version-entity-%d'
+FRAGMENT_KEY = '%s-entity-%d-%d-%d-%s'
+DOCUMENT_KEY = '%s-document-%s-%d-%d-%s'
+INFRASTRUCTURE_VERSION_KEY = '%s-version-infrastructure' % (KEY_PREFIX)
+INFRASTRUCTURE_KEY = '%s-infrastructure-%d-%s'
+DATASET_VERSION_KEY = '%s-version-dataset' % (KEY_PREFIX)
+
+# Number of seconds for which an entity's EATSML is cached.
+DEFAULT_FRAGMENT_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def get_fragment_timeout():
+    """Return the number of seconds for which an entity's EATSML is
+    cached."""
+    return getattr(settings, 'EATS_EATSML_CACHE_TIMEOUT',
+                   DEFAULT_FRAGMENT_TIMEOUT)
+
+
+def _new_version():
+    # A version key that has been evicted from the cache must not be
+    # recreated with a number it has had before, or EATSML cached
+    # under that number would be read again. Start from the time.
+    return int(time.time() * 1000)
+
+
+def _increment_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key is not in the cache.
+        cache.add(key, _new_version(), None)
+
+
+def _increment_on_commit(keys):
+    # Until the transaction is committed, a reader would not see the
+    # changes, and what it cached under the new version would be
+    # stale; so the versions are incremented only after the commit.
+    def increment():
+        for key in keys:
+            _increment_version(key)
+    connection = transaction.get_connection()
+    # The connection keeps only weak references to the pending
+    # increments, which are otherwise referenced only by the
+    # transaction's commit callbacks, and so are dropped when it is
+    # committed or rolled back.
+    pending = getattr(connection, 'eats_cache_increments', None)
+    if pending is None:
+        pending = connection.eats_cache_increments = weakref.WeakSet()
+    pending.add(increment)
+    transaction.on_commit(increment)
+
+
+def can_cache():
+    """Return True if what is read from the data in the current
+    transaction may be cached.
+
+    It may not be if the transaction has changed data whose versions
+    are yet to be incremented, since it would be cached under the old
+    versions and read by others even if the transaction were rolled
+    back.
+
+    """
+    connection = transaction.get_connection()
+    return not getattr(connection, 'eats_cache_increments', None)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = _new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_global_version():
+    """Return the current global version number."""
+    return _get_version(GLOBAL_VERSION_KEY)
+
+
+def increment_global_version():
+    """Mark the cached EATSML of all entities as stale, once the
+    current transaction, if any, is committed."""
+    _increment_on_commit([GLOBAL_VERSION_KEY, DATASET_VERSION_KEY])
+
+
+def get_infrastructure_version():
+    """Return the current version number of the infrastructure
+    elements."""
+    return _get_version(INFRASTRUCTURE_VERSION_KEY)
+
+
+def increment_infrastructure_version():
+    """Mark the cached infrastructure elements as stale, once the
+    current transaction, if any, is committed."""
+    _increment_on_commit([INFRASTRUCTURE_VERSION_KEY, DATASET_VERSION_KEY])
+
+
+def get_dataset_version():
+    """Return the current version number of the dataset."""
+    return _get_version(DATASET_VERSION_KEY)
+
+
+def increment_dataset_version():
+    """Mark the exports of the dataset as stale, once the current
+    transaction, if any, is committed."""
+    _increment_on_commit([DATASET_VERSION_KEY])
+
+
+def get_infrastructure_key(variant):
+    """Return the key under which the infrastructure elements are
+    cached.
+
+    Arguments:
+    variant -- string distinguishing the different selections of
+               infrastructure elements that may be exported
+
+    """
+    return INFRASTRUCTURE_KEY % (KEY_PREFIX, get_infrastructure_version(),
+                                 variant)
+
+
+def get_entity_versions(entity_ids):
+    """Return a dictionary of the current version numbers of the
+    entities with IDs entity_ids, keyed by entity ID."""
+    keys = dict((ENTITY_VERSION_KEY % (KEY_PREFIX, entity_id), entity_id)
+                for entity_id in entity_ids)
+    cached_versions = cache.get_many(keys.keys())
+    versions = {}
+    new_versions = {}
+    for key, entity_id in keys.items():
+        if key in cached_versions:
+            versions[entity_id] = cached_versions[key]
+        else:
+            versions[entity_id] = new_versions[key] = _new_version()
+    if new_versions:
+        cache.set_many(new_versions, None)
+    return versions
+
+
+def increment_entity_versions(entity_ids):
+    """Mark the cached EATSML of the entities with IDs entity_ids as
+    stale, once the current transaction, if any, is committed."""
+    keys = [ENTITY_VERSION_KEY % (KEY_PREFIX, entity_id)
+            for entity_id in set(entity_ids)]
+    if keys:
+        _increment_on_commit(keys + [DATASET_VERSION_KEY])
+
+
+def get_fragment_keys(entity_ids, variant):
+    """Return a dictionary of the keys under which the EATSML of the
+    entities with IDs entity_ids is cached, keyed by entity ID.
+
+    Arguments:
+    entity_ids -- list of entity IDs
+    variant -- string distinguishing the different forms of EATSML
+               an entity may be exported in
+
+    """
+    global_version = get_global_version()
+    versions = get_entity_versions(entity_ids)
+    return dict((entity_id, FRAGMENT_KEY % (
+        KEY_PREFIX, entity_id, versions[entity_id], global_version, variant))
+        for entity_id in entity_ids)
+
+
+def get_fragments(keys):
+    """Return a dictionary of the cached EATSML fragments stored under
+    keys, keyed by cache key."""
+    return cache.get_many(keys)
+
+
+def set_fragments(fragments):
+    """Cache fragments, a dictionary of EATSML fragments keyed by
+    cache key."""
+    if fragments and can_cache():
+        cache.set_many(fragments, get_fragment_timeout())
+
+
+def get_document_key(entity_ids, variant):
+    """Return the key under which a document built from the data of
+    the entities with IDs entity_ids is cached.
+
+    Arguments:
+    entity_ids -- list of entity IDs
+    variant -- string distinguishing the different documents built
+               from the same entities
+
+    """
+    versions = get_entity_versions(entity_ids)
+    entity_versions = ','.join('%d:%d' % (entity_id, versions[entity_id])
+                               for entity_id in sorted(versions))
+    digest = hashlib.sha1(entity_versions.encode('utf-8')).hexdigest()
+    return DOCUMENT_KEY % (KEY_PREFIX, digest, get_global_version(),
+                           get_infrastructure_version(), variant)
+
+
+def get_document(key):
+    """Return the document cached under key, or None."""
+    return cache.get(key)
+
+
+def set_document(key, document):
+    """Cache document under key."""
+    if can_cache():
+        cache.set(key, document, get_fragment_timeout())
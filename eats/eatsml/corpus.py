@@ -0,0 +1,466 @@
+"""This module generates synthetic EATSML documents, for measuring the
+import and export of data at scale.
+
+A corpus has a fixed infrastructure of a few authorities, each with
+its own types, and a given number of entities. The number of names,
+name parts, dates, notes, references and relationships of each entity
+is drawn at random with the distributions given by the constants
+below, which are modelled on the data of the projects using EATS: most
+entities have a single authority record and one or two names, while a
+few have many. The same seed always generates the same document.
+
+The languages, scripts and system name part types of a corpus are
+ones EATS has rules for, so that its names are assembled as real
+names are; where these already exist in the database, the corpus
+refers to them by EATS ID (see get_existing_ids). The names of the
+other infrastructure are chosen so as not to clash with data already
+in EATS, but the authority system IDs are not, so a corpus should
+only be imported once into a database.
+
+The document is written entity by entity, so that a corpus of any
+size may be generated without holding it in memory."""
+
+import random
+
+from lxml import etree
+
+from eats.models import Language, Script, SystemNamePartType
+from eats.eatsml.importer import EATS, EATS_NAMESPACE, XML
+
+# Number of authorities, each of which has its own types.
+AUTHORITY_COUNT = 3
+
+# Languages and scripts, as (name, code) pairs. Names in every
+# language are in the first script.
+LANGUAGES = (('English', 'en'), ('French', 'fre'))
+SCRIPTS = (('Latin', 'Latn'),)
+
+# Entity types, with the proportion of entities of each.
+ENTITY_TYPES = (('person', 0.6), ('place', 0.25), ('organisation', 0.15))
+
+ENTITY_RELATIONSHIP_TYPES = ('is related to', 'lived in', 'is member of')
+NAME_TYPES = ('regular', 'pseudonym')
+NAME_PART_TYPES = ('given', 'family')
+NAME_RELATIONSHIP_TYPES = ('is a transliteration of',)
+CALENDARS = ('Gregorian', 'Julian')
+DATE_PERIODS = ('lifespan', 'floruit')
+DATE_TYPES = ('exact', 'circa')
+
+# Probability of an entity having an authority record from each
+# further authority, besides that of its first record.
+EXTRA_RECORD_PROBABILITY = 0.2
+
+# Probability of a further name for an entity, after each name; the
+# number of names is geometrically distributed, up to MAXIMUM_NAMES.
+EXTRA_NAME_PROBABILITY = 0.4
+MAXIMUM_NAMES = 8
+
+# Probability of a given name having a second word.
+SECOND_GIVEN_NAME_PROBABILITY = 0.3
+
+# Probabilities of the optional properties of an entity, and of an
+# assertion having a date.
+EXISTENCE_DATE_PROBABILITY = 0.5
+NAME_DATE_PROBABILITY = 0.1
+RELATIONSHIP_DATE_PROBABILITY = 0.3
+NOTE_PROBABILITY = 0.2
+REFERENCE_PROBABILITY = 0.1
+NAME_RELATIONSHIP_PROBABILITY = 0.1
+
+# Mean number of relationships an entity has to other entities.
+RELATIONSHIPS_PER_ENTITY = 0.5
+
+# Syllables from which names are made.
+SYLLABLES = ('al', 'an', 'bel', 'cor', 'dan', 'el', 'fen', 'gar', 'hol',
+             'is', 'jor', 'kel', 'lin', 'mar', 'nor', 'or', 'pel', 'quin',
+             'ros', 'sen', 'tor', 'ul', 'val', 'wen', 'yr', 'zan')
+
+# Range of years of the dates generated.
+FIRST_YEAR = 1500
+LAST_YEAR = 2000
+
+
+def generate_corpus(output, entity_count, seed=0, existing_ids=None):
+    """Write a synthetic EATSML document with entity_count entities to
+    output.
+
+    Arguments:
+    output -- filename or binary file to write to
+    entity_count -- number of entities to generate
+    seed -- optional seed for the random choices made
+    existing_ids -- optional dictionary of the EATS IDs of existing
+                    languages, scripts and system name part types,
+                    as returned by get_existing_ids
+
+    """
+    CorpusGenerator(entity_count, seed, existing_ids).write(output)
+
+
+def get_existing_ids():
+    """Return a dictionary of the EATS IDs of the languages, scripts
+    and system name part types of a corpus that are already in the
+    database, keyed by element name and then by code or name."""
+    return {
+        'language': dict(Language.objects.filter(
+            language_code__in=[code for name, code in LANGUAGES])
+            .values_list('language_code', 'id')),
+        'script': dict(Script.objects.filter(
+            script_code__in=[code for name, code in SCRIPTS])
+            .values_list('script_code', 'id')),
+        'system_name_part_type': dict(SystemNamePartType.objects.filter(
+            name_part_type__in=NAME_PART_TYPES)
+            .values_list('name_part_type', 'id')),
+    }
+
+
+class CorpusGenerator (object):
+
+    """Class implementing the generation of a synthetic EATSML
+    document."""
+
+    def __init__(self, entity_count, seed=0, existing_ids=None):
+        self._entity_count = entity_count
+        self._existing_ids = existing_ids or {}
+        self._random = random.Random(seed)
+        self._assertion_count = 0
+        self._date_count = 0
+
+    def write(self, output):
+        """Write the document to output, a filename or binary file."""
+        with etree.xmlfile(output, encoding='utf-8') as xml_file:
+            xml_file.write_declaration()
+            with xml_file.element(EATS + 'collection',
+                                  nsmap={None: EATS_NAMESPACE}):
+                for element in self._get_infrastructure():
+                    xml_file.write(element, pretty_print=True)
+                # The authority records are written before the
+                # entities that reference them, so the records of
+                # each entity are drawn in advance.
+                records = [self._get_entity_authorities(index)
+                           for index in range(1, self._entity_count + 1)]
+                xml_file.write(self._get_authority_records(records),
+                               pretty_print=True)
+                with xml_file.element(EATS + 'entities'):
+                    for index, authorities in enumerate(records, 1):
+                        xml_file.write(self._get_entity(index, authorities),
+                                       pretty_print=True)
+
+    def _get_infrastructure(self):
+        """Return the elements of the infrastructure of the document,
+        other than its authority records."""
+        authorities = etree.Element(EATS + 'authorities')
+        for number in range(1, AUTHORITY_COUNT + 1):
+            authority = etree.SubElement(authorities, EATS + 'authority')
+            authority.set(XML + 'id', 'authority-%d' % (number))
+            authority.set('is_default', self._get_boolean(number == 1))
+            authority.set('default_calendar', 'calendar-1')
+            authority.set('default_date_period', 'date_period-1')
+            authority.set('default_date_type', 'date_type-1')
+            authority.set('default_language', 'language-1')
+            authority.set('default_script', 'script-1')
+            self._add_text(authority, 'name', 'Corpus authority %d' % (number))
+            self._add_text(authority, 'abbreviated_name', 'CA%d' % (number))
+            self._add_text(authority, 'base_id', '')
+            self._add_text(authority, 'base_url',
+                           'http://authority-%d.example.org/' % (number))
+        elements = [authorities]
+        elements.append(self._get_authority_types(
+            'entity_type', [name for name, proportion in ENTITY_TYPES]))
+        elements.append(self._get_authority_types(
+            'entity_relationship_type', ENTITY_RELATIONSHIP_TYPES,
+            unique=True))
+        name_types = self._get_authority_types('name_type', NAME_TYPES)
+        for name_type in name_types:
+            name_type.set('is_default', self._get_boolean(
+                name_type.text == NAME_TYPES[0]))
+        elements.append(name_types)
+        system_types = etree.Element(EATS + 'system_name_part_types')
+        for number, name in enumerate(NAME_PART_TYPES, 1):
+            system_type = etree.SubElement(system_types,
+                                           EATS + 'system_name_part_type')
+            system_type.set(XML + 'id', 'system_name_part_type-%d' % (number))
+            self._set_existing_id(system_type, name)
+            self._add_text(system_type, 'name', name)
+            self._add_text(system_type, 'description', '')
+        elements.append(system_types)
+        part_types = self._get_authority_types('name_part_type',
+                                               NAME_PART_TYPES)
+        for index, part_type in enumerate(part_types):
+            part_type.set('system_name_part_type', 'system_name_part_type-%d'
+                          % (index % len(NAME_PART_TYPES) + 1))
+        elements.append(part_types)
+        languages = etree.Element(EATS + 'languages')
+        for number, (name, code) in enumerate(LANGUAGES, 1):
+            language = etree.SubElement(languages, EATS + 'language')
+            language.set(XML + 'id', 'language-%d' % (number))
+            self._set_existing_id(language, code)
+            self._add_text(language, 'name', name)
+            self._add_text(language, 'code', code)
+            language_types = etree.SubElement(
+                language, EATS + 'system_name_part_types')
+            for type_number in range(1, len(NAME_PART_TYPES) + 1):
+                etree.SubElement(
+                    language_types, EATS + 'system_name_part_type',
+                    ref='system_name_part_type-%d' % (type_number))
+        elements.append(languages)
+        scripts = etree.Element(EATS + 'scripts')
+        for number, (name, code) in enumerate(SCRIPTS, 1):
+            script = etree.SubElement(scripts, EATS + 'script')
+            script.set(XML + 'id', 'script-%d' % (number))
+            self._set_existing_id(script, code)
+            self._add_text(script, 'name', name)
+            self._add_text(script, 'code', code)
+        elements.append(scripts)
+        elements.append(self._get_authority_types(
+            'name_relationship_type', NAME_RELATIONSHIP_TYPES))
+        for item_name, names in (('date_period', DATE_PERIODS),
+                                 ('date_type', DATE_TYPES),
+                                 ('calendar', CALENDARS)):
+            items = etree.Element(EATS + item_name + 's')
+            for number, name in enumerate(names, 1):
+                item = self._add_text(items, item_name, name)
+                item.set(XML + 'id', '%s-%d' % (item_name, number))
+            elements.append(items)
+        return elements
+
+    def _set_existing_id(self, element, key):
+        """Set the EATS ID of element to that of the existing object
+        with the code or name key, if there is one."""
+        eats_id = self._existing_ids.get(etree.QName(element).localname,
+                                         {}).get(key)
+        if eats_id:
+            element.set('eats_id', str(eats_id))
+
+    def _get_authority_types(self, item_name, names, unique=False):
+        """Return an element containing an item_name element for each
+        of names for each authority. If unique is True, the names are
+        made unique to each authority."""
+        items = etree.Element(EATS + item_name + 's')
+        for authority in range(1, AUTHORITY_COUNT + 1):
+            for number, name in enumerate(names, 1):
+                if unique:
+                    name = '%s (corpus authority %d)' % (name, authority)
+                item = self._add_text(items, item_name, name)
+                item.set(XML + 'id', '%s-%d-%d'
+                         % (item_name, authority, number))
+                item.set('authority', 'authority-%d' % (authority))
+        return items
+
+    def _get_entity_authorities(self, index):
+        """Return the list of the numbers of the authorities with a
+        record of the entity numbered index."""
+        authorities = [self._random.randint(1, AUTHORITY_COUNT)]
+        for authority in range(1, AUTHORITY_COUNT + 1):
+            if authority not in authorities and \
+                    self._random.random() < EXTRA_RECORD_PROBABILITY:
+                authorities.append(authority)
+        return authorities
+
+    def _get_authority_records(self, records):
+        """Return the authority_records element for the records of
+        each entity, listed in records."""
+        records_element = etree.Element(EATS + 'authority_records')
+        for index, authorities in enumerate(records, 1):
+            for authority in authorities:
+                record = etree.SubElement(records_element,
+                                          EATS + 'authority_record')
+                record.set(XML + 'id', self._get_record_id(index, authority))
+                record.set('authority', 'authority-%d' % (authority))
+                system_id = self._add_text(record, 'authority_system_id',
+                                           'corpus-%06d' % (index))
+                system_id.set('is_complete', 'true')
+                system_url = self._add_text(record, 'authority_system_url',
+                                            '')
+                system_url.set('is_complete', 'false')
+        return records_element
+
+    def _get_entity(self, index, authorities):
+        """Return the entity element for the entity numbered index,
+        with records from authorities."""
+        entity_type = self._choose_entity_type()
+        entity = etree.Element(EATS + 'entity')
+        entity.set(XML + 'id', 'entity-%d' % (index))
+        records = [(self._get_record_id(index, authority), authority)
+                   for authority in authorities]
+        # Every record makes an existence assertion, so that its other
+        # assertions are valid.
+        existences = etree.SubElement(entity, EATS + 'existence_assertions')
+        for record, authority in records:
+            existence = self._add_assertion(existences, 'existence', record,
+                                            record == records[0][0])
+            if self._random.random() < EXISTENCE_DATE_PROBABILITY:
+                self._add_date(existence, span=entity_type == 1)
+        entity_types = etree.SubElement(entity,
+                                        EATS + 'entity_type_assertions')
+        for record, authority in records:
+            self._add_assertion(
+                entity_types, 'entity_type', record, record == records[0][0],
+                entity_type='entity_type-%d-%d' % (authority, entity_type))
+        record, authority = records[0]
+        if self._random.random() < NOTE_PROBABILITY:
+            notes = etree.SubElement(entity, EATS + 'entity_note_assertions')
+            note = self._add_assertion(notes, 'entity_note', record, True,
+                                       is_internal='false')
+            self._add_text(note, 'note', 'A note about %s.' % (
+                self._get_word().capitalize()))
+        if self._random.random() < REFERENCE_PROBABILITY:
+            references = etree.SubElement(
+                entity, EATS + 'entity_reference_assertions')
+            reference = self._add_assertion(references, 'entity_reference',
+                                            record, True)
+            self._add_text(reference, 'label', 'Corpus reference')
+            self._add_text(reference, 'url', 'http://authority-%d.example'
+                           '.org/corpus-%06d' % (authority, index))
+        name_ids = self._add_names(entity, records, entity_type)
+        self._add_entity_relationships(entity, index, record, authority)
+        if len(name_ids) > 1 and \
+                self._random.random() < NAME_RELATIONSHIP_PROBABILITY:
+            relationships = etree.SubElement(
+                entity, EATS + 'name_relationship_assertions')
+            self._add_assertion(
+                relationships, 'name_relationship', record, False,
+                type='name_relationship_type-%d-1' % (authority),
+                name=name_ids[1], related_name=name_ids[0])
+        return entity
+
+    def _add_names(self, entity, records, entity_type):
+        """Add name assertions to entity, by the records (as (XML ID,
+        authority number) pairs), and return the XML IDs of those
+        made by the first record."""
+        names = etree.SubElement(entity, EATS + 'name_assertions')
+        name_ids = []
+        count = 1
+        while count < MAXIMUM_NAMES and \
+                self._random.random() < EXTRA_NAME_PROBABILITY:
+            count += 1
+        for number in range(count):
+            # The first name of each record is in the default
+            # language, and is its preferred name.
+            record, authority = records[number % len(records)]
+            is_first = number < len(records)
+            language = 1 if is_first else self._random.randint(
+                1, len(LANGUAGES))
+            name = self._add_assertion(
+                names, 'name', record, is_first,
+                type='name_type-%d-%d' % (authority, 1 if is_first else
+                                          self._random.randint(
+                                              1, len(NAME_TYPES))),
+                language='language-%d' % (language), script='script-1')
+            if record == records[0][0]:
+                name_ids.append(name.get(XML + 'id'))
+            if entity_type == 1:
+                # Personal names are made of a given and family name.
+                given = self._get_word().capitalize()
+                if self._random.random() < SECOND_GIVEN_NAME_PROBABILITY:
+                    given += ' ' + self._get_word().capitalize()
+                family = self._get_word(3).capitalize()
+                self._add_text(name, 'display_form', '')
+                parts = etree.SubElement(name, EATS + 'name_parts')
+                for type_number, text in enumerate((given, family), 1):
+                    part = self._add_text(parts, 'name_part', text)
+                    part.set('type', 'name_part_type-%d-%d'
+                             % (authority, type_number))
+                self._add_text(name, 'assembled_form',
+                               '%s %s' % (given, family))
+            else:
+                self._add_text(name, 'display_form', ' '.join(
+                    self._get_word().capitalize() for word in
+                    range(self._random.randint(1, 3))))
+                self._add_text(name, 'assembled_form', '')
+            if self._random.random() < NAME_DATE_PROBABILITY:
+                self._add_date(name)
+        return name_ids
+
+    def _add_entity_relationships(self, entity, index, record, authority):
+        """Add relationships from entity, numbered index, to other
+        entities, by record of authority."""
+        count = 0
+        while self._random.random() < RELATIONSHIPS_PER_ENTITY / (
+                1 + RELATIONSHIPS_PER_ENTITY):
+            count += 1
+        if self._entity_count < 2 or not count:
+            return
+        relationships = etree.SubElement(
+            entity, EATS + 'entity_relationship_assertions')
+        for number in range(count):
+            related_index = index
+            while related_index == index:
+                related_index = self._random.randint(1, self._entity_count)
+            relationship = self._add_assertion(
+                relationships, 'entity_relationship', record, False,
+                type='entity_relationship_type-%d-%d' % (
+                    authority, self._random.randint(
+                        1, len(ENTITY_RELATIONSHIP_TYPES))),
+                related_entity='entity-%d' % (related_index))
+            if self._random.random() < RELATIONSHIP_DATE_PROBABILITY:
+                self._add_date(relationship)
+
+    def _add_assertion(self, parent, field, record, is_preferred,
+                       **attributes):
+        """Add to parent, and return, a field assertion element by
+        record, with the additional attributes."""
+        self._assertion_count += 1
+        assertion = etree.SubElement(parent, EATS + field + '_assertion')
+        assertion.set(XML + 'id', '%s_assertion-%d'
+                      % (field, self._assertion_count))
+        assertion.set('authority_record', record)
+        assertion.set('is_preferred', self._get_boolean(is_preferred))
+        for name, value in attributes.items():
+            assertion.set(name, value)
+        return assertion
+
+    def _add_date(self, assertion, span=False):
+        """Add a date to assertion, which is a span of years if span
+        is True, and otherwise a start date."""
+        self._date_count += 1
+        dates = etree.SubElement(assertion, EATS + 'dates')
+        date = etree.SubElement(dates, EATS + 'date')
+        date.set(XML + 'id', 'date-%d' % (self._date_count))
+        date.set('period', 'date_period-%d'
+                 % (self._random.randint(1, len(DATE_PERIODS))))
+        start = self._random.randint(FIRST_YEAR, LAST_YEAR)
+        parts = [('start_date', start)]
+        if span:
+            parts.append(('end_date', start + self._random.randint(20, 90)))
+        for part_type, year in parts:
+            part = etree.SubElement(date, EATS + 'date_part')
+            part.set('type', part_type)
+            part.set('calendar', 'calendar-1')
+            part.set('date_type', 'date_type-%d'
+                     % (self._random.randint(1, len(DATE_TYPES))))
+            part.set('confident', 'true')
+            self._add_text(part, 'raw', str(year))
+            self._add_text(part, 'normalised', str(year))
+        self._add_text(date, 'assembled_form', ' – '.join(
+            str(year) for part_type, year in parts))
+
+    def _choose_entity_type(self):
+        """Return the number of an entity type, chosen in the
+        proportions of ENTITY_TYPES."""
+        value = self._random.random()
+        for number, (name, proportion) in enumerate(ENTITY_TYPES, 1):
+            value -= proportion
+            if value < 0:
+                break
+        return number
+
+    def _get_word(self, maximum=2):
+        """Return a word of one to maximum syllables."""
+        return ''.join(self._random.choice(SYLLABLES) for syllable in
+                       range(self._random.randint(1, maximum)))
+
+    @staticmethod
+    def _get_record_id(index, authority):
+        return 'authority_record-%d-%d' % (index, authority)
+
+    @staticmethod
+    def _add_text(parent, name, text):
+        """Add to parent, and return, a name element containing
+        text."""
+        element = etree.SubElement(parent, EATS + name)
+        element.text = text
+        return element
+
+    @staticmethod
+    def _get_boolean(value):
+        return 'true' if value else 'false'
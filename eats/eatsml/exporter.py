@@ -2,17 +2,22 @@
 
 import logging
 from os.path import abspath, dirname, join
+import shutil
 
 from lxml import etree
-from django.db.models import Q
+from django.db.models import Prefetch, Q
 from django.db.models.query import QuerySet
 from eats.models import UserProfile
 
-from eats.models import Authority, AuthorityRecord, Calendar, \
-    DatePeriod, DateType, Entity, EntityRelationshipType, EntityTypeList, \
-    Language, NamePartType, NameRelationshipType, NameType, PropertyAssertion, \
-    Script, SystemNamePartType
+from eats.models import Authority, AuthorityRecord, Calendar, Date, \
+    DatePeriod, DateType, Entity, EntityRelationship, EntityRelationshipType, \
+    EntityType, EntityTypeList, Language, Name, NamePart, NamePartType, \
+    NameRelationship, NameRelationshipType, NameType, PropertyAssertion, \
+    Script, SystemNamePartType, get_default_object
 import eats.names
+from eats.eatsml.cache import get_document, get_fragment_keys, \
+    get_fragments, get_infrastructure_key, set_document, set_fragments
+from eats.eatsml.schema import get_relaxng, should_validate_export
 
 # Full path to this directory.
 PATH = abspath(dirname(__file__))
@@ -23,9 +28,6 @@ LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
 FILE_LOG = join(PATH, 'export.log')
 FILE_MODE = 'w'
 
-# RelaxNG schema.
-RNG_FILENAME = 'eatsml.rng'
-RNG_PATH = join(PATH, RNG_FILENAME)
 # Path for where to save export if it is invalid.
 INVALID_FILE_PATH = join(PATH, 'invalid-export.xml')
 
@@ -44,6 +46,23 @@ NSMAP = {None: EATS_NAMESPACE}
 # Number of entities to export at a time (for memory saving purposes).
 BATCH_NUMBER = 1000
 
+# UserProfile fields naming the user's preferred infrastructure
+# objects, each of which is also the prefix of the XML IDs of the
+# objects of its type.
+USER_PREFERENCES = ('authority', 'calendar', 'date_period', 'date_type',
+                    'language', 'name_type', 'script')
+
+# Objects to fetch along with each property assertion of a batch of
+# entities, so that exporting an entity requires no further queries.
+ASSERTION_RELATED_FIELDS = (
+    'authority_record', 'existence', 'entity_type', 'note', 'reference',
+    'name__language', 'name__script', 'entity_relationship',
+    'name_relationship__name__assertion',
+    'name_relationship__related_name__assertion')
+DATE_RELATED_FIELDS = ('date_period',) + tuple(
+    date_part + suffix for date_part in DATE_PARTS
+    for suffix in ('_calendar', '_type'))
+
 
 class EATSExportError (Exception):
 
@@ -51,11 +70,60 @@ class EATSExportError (Exception):
     pass
 
 
+class StreamBuffer (object):
+
+    """File-like object that collects the output of an lxml xmlfile
+    until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def drain(self):
+        """Return the data written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def get_related_entity_ids(primary_ids):
+    """Return a QuerySet of the IDs of the entities that are the
+    subject or object of an entity relationship with one of the
+    entities in primary_ids.
+
+    Arguments:
+    primary_ids -- list or QuerySet of entity IDs
+
+    """
+    related_ids = EntityRelationship.objects.filter(
+        assertion__entity__in=primary_ids).values('related_entity')
+    relating_ids = PropertyAssertion.objects.filter(
+        entity_relationship__related_entity__in=primary_ids)\
+        .values('entity')
+    return Entity.objects.filter(
+        Q(pk__in=related_ids) | Q(pk__in=relating_ids)).values('pk')
+
+
 class Exporter (object):
 
     """Class implementing an export of EATS data into EATSML XML."""
 
-    def __init__(self):
+    def __init__(self, for_read=False, prune=False):
+        """Initialise the exporter.
+
+        Arguments:
+        for_read -- optional Boolean indicating if the export is made
+                    for one of the public read views, which may be
+                    exempted from validation by the
+                    EATS_EXPORT_VALIDATION setting
+        prune -- optional Boolean indicating if the EATSML export of
+                 entities should leave out the infrastructure data
+                 that the entities do not reference, as the
+                 remove-redundant-eatsml-*.xsl transformations do
+
+        """
         try:
             logging.basicConfig(level=LOG_LEVEL,
                                 filename=FILE_LOG,
@@ -63,11 +131,11 @@ class Exporter (object):
                                 format=LOG_FORMAT)
         except IOError as e:
             raise EATSExportError('Failed to set up logging: %s' % e)
-        # Keep a list of the IDs of those entities that are to be
+        # Keep a set of the IDs of those entities that are to be
         # fully exported. Other, referenced, entities should not
         # export entity relationship assertions that point to entities
-        # not in this list.
-        self._primary_entity_ids = []
+        # not in this set.
+        self._primary_entity_ids = set()
         # As the entities to be exported are processed, the
         # infrastructural objects they reference are tracked via their
         # IDs in the object_list dictionary. Sets are used because
@@ -89,11 +157,19 @@ class Exporter (object):
             'Script': set(),
             'SystemNamePartType': set(),
         }
+        # The property assertions of the batch of entities being
+        # exported, and the IDs of the entities that have a
+        # relationship to each of them, keyed by entity ID.
+        self._entity_assertions = {}
+        self._relating_entity_ids = {}
+        self._default_calendar = None
         self._user = None
         self._user_profile = None
         self._XML_true = self._get_XML_boolean(True)
         self._annotated = False
         self._full_details = False
+        self._for_read = for_read
+        self._prune = prune
 
     def set_user(self, user):
         """Set the user for this export.
@@ -103,7 +179,7 @@ class Exporter (object):
 
         """
         self._user = user
-        if user.is_authenticated():
+        if user.is_authenticated:
             self._user_profile = UserProfile.objects.get(user=user)
 
     def export_entities(self, entity_objects, annotated=False,
@@ -134,10 +210,46 @@ class Exporter (object):
             self._export_entities(entity_objects, root)
             self._export_infrastructure(root)
         logging.info('Finished compiling XML')
-        self._validate(root)
+        if should_validate_export(self._for_read):
+            self._validate(root)
         logging.info('Finished export')
         return root
 
+    def stream_entities(self, entity_objects, annotated=False,
+                        full_details=False, progress=None):
+        """Return an iterator over the UTF-8 encoded chunks of an XML
+        document containing the exported entities.
+
+        Unlike export_entities, the document is written incrementally,
+        and no more than BATCH_NUMBER entities or authority records
+        are held in memory at once. The infrastructure elements are
+        determined in advance from the database, and are written
+        before the entities. Since the document is never held in full,
+        it is not validated.
+
+        Arguments:
+        entity_objects -- list or QuerySet of Entity objects
+        annotated -- optional Boolean indicating if the data exported
+                     should be annotated with the user's preferences
+        full_details -- optional Boolean indicating if non-standard
+                        data should be exported, such as all
+                        constructed name forms
+        progress -- optional callable, called with the number of
+                    primary entities written so far after each batch
+
+        """
+        if annotated and self._user_profile is None:
+            message = 'A user must be specified if the export is to be ' \
+                'annotated'
+            logging.error(message)
+            raise EATSExportError(message)
+        self._annotated = annotated
+        self._full_details = full_details
+        if not isinstance(entity_objects, QuerySet):
+            entity_objects = Entity.objects.filter(
+                pk__in=[entity_object.id for entity_object in entity_objects])
+        return self._stream_entities(entity_objects, progress)
+
     def export_infrastructure(self, limited=False, annotated=False):
         """Return the root element of an XML tree containing the
         export of infrastructure elements.
@@ -153,13 +265,43 @@ class Exporter (object):
             message = 'A user must be specified if the export is to be limited or annotated'
             logging.error(message)
             raise EATSExportError(message)
-        self._annotated = annotated
+        # The un-annotated export is cached, for each set of editable
+        # authorities, until an infrastructure object is changed; the
+        # user's preferences are then marked on a copy of it.
         if limited:
-            editable_authorities = self._user_profile.editable_authorities.all()
+            authority_ids = sorted(
+                self._user_profile.editable_authorities.values_list(
+                    'pk', flat=True))
+            variant = ','.join([str(authority_id) for authority_id
+                                in authority_ids])
         else:
-            editable_authorities = Authority.objects.all()
-        editable_authorities_ids = editable_authorities.values('pk').query
-        authority_filter = Q(authority__in=editable_authorities_ids)
+            authority_ids = None
+            variant = 'all'
+        key = get_infrastructure_key(variant)
+        xml = get_document(key)
+        if xml is None:
+            root = self._build_infrastructure(authority_ids)
+            set_document(key, etree.tostring(root))
+        else:
+            root = etree.fromstring(xml)
+        self._annotated = annotated
+        if annotated:
+            self._annotate_infrastructure(root)
+        return root
+
+    def _build_infrastructure(self, authority_ids):
+        """Return the root element of an XML tree containing the
+        un-annotated export of infrastructure elements.
+
+        Arguments:
+        authority_ids -- list of the IDs of the authorities to limit
+                         the export to, or None for all authorities
+
+        """
+        self._annotated = False
+        if authority_ids is None:
+            authority_ids = Authority.objects.values('pk').query
+        authority_filter = Q(authority__in=authority_ids)
         # Record the IDs of infrastructure objects, restricting them
         # by the editable authorities where appropriate.
         object_types = [
@@ -185,41 +327,403 @@ class Exporter (object):
                 self._object_list[key].add(eats_object.id)
         root = etree.Element(EATS + 'collection', nsmap=NSMAP)
         self._export_infrastructure(root)
-        self._validate(root)
+        if should_validate_export(self._for_read):
+            self._validate(root)
         return root
 
+    def _annotate_infrastructure(self, root):
+        """Mark the user's preferred infrastructure objects in the
+        export with root as root element."""
+        for object_type in USER_PREFERENCES:
+            object_id = getattr(self._user_profile, object_type + '_id')
+            if object_id is None:
+                continue
+            for element in root.xpath('//*[@xml:id = $id]', id='%s-%d' % (
+                    object_type, object_id)):
+                element.set('user_default', self._XML_true)
+
+    def export_fragment(self, entity_objects, fragment_file,
+                        full_details=False):
+        """Write the XML of entity_objects, exported as primary
+        entities, to fragment_file, and return a dictionary of sets of
+        the IDs of the objects they reference, keyed by model name.
+
+        The fragment is a sequence of entity elements, which
+        write_fragments assembles, along with those of other
+        fragments, into a document. Related entities are not exported;
+        the fragments of a full export between them contain every
+        entity.
+
+        Arguments:
+        entity_objects -- list or QuerySet of Entity objects
+        fragment_file -- file object opened for writing bytes
+        full_details -- optional Boolean indicating if non-standard
+                        data should be exported, such as all
+                        constructed name forms
+
+        """
+        self._full_details = full_details
+        for entity_batch in self._get_batches(entity_objects):
+            entities_element = etree.Element(EATS + 'entities', nsmap=NSMAP)
+            self._export_primary_entities(entity_batch, entities_element)
+            for entity_element in entities_element:
+                fragment_file.write(etree.tostring(entity_element,
+                                                   encoding='utf-8'))
+        return self._object_list
+
+    def write_fragments(self, xml_file, fragment_paths, object_lists):
+        """Write an XML document containing the entities in the
+        fragments at fragment_paths to xml_file.
+
+        Arguments:
+        xml_file -- file object opened for writing bytes
+        fragment_paths -- list of paths of non-empty files written by
+                          export_fragment, in document order
+        object_lists -- list of the dictionaries of referenced
+                        object IDs returned by export_fragment
+
+        """
+        for object_list in object_lists:
+            for model_name, ids in object_list.items():
+                self._object_list[model_name].update(ids)
+        xml_file.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        xml_file.write(('<collection xmlns="%s">' % EATS_NAMESPACE).encode(
+            'utf-8'))
+        if fragment_paths:
+            infrastructure = etree.Element(EATS + 'collection', nsmap=NSMAP)
+            self._export_infrastructure_types(infrastructure)
+            self._write_fragment_children(xml_file, infrastructure)
+            ids = sorted(self._object_list['AuthorityRecord'])
+            if ids:
+                xml_file.write(b'<authority_records>')
+            for record_batch in self._get_batches(ids):
+                records_element = etree.Element(EATS + 'authority_records',
+                                                nsmap=NSMAP)
+                for record_object in AuthorityRecord.objects.filter(
+                        pk__in=record_batch).order_by('pk'):
+                    self._export_authority_record(record_object,
+                                                  records_element)
+                self._write_fragment_children(xml_file, records_element)
+            if ids:
+                xml_file.write(b'</authority_records>')
+            xml_file.write(b'<entities>')
+            for fragment_path in fragment_paths:
+                with open(fragment_path, 'rb') as fragment_file:
+                    shutil.copyfileobj(fragment_file, xml_file)
+            xml_file.write(b'</entities>')
+        xml_file.write(b'</collection>')
+
     def _export_entities(self, entity_objects, parent_element):
         """Export entity objects, attaching their XML nodes to parent."""
         # It is too memory expensive to deal with all entities at
         # once, if there are many of them, so do them in batches.
-        if isinstance(entity_objects, QuerySet):
-            count = entity_objects.count()
-        else:
-            count = len(entity_objects)
-        logging.info('Exporting %d entities' % (count))
+        logging.info('Exporting entities')
         entities_element = etree.SubElement(parent_element, EATS + 'entities')
-        for lower_bound in range(0, count, BATCH_NUMBER):
-            upper_bound = lower_bound + BATCH_NUMBER
+        exported = 0
+        for entity_batch in self._get_batches(entity_objects):
             logging.info('Exporting entities %d to %d'
-                         % (lower_bound, upper_bound))
-            for entity_object in entity_objects[lower_bound:upper_bound]:
-                self._primary_entity_ids.append(entity_object.id)
-                self._export_entity(entity_object, entities_element)
+                         % (exported, exported + len(entity_batch)))
+            self._export_primary_entities(entity_batch, entities_element)
+            exported += len(entity_batch)
         # We may have picked up some extra entities from the entity
         # relationships defined for an entity, so export those now.
-        ids = tuple(self._object_list['Entity'])
-        new_entity_objects = Entity.objects.filter(pk__in=ids)
-        count = new_entity_objects.count()
-        logging.info('Exporting potentially %d new entities' % (count))
-        for lower_bound in range(0, count, BATCH_NUMBER):
+        ids = sorted(self._object_list['Entity'] - self._primary_entity_ids)
+        logging.info('Exporting potentially %d new entities' % (len(ids)))
+        for lower_bound in range(0, len(ids), BATCH_NUMBER):
             upper_bound = lower_bound + BATCH_NUMBER
             logging.info('Exporting potentially new entities %d to %d'
                          % (lower_bound, upper_bound))
-            for entity_object in new_entity_objects[lower_bound:upper_bound]:
-                if entity_object not in entity_objects:
-                    self._export_entity(entity_object, entities_element, False)
+            entity_batch = list(Entity.objects.filter(
+                pk__in=ids[lower_bound:upper_bound]).order_by('pk'))
+            self._prefetch_entities(entity_batch)
+            for entity_object in entity_batch:
+                self._export_entity(entity_object, entities_element, False)
         return
 
+    def _stream_entities(self, entity_objects, progress=None):
+        """Generate the chunks of the XML document for the export of
+        entity_objects."""
+        logging.info('Starting streamed export')
+        primary_ids = entity_objects.values('pk')
+        related_ids = get_related_entity_ids(primary_ids)
+        entity_ids = Entity.objects.filter(
+            Q(pk__in=primary_ids) | Q(pk__in=related_ids)).values('pk')
+        record_objects = self._collect_infrastructure_ids(entity_ids,
+                                                          primary_ids)
+        buffer = StreamBuffer()
+        with etree.xmlfile(buffer, encoding='utf-8') as xml_file:
+            xml_file.write_declaration()
+            with xml_file.element(EATS + 'collection', nsmap=NSMAP):
+                if entity_objects.exists():
+                    infrastructure = etree.Element(EATS + 'collection',
+                                                   nsmap=NSMAP)
+                    self._export_infrastructure_types(infrastructure)
+                    self._write_children(xml_file, infrastructure)
+                    yield buffer.drain()
+                    with xml_file.element(EATS + 'authority_records'):
+                        for record_batch in self._get_batches(record_objects):
+                            records_element = etree.Element(
+                                EATS + 'authority_records', nsmap=NSMAP)
+                            for record_object in record_batch:
+                                self._export_authority_record(
+                                    record_object, records_element)
+                            self._write_children(xml_file, records_element)
+                            yield buffer.drain()
+                    with xml_file.element(EATS + 'entities'):
+                        exported = 0
+                        for entity_batch in self._get_batches(entity_objects):
+                            self._write_entities(xml_file, entity_batch)
+                            exported += len(entity_batch)
+                            if progress is not None:
+                                progress(exported)
+                            yield buffer.drain()
+                        related_objects = Entity.objects.filter(
+                            pk__in=related_ids).exclude(pk__in=primary_ids)
+                        for entity_batch in self._get_batches(related_objects):
+                            # Relationships of related entities are only
+                            # exported if they point to a primary entity.
+                            batch_relationships = EntityRelationship.objects\
+                                .filter(assertion__entity__in=entity_batch)\
+                                .values('related_entity')
+                            self._primary_entity_ids = set(
+                                entity_objects.filter(
+                                    pk__in=batch_relationships)
+                                .values_list('pk', flat=True))
+                            self._write_entities(xml_file, entity_batch,
+                                                 False)
+                            yield buffer.drain()
+        logging.info('Finished streamed export')
+        yield buffer.drain()
+
+    def _write_entities(self, xml_file, entity_objects, is_primary=True):
+        """Write the export of entity_objects to xml_file."""
+        entities_element = etree.Element(EATS + 'entities', nsmap=NSMAP)
+        if is_primary:
+            self._export_primary_entities(entity_objects, entities_element)
+        else:
+            self._prefetch_entities(entity_objects)
+            for entity_object in entity_objects:
+                self._export_entity(entity_object, entities_element, False)
+        self._write_children(xml_file, entities_element)
+        # The referenced objects have already been written, so there
+        # is no need to keep track of them.
+        for ids in self._object_list.values():
+            ids.clear()
+
+    @staticmethod
+    def _write_children(xml_file, element):
+        """Write the children of element to xml_file, and flush it."""
+        for child in element:
+            xml_file.write(child, pretty_print=True)
+        xml_file.flush()
+
+    def _export_primary_entities(self, entity_objects, parent_element):
+        """Export entity_objects as primary entities, attaching their
+        XML nodes to parent_element.
+
+        The XML of each entity is cached, along with the IDs of the
+        objects it references, under a key that changes whenever the
+        entity's data does. Only those entities not in the cache are
+        exported afresh, and they are prefetched together.
+
+        Arguments:
+        entity_objects -- list of Entity objects
+        parent_element -- Element object
+
+        """
+        keys = get_fragment_keys(
+            [entity_object.id for entity_object in entity_objects],
+            self._get_fragment_variant())
+        fragments = get_fragments(keys.values())
+        new_fragments = {}
+        missing_objects = [entity_object for entity_object in entity_objects
+                           if keys[entity_object.id] not in fragments]
+        if missing_objects:
+            self._prefetch_entities(missing_objects)
+        object_list = self._object_list
+        for entity_object in entity_objects:
+            self._primary_entity_ids.add(entity_object.id)
+            key = keys[entity_object.id]
+            if key in fragments:
+                xml, object_ids = fragments[key]
+                parent_element.append(etree.fromstring(xml))
+            else:
+                # Track the objects referenced by this entity alone.
+                self._object_list = dict(
+                    (model_name, set()) for model_name in object_list)
+                try:
+                    self._export_entity(entity_object, parent_element)
+                finally:
+                    object_ids = dict(
+                        (model_name, list(ids)) for model_name, ids
+                        in self._object_list.items() if ids)
+                    self._object_list = object_list
+                new_fragments[key] = (etree.tostring(parent_element[-1]),
+                                      object_ids)
+            for model_name, ids in object_ids.items():
+                object_list[model_name].update(ids)
+        set_fragments(new_fragments)
+
+    def _get_fragment_variant(self):
+        """Return a string identifying the options of this export
+        that affect the XML of a primary entity."""
+        variant = 'full' if self._full_details else 'standard'
+        if self._annotated:
+            variant = '%s-%d-%d-%d' % (
+                variant, self._user_profile.authority_id,
+                self._user_profile.language_id, self._user_profile.script_id)
+        return variant
+
+    @staticmethod
+    def _write_fragment_children(xml_file, element):
+        """Write the serialised children of element to xml_file."""
+        for child in element:
+            xml_file.write(etree.tostring(child, encoding='utf-8'))
+
+    @staticmethod
+    def _get_batches(model_objects):
+        """Generate lists of up to BATCH_NUMBER objects from
+        model_objects, in their order.
+
+        Each batch of an unordered QuerySet, or one ordered by primary
+        key, is fetched in order of primary key with a query for the
+        objects following the last one in the previous batch, rather
+        than with an offset, so that fetching a batch does not get
+        slower the further into the QuerySet it is. A QuerySet in any
+        other order keeps it, and is fetched by offset.
+
+        Arguments:
+        model_objects -- list or QuerySet of model objects
+
+        """
+        if not isinstance(model_objects, QuerySet):
+            for lower_bound in range(0, len(model_objects), BATCH_NUMBER):
+                upper_bound = lower_bound + BATCH_NUMBER
+                yield list(model_objects[lower_bound:upper_bound])
+            return
+        if model_objects.ordered and \
+                tuple(model_objects.query.order_by) not in (('pk',), ('id',)):
+            lower_bound = 0
+            batch = list(model_objects[:BATCH_NUMBER])
+            while batch:
+                yield batch
+                lower_bound += BATCH_NUMBER
+                batch = list(model_objects[
+                    lower_bound:lower_bound + BATCH_NUMBER])
+            return
+        model_objects = model_objects.order_by('pk')
+        batch = list(model_objects[:BATCH_NUMBER])
+        while batch:
+            yield batch
+            batch = list(model_objects.filter(
+                pk__gt=batch[-1].pk)[:BATCH_NUMBER])
+
+    def _collect_infrastructure_ids(self, entity_ids, primary_ids):
+        """Record the IDs of the infrastructure objects referenced by
+        the entities in entity_ids, and return a QuerySet of the
+        referenced AuthorityRecord objects.
+
+        The IDs are gathered with one query per type of reference,
+        rather than by exporting the entities first. Those referenced
+        only by the dates of relationships that are not exported are
+        included, unless the export is pruned.
+
+        Arguments:
+        entity_ids -- QuerySet of the IDs of all exported entities
+        primary_ids -- QuerySet of the IDs of the primary entities
+
+        """
+        existences = PropertyAssertion.objects.filter(
+            entity__in=entity_ids, existence__isnull=False)
+        self._object_list['Authority'].update(
+            existences.values_list('authority_record__authority', flat=True)
+            .distinct())
+        self._object_list['EntityTypeList'].update(
+            EntityType.objects.filter(assertion__entity__in=entity_ids)
+            .values_list('entity_type', flat=True).distinct())
+        # Relationships are only exported if either entity is primary.
+        relationship_filter = Q(assertion__entity__in=primary_ids)
+        relationship_filter |= Q(related_entity__in=primary_ids)
+        self._object_list['EntityRelationshipType'].update(
+            EntityRelationship.objects.filter(relationship_filter)
+            .values_list('entity_relationship_type', flat=True).distinct())
+        self._object_list['NameRelationshipType'].update(
+            NameRelationship.objects.filter(assertion__entity__in=entity_ids)
+            .values_list('name_relationship_type', flat=True).distinct())
+        name_objects = Name.objects.filter(assertion__entity__in=entity_ids)
+        for type_id, language_id, script_id in name_objects.values_list(
+                'name_type', 'language', 'script').distinct():
+            self._object_list['NameType'].add(type_id)
+            self._object_list['Language'].add(language_id)
+            self._object_list['Script'].add(script_id)
+        part_objects = NamePart.objects.filter(name__in=name_objects)
+        for type_id, language_id, script_id in part_objects.values_list(
+                'name_part_type', 'language', 'script').distinct():
+            self._object_list['NamePartType'].add(type_id)
+            if language_id:
+                self._object_list['Language'].add(language_id)
+            if script_id:
+                self._object_list['Script'].add(script_id)
+        date_objects = Date.objects.filter(assertion__entity__in=entity_ids)
+        if self._prune:
+            date_filter = Q(assertion__entity_relationship__isnull=True)
+            date_filter |= Q(assertion__entity__in=primary_ids)
+            date_filter |= Q(
+                assertion__entity_relationship__related_entity__in=primary_ids)
+            date_objects = date_objects.filter(date_filter)
+        self._object_list['DatePeriod'].update(
+            date_objects.values_list('date_period', flat=True).distinct())
+        for date_part in DATE_PARTS:
+            part_ids = date_objects.exclude(**{date_part: ''}).values_list(
+                date_part + '_calendar', date_part + '_type').distinct()
+            for calendar_id, type_id in part_ids:
+                self._object_list['Calendar'].add(calendar_id)
+                self._object_list['DateType'].add(type_id)
+        return AuthorityRecord.objects.filter(
+            pk__in=existences.values('authority_record'))
+
+    def _prefetch_entities(self, entity_objects):
+        """Fetch the property assertions of entity_objects, and the
+        objects associated with them, with a fixed number of queries,
+        and group them by entity."""
+        entity_ids = [entity_object.id for entity_object in entity_objects]
+        self._entity_assertions = {}
+        assertion_objects = PropertyAssertion.objects.filter(
+            entity__in=entity_ids).select_related(
+                *ASSERTION_RELATED_FIELDS).prefetch_related(
+                    Prefetch('dates', queryset=Date.objects.select_related(
+                        *DATE_RELATED_FIELDS).order_by('pk')),
+                    Prefetch('name__name_parts',
+                             queryset=NamePart.objects.select_related(
+                                 'name_part_type__system_name_part_type')
+                             .order_by('pk')),
+                    'name__notes', 'entity_relationship__notes')\
+            .order_by('pk')
+        for assertion_object in assertion_objects:
+            self._entity_assertions.setdefault(
+                assertion_object.entity_id, []).append(assertion_object)
+        self._relating_entity_ids = {}
+        relating_ids = PropertyAssertion.objects.filter(
+            entity_relationship__related_entity__in=entity_ids).values_list(
+                'entity_relationship__related_entity', 'entity')
+        for related_entity_id, entity_id in relating_ids:
+            self._relating_entity_ids.setdefault(
+                related_entity_id, []).append(entity_id)
+
+    def _get_default_calendar(self):
+        """Return the system-wide default Calendar object."""
+        if self._default_calendar is None:
+            self._default_calendar = get_default_object(Calendar)
+        return self._default_calendar
+
+    def _get_assertions(self, entity_object, property_name):
+        """Return the prefetched assertions of entity_object that are
+        of the property property_name."""
+        attribute = property_name + '_id'
+        return [assertion_object for assertion_object in
+                self._entity_assertions.get(entity_object.id, [])
+                if getattr(assertion_object, attribute) is not None]
+
     def _export_entity(self, entity_object, parent_element, is_primary=True):
         """Export Entity object.
 
@@ -252,8 +756,7 @@ class Exporter (object):
         """Export Existence property assertions for entity_object."""
         model_name = 'Existence'
         self._log_start_objects(model_name)
-        assertion_objects = PropertyAssertion.objects.filter(
-            entity=entity_object, existence__isnull=False)
+        assertion_objects = self._get_assertions(entity_object, 'existence')
         if len(assertion_objects):
             existences_element = etree.SubElement(parent_element,
                                                   EATS + 'existence_assertions')
@@ -276,8 +779,7 @@ class Exporter (object):
         """Export EntityType property assertions for entity_object."""
         model_name = 'EntityType'
         self._log_start_objects(model_name)
-        assertion_objects = PropertyAssertion.objects.filter(
-            entity=entity_object, entity_type__isnull=False)
+        assertion_objects = self._get_assertions(entity_object, 'entity_type')
         if len(assertion_objects):
             types_element = etree.SubElement(parent_element,
                                              EATS + 'entity_type_assertions')
@@ -299,8 +801,7 @@ class Exporter (object):
         """Export EntityNote property assertions for entity_object."""
         model_name = 'EntityNote'
         self._log_start_objects(model_name)
-        assertion_objects = PropertyAssertion.objects.filter(
-            entity=entity_object, note__isnull=False)
+        assertion_objects = self._get_assertions(entity_object, 'note')
         if len(assertion_objects):
             notes_element = etree.SubElement(parent_element,
                                              EATS + 'entity_note_assertions')
@@ -321,8 +822,7 @@ class Exporter (object):
         """Export EntityReference property assertions for entity_object."""
         model_name = 'EntityReference'
         self._log_start_objects(model_name)
-        assertion_objects = PropertyAssertion.objects.filter(
-            entity=entity_object, reference__isnull=False)
+        assertion_objects = self._get_assertions(entity_object, 'reference')
         if len(assertion_objects):
             references_element = etree.SubElement(parent_element, EATS +
                                                   'entity_reference_assertions')
@@ -345,8 +845,7 @@ class Exporter (object):
         """Export Name property assertions for entity_object."""
         model_name = 'Name'
         self._log_start_objects(model_name)
-        assertion_objects = PropertyAssertion.objects.filter(
-            entity=entity_object, name__isnull=False)
+        assertion_objects = self._get_assertions(entity_object, 'name')
         if len(assertion_objects):
             names_element = etree.SubElement(parent_element,
                                              EATS + 'name_assertions')
@@ -444,8 +943,8 @@ class Exporter (object):
         """Export EntityRelationship property assertions for entity_object."""
         model_name = 'EntityRelationship'
         self._log_start_objects(model_name)
-        assertion_objects = PropertyAssertion.objects.filter(
-            entity=entity_object, entity_relationship__isnull=False)
+        assertion_objects = self._get_assertions(entity_object,
+                                                 'entity_relationship')
         relationships_element = None
         for assertion_object in assertion_objects:
             entity_id = assertion_object.entity_relationship.related_entity_id
@@ -478,9 +977,8 @@ class Exporter (object):
             # Find all entities that have this entity as a related
             # entity, and add them to the list of entities to be
             # exported.
-            for entity in Entity.objects.filter(
-                    assertions__entity_relationship__related_entity=entity_object):
-                self._object_list['Entity'].add(entity.id)
+            self._object_list['Entity'].update(
+                self._relating_entity_ids.get(entity_object.id, []))
         return
 
     def _export_entity_relationship_notes(self, relationship_object,
@@ -505,8 +1003,8 @@ class Exporter (object):
         """Export NameRelationship property assertions for entity_object."""
         model_name = 'NameRelationship'
         self._log_start_objects(model_name)
-        assertion_objects = PropertyAssertion.objects.filter(
-            entity=entity_object, name_relationship__isnull=False)
+        assertion_objects = self._get_assertions(entity_object,
+                                                 'name_relationship')
         if len(assertion_objects):
             relationships_element = etree.SubElement(
                 parent_element, EATS + 'name_relationship_assertions')
@@ -522,10 +1020,11 @@ class Exporter (object):
             relationship_element.set('type', 'name_relationship_type-%d'
                                      % (type_id))
             self._object_list['NameRelationshipType'].add(type_id)
-            name_assertion = assertion_object.name_relationship.name.assertion.get()
+            name_assertion = assertion_object.name_relationship.name.assertion
             relationship_element.set('name', 'name_assertion-%d' %
                                      (name_assertion.id))
-            related_name_assertion = assertion_object.name_relationship.related_name.assertion.get()
+            related_name_assertion = \
+                assertion_object.name_relationship.related_name.assertion
             relationship_element.set('related_name', 'name_assertion-%d' %
                                      (related_name_assertion.id))
         return
@@ -554,7 +1053,8 @@ class Exporter (object):
                     note_element.text = date_object.note
                 assembled_form_element = etree.SubElement(
                     date_element, EATS + 'assembled_form')
-                assembled_form_element.text = str(date_object)
+                assembled_form_element.text = date_object.get_assembled_form(
+                    self._get_default_calendar())
         return
 
     def _export_date_part(self, date_object, date_part, parent_element):
@@ -602,6 +1102,16 @@ class Exporter (object):
         """Export those types of objects that serve as 'static' material
         referenced by the entities. Only referenced objects of each type
         are exported."""
+        self._export_infrastructure_types(parent_element)
+        self._export_authority_records(parent_element)
+        # The schema requires that Entities go last, so move them there.
+        if parent_element[0].tag == EATS + 'entities':
+            parent_element.append(parent_element[0])
+        return
+
+    def _export_infrastructure_types(self, parent_element):
+        """Export the referenced infrastructure objects other than
+        authority records."""
         self._export_authorities(parent_element)
         self._export_entity_types_list(parent_element)
         self._export_entity_relationship_types(parent_element)
@@ -620,10 +1130,6 @@ class Exporter (object):
         self._export_date_periods(parent_element)
         self._export_date_types(parent_element)
         self._export_calendars(parent_element)
-        self._export_authority_records(parent_element)
-        # The schema requires that Entities go last, so move them there.
-        if parent_element[0].tag == EATS + 'entities':
-            parent_element.append(parent_element[0])
         return
 
     def _export_authorities(self, parent_element):
@@ -645,25 +1151,9 @@ class Exporter (object):
                                            'authority')
             authority_element.set('is_default', self._get_XML_boolean(
                 authority_object.is_default))
-            authority_element.set('default_calendar', 'calendar-%s' %
-                                  authority_object.default_calendar_id)
-            self._object_list['Calendar'].add(
-                authority_object.default_calendar_id)
-            authority_element.set('default_date_period', 'date_period-%s' %
-                                  authority_object.default_date_period_id)
-            self._object_list['DatePeriod'].add(
-                authority_object.default_date_period_id)
-            authority_element.set('default_date_type', 'date_type-%s' %
-                                  authority_object.default_date_type_id)
-            self._object_list['DateType'].add(
-                authority_object.default_date_type_id)
-            authority_element.set('default_language', 'language-%s' %
-                                  authority_object.default_calendar_id)
-            self._object_list['Language'].add(
-                authority_object.default_calendar_id)
-            authority_element.set('default_script', 'script-%s' %
-                                  authority_object.default_script_id)
-            self._object_list['Script'].add(authority_object.default_script_id)
+            if not self._prune:
+                self._export_authority_defaults(authority_object,
+                                                authority_element)
             name_element = etree.SubElement(authority_element, EATS + 'name')
             name_element.text = authority_object.authority
             abbreviated_name_element = etree.SubElement(
@@ -677,6 +1167,27 @@ class Exporter (object):
             base_url_element.text = authority_object.base_url
         return
 
+    def _export_authority_defaults(self, authority_object, authority_element):
+        """Export the default infrastructure objects of
+        authority_object as attributes of authority_element."""
+        authority_element.set('default_calendar', 'calendar-%s' %
+                              authority_object.default_calendar_id)
+        self._object_list['Calendar'].add(authority_object.default_calendar_id)
+        authority_element.set('default_date_period', 'date_period-%s' %
+                              authority_object.default_date_period_id)
+        self._object_list['DatePeriod'].add(
+            authority_object.default_date_period_id)
+        authority_element.set('default_date_type', 'date_type-%s' %
+                              authority_object.default_date_type_id)
+        self._object_list['DateType'].add(
+            authority_object.default_date_type_id)
+        authority_element.set('default_language', 'language-%s' %
+                              authority_object.default_calendar_id)
+        self._object_list['Language'].add(authority_object.default_calendar_id)
+        authority_element.set('default_script', 'script-%s' %
+                              authority_object.default_script_id)
+        self._object_list['Script'].add(authority_object.default_script_id)
+
     def _export_entity_types_list(self, parent_element):
         """Export referenced EntityTypeList objects."""
         model_name = 'EntityTypeList'
@@ -772,7 +1283,8 @@ class Exporter (object):
         model_name = 'Language'
         self._log_start_objects(model_name)
         ids = tuple(self._object_list[model_name])
-        language_objects = Language.objects.filter(pk__in=ids)
+        language_objects = Language.objects.filter(pk__in=ids)\
+            .prefetch_related('system_name_part_types')
         languages_element = None
         if len(language_objects):
             languages_element = etree.SubElement(parent_element,
@@ -940,23 +1452,27 @@ class Exporter (object):
                           % (lower_bound, upper_bound))
             record_objects = AuthorityRecord.objects.filter(pk__in=batch_ids)
             for record_object in record_objects:
-                record_element = etree.SubElement(records_element,
-                                                  EATS + 'authority_record')
-                self._add_ids(record_object, record_element,
-                              'authority_record')
-                record_element.set('authority', 'authority-%d'
-                                   % (record_object.authority_id))
-                self._export_last_modified(record_object, record_element)
-                id_element = etree.SubElement(record_element,
-                                              EATS + 'authority_system_id')
-                id_element.set('is_complete', self._get_XML_boolean(
-                    record_object.is_complete_id))
-                id_element.text = record_object.authority_system_id
-                url_element = etree.SubElement(record_element,
-                                               EATS + 'authority_system_url')
-                url_element.set('is_complete', self._get_XML_boolean(
-                    record_object.is_complete_url))
-                url_element.text = record_object.authority_system_url
+                self._export_authority_record(record_object, records_element)
+        return
+
+    def _export_authority_record(self, record_object, parent_element):
+        """Export AuthorityRecord object."""
+        record_element = etree.SubElement(parent_element,
+                                          EATS + 'authority_record')
+        self._add_ids(record_object, record_element, 'authority_record')
+        record_element.set('authority', 'authority-%d'
+                           % (record_object.authority_id))
+        self._export_last_modified(record_object, record_element)
+        id_element = etree.SubElement(record_element,
+                                      EATS + 'authority_system_id')
+        id_element.set('is_complete', self._get_XML_boolean(
+            record_object.is_complete_id))
+        id_element.text = record_object.authority_system_id
+        url_element = etree.SubElement(record_element,
+                                       EATS + 'authority_system_url')
+        url_element.set('is_complete', self._get_XML_boolean(
+            record_object.is_complete_url))
+        url_element.text = record_object.authority_system_url
         return
 
     ###
@@ -994,9 +1510,7 @@ class Exporter (object):
     @staticmethod
     def _validate(root):
         """Validate the XML document against the RelaxNG schema."""
-        logging.debug('Parsing RelaxNG schema')
-        relaxng_doc = etree.parse(RNG_PATH)
-        relaxng = etree.RelaxNG(relaxng_doc)
+        relaxng = get_relaxng()
         logging.debug('Validating export file')
         if not relaxng.validate(etree.ElementTree(root)):
             message = 'RelaxNG validation of the export document failed: %s' % \
@@ -12,16 +12,13 @@ from eats.models import Authority, AuthorityRecord, Calendar, Date, \
     EntityRelationship, EntityRelationshipType, EntityRelationshipNote, \
     EntityType, EntityTypeList, Existence, Language, Name, NamePart, \
     NameType, NamePartType, NameRelationship, NameRelationshipType, \
-    PropertyAssertion, Script, SystemNamePartType, \
-    get_new_authority_record_details
+    PropertyAssertion, PropertyAssertionValidator, Script, \
+    SystemNamePartType, reserve_authority_record_details
+from eats.eatsml.schema import get_relaxng
 
 # Full path to this directory.
 PATH = abspath(dirname(__file__))
 
-# RelaxNG schema.
-RNG_FILENAME = 'eatsml.rng'
-RNG_PATH = join(PATH, RNG_FILENAME)
-
 # Logging constants.
 LOG_LEVEL = logging.DEBUG
 LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
@@ -35,6 +32,88 @@ EATS_NAMESPACE = 'http://hdl.handle.net/10063/234'
 EATS = '{%s}' % (EATS_NAMESPACE)
 NSMAP = {'e': EATS_NAMESPACE}
 
+# Phases of an import, as reported to the progress function.
+INFRASTRUCTURE_PHASE = 'infrastructure'
+ENTITIES_PHASE = 'entities'
+RELATIONSHIPS_PHASE = 'relationships'
+
+# Number of items of a phase to import between reports of progress.
+PROGRESS_INTERVAL = 100
+
+# Models of the objects referenced by EATS ID from elements, keyed
+# by element name. Elements whose names end in "_assertion" are of
+# PropertyAssertion objects.
+ELEMENT_MODELS = {
+    EATS + 'authority': Authority,
+    EATS + 'authority_record': AuthorityRecord,
+    EATS + 'calendar': Calendar,
+    EATS + 'date': Date,
+    EATS + 'date_period': DatePeriod,
+    EATS + 'date_type': DateType,
+    EATS + 'entity': Entity,
+    EATS + 'entity_relationship_type': EntityRelationshipType,
+    EATS + 'entity_type': EntityTypeList,
+    EATS + 'language': Language,
+    EATS + 'name_part_type': NamePartType,
+    EATS + 'name_relationship_type': NameRelationshipType,
+    EATS + 'name_type': NameType,
+    EATS + 'script': Script,
+    EATS + 'system_name_part_type': SystemNamePartType,
+}
+
+# The infrastructure of a document, as the names of the section and
+# item elements, in the order in which they are imported.
+INFRASTRUCTURE_PATHS = (
+    ('system_name_part_types', 'system_name_part_type'),
+    ('calendars', 'calendar'),
+    ('date_periods', 'date_period'),
+    ('date_types', 'date_type'),
+    ('languages', 'language'),
+    ('scripts', 'script'),
+    ('authorities', 'authority'),
+    ('entity_types', 'entity_type'),
+    ('entity_relationship_types', 'entity_relationship_type'),
+    ('name_types', 'name_type'),
+    ('name_part_types', 'name_part_type'),
+    ('name_relationship_types', 'name_relationship_type'),
+    ('authority_records', 'authority_record'),
+)
+
+# The property assertions of an entity element, as the name of the
+# PropertyAssertion field relating the property and the path to the
+# assertion elements. The properties are created in this order.
+ASSERTION_PATHS = (
+    ('existence', 'e:existence_assertions/e:existence_assertion'),
+    ('entity_type', 'e:entity_type_assertions/e:entity_type_assertion'),
+    ('note', 'e:entity_note_assertions/e:entity_note_assertion'),
+    ('reference', 'e:entity_reference_assertions/'
+     'e:entity_reference_assertion'),
+    ('name', 'e:name_assertions/e:name_assertion'),
+    ('entity_relationship', 'e:entity_relationship_assertions/'
+     'e:entity_relationship_assertion'),
+    ('name_relationship', 'e:name_relationship_assertions/'
+     'e:name_relationship_assertion'),
+)
+
+# The types referenced by new property assertions, whose authority
+# must match that of the assertion, as the attribute referencing the
+# type, the map it is resolved in, and its model; keyed by the name
+# of the PropertyAssertion field.
+ASSERTION_TYPES = {
+    'entity_type': ('entity_type', 'entity type', EntityTypeList),
+    'name': ('type', 'name type', NameType),
+    'entity_relationship': ('type', 'entity relationship type',
+                            EntityRelationshipType),
+    'name_relationship': ('type', 'name relationship type',
+                          NameRelationshipType),
+}
+
+# Maximum number of problems listed in the report of a dry run.
+MAXIMUM_PROBLEMS = 50
+
+# Estimated number of search names generated for each new name.
+SEARCH_NAMES_PER_NAME = 2
+
 
 class EATSImportError (Exception):
 
@@ -46,7 +125,16 @@ class Importer (object):
 
     """Class implementing an import of an EATSML XML document into EATS."""
 
-    def __init__(self, user):
+    def __init__(self, user, progress=None):
+        """Initialise the importer.
+
+        Arguments:
+        user -- User object performing the import
+        progress -- optional function to call with the phase of the
+                    import, the number of items of it imported and
+                    the total number of them
+
+        """
         try:
             logging.basicConfig(level=LOG_LEVEL,
                                 filename=FILE_LOG,
@@ -74,6 +162,12 @@ class Importer (object):
         self._user = None
         self._has_add_infrastructure_permission = False
         self._user_authority_ids = []
+        self._assertion_validator = PropertyAssertionValidator()
+        # Objects fetched for checking, keyed by model and then by ID.
+        self._objects = {}
+        self._progress = progress
+        # Element being imported.
+        self._current_element = None
         self._set_user(user)
 
     def _set_user(self, user):
@@ -91,43 +185,302 @@ class Importer (object):
                                         authorities]
         self._has_add_infrastructure_permission = self._user.is_superuser
 
-    def import_file(self, eatsml):
+    def import_file(self, eatsml, dry_run=False):
         """Import XML data from eatsml into EATS, returning the
         the parsed XML document and that same document annotated with
         the EATS IDs for the elements imported (both lxml "root"
         objects).
 
+        If dry_run is True, nothing is imported; instead the document
+        is validated and checked against the database, and a report
+        is returned (see check_tree).
+
         Arguments:
         eatsml -- open file or filename (anything suitable for the
                   etree parse method)
+        dry_run -- Boolean of whether to only check the import
 
         """
         logging.debug('Starting import')
         parser = etree.XMLParser(remove_blank_text=True)
         raw_tree = etree.parse(eatsml, parser)
         logging.debug('Parsed import file')
+        self._assertion_validator = PropertyAssertionValidator()
+        self._objects = {}
+        self._current_element = None
+        if dry_run:
+            return self.check_tree(raw_tree)
         self._validate(raw_tree)
         processed_tree = copy.deepcopy(raw_tree)
-        self._import_infrastructure(processed_tree)
-        self._import_entities(processed_tree)
-        self._import_entity_relationships(processed_tree)
+        self._prefetch_objects(processed_tree.getroot())
+        self._import_tree(processed_tree)
         return raw_tree.getroot(), processed_tree.getroot()
 
+    def check_tree(self, tree):
+        """Return a report of what importing XML tree would create,
+        and of the problems that would prevent it, without changing
+        the database.
+
+        Every object referenced by EATS ID is fetched in bulk, and the
+        invariants of the new property assertions are checked with a
+        single query. The report is a dictionary with the keys:
+
+        valid -- Boolean of whether the import would succeed
+        new -- counts of the objects to be created, by item name
+        existing -- counts of the existing objects referenced, by
+                    item name
+        estimated_rows -- estimated number of rows to be inserted
+        problems -- list of the first MAXIMUM_PROBLEMS problems, each
+                    a dictionary with the xml_id of the element and
+                    a message
+        problem_count -- number of problems found
+
+        Arguments:
+        tree -- parsed XML document, which is not modified
+
+        """
+        logging.debug('Checking import')
+        self._report = {'valid': True, 'new': {}, 'existing': {},
+                        'estimated_rows': 0, 'problems': [],
+                        'problem_count': 0}
+        # New objects are mapped to placeholder IDs, which are
+        # negative so that they match nothing in the database.
+        self._placeholder_id = 0
+        self._new_assertions = []
+        try:
+            self._validate(tree)
+        except EATSImportError as e:
+            self._add_problem(None, str(e))
+        else:
+            self._prefetch_objects(tree.getroot())
+            self._check_infrastructure(tree)
+            entity_elements = tree.xpath('/e:collection/e:entities/e:entity',
+                                         namespaces=NSMAP)
+            for entity_element in entity_elements:
+                self._check_entity(entity_element)
+            relationship_elements = tree.xpath(
+                '/e:collection/e:entities/e:entity/'
+                'e:entity_relationship_assertions/'
+                'e:entity_relationship_assertion', namespaces=NSMAP)
+            for relationship_element in relationship_elements:
+                self._check_assertion(relationship_element,
+                                      'entity_relationship')
+            self._check_new_assertions()
+        self._report['valid'] = not self._report['problem_count']
+        logging.debug('Checked import: %d problems'
+                      % (self._report['problem_count']))
+        return self._report
+
+    def _check_infrastructure(self, tree):
+        """Check the non-entity information from XML tree, mapping
+        each item to its EATS ID, or to a placeholder if it is new."""
+        permission_checked = False
+        for section, item in INFRASTRUCTURE_PATHS:
+            item_name = item.replace('_', ' ')
+            model = ELEMENT_MODELS[EATS + item]
+            elements = tree.xpath('/e:collection/e:%s/e:%s' % (section, item),
+                                  namespaces=NSMAP)
+            for element in elements:
+                xml_id = self._get_element_id(element)
+                eats_id = self._get_element_eats_id(element)
+                if eats_id:
+                    self._check(element, self._check_object_exists, model,
+                                eats_id, xml_id)
+                    self._count_existing(item_name)
+                else:
+                    if item == 'authority_record':
+                        authority_id = self._get_referenced_eats_id(
+                            element, 'authority')
+                        # The permission to add a new authority has
+                        # already been checked.
+                        if self._is_existing(authority_id):
+                            self._check(element, self._check_add_permission,
+                                        authority=authority_id)
+                    elif not permission_checked:
+                        # Report a lack of permission only once.
+                        self._check(element,
+                                    self._check_add_infrastructure_permission)
+                        permission_checked = True
+                    rows = 1 + len(element.xpath(
+                        'e:system_name_part_types/e:system_name_part_type',
+                        namespaces=NSMAP))
+                    eats_id = self._get_placeholder_id()
+                    self._count(item_name, rows)
+                self._xml_object_map[item_name][xml_id] = eats_id
+
+    def _check_entity(self, entity_element):
+        """Check entity, other than its entity relationships, from XML
+        element."""
+        xml_id = self._get_element_id(entity_element)
+        eats_id = self._get_element_eats_id(entity_element)
+        if eats_id:
+            self._check(entity_element, self._check_object_exists, Entity,
+                        eats_id, xml_id)
+            self._count_existing('entity')
+        else:
+            eats_id = self._get_placeholder_id()
+            self._count('entity')
+        self._xml_object_map['entity'][xml_id] = eats_id
+        for field, path in ASSERTION_PATHS:
+            if field == 'entity_relationship':
+                continue
+            for element in entity_element.xpath(path, namespaces=NSMAP):
+                self._check_assertion(element, field, eats_id)
+
+    def _check_assertion(self, element, field, entity_id=None):
+        """Check the field property assertion from XML element, made
+        of the entity with entity_id (or of the entity containing
+        element, if entity_id is None)."""
+        xml_id = self._get_element_id(element)
+        eats_id = self._get_element_eats_id(element)
+        if entity_id is None:
+            entity_id = self._get_referenced_eats_id(
+                element.getparent().getparent(), XML + 'id', 'entity')
+        item_name = '%s assertion' % (field.replace('_', ' '))
+        if eats_id:
+            self._check(element, self._check_object_exists,
+                        PropertyAssertion, eats_id, xml_id,
+                        entity_id if self._is_existing(entity_id) else None,
+                        field)
+            self._count_existing(item_name)
+        else:
+            eats_id = self._get_placeholder_id()
+            authority_record_id = self._get_referenced_eats_id(
+                element, 'authority_record')
+            if self._is_existing(authority_record_id):
+                self._check(element, self._check_add_permission,
+                            record=authority_record_id)
+            if field in ASSERTION_TYPES:
+                attribute, map_key, model = ASSERTION_TYPES[field]
+                type_id = self._get_referenced_eats_id(element, attribute,
+                                                       map_key)
+                self._check_assertion_type(element, type_id, model,
+                                           authority_record_id, xml_id)
+            rows = 2
+            if field == 'name':
+                rows += SEARCH_NAMES_PER_NAME
+                for part_element in element.xpath('e:name_parts/e:name_part',
+                                                  namespaces=NSMAP):
+                    type_id = self._get_referenced_eats_id(
+                        part_element, 'type', 'name part type')
+                    self._check_assertion_type(element, type_id, NamePartType,
+                                               authority_record_id, xml_id)
+                    self._count('name part')
+            elif field == 'entity_relationship':
+                for note_element in element.xpath(
+                        'e:entity_relationship_notes/'
+                        'e:entity_relationship_note', namespaces=NSMAP):
+                    self._count('entity relationship note')
+            self._count(item_name, rows)
+            assertion_object = PropertyAssertion(
+                entity_id=entity_id, authority_record_id=authority_record_id)
+            if field == 'existence':
+                assertion_object.existence_id = eats_id
+            self._new_assertions.append((element, field, assertion_object))
+        if field == 'name':
+            self._xml_object_map['name'][xml_id] = eats_id
+        for date_element in element.xpath('e:dates/e:date', namespaces=NSMAP):
+            date_eats_id = self._get_element_eats_id(date_element)
+            if date_eats_id:
+                self._check(date_element, self._check_object_exists, Date,
+                            date_eats_id, self._get_element_id(date_element))
+                self._count_existing('date')
+            else:
+                self._count('date')
+
+    def _check_assertion_type(self, element, type_id, model,
+                              authority_record_id, xml_id):
+        """Check that the existing type with type_id is associated with
+        the same authority as the existing authority record with
+        authority_record_id."""
+        if self._is_existing(type_id) and \
+                self._is_existing(authority_record_id):
+            self._check(element, self._check_type_authority, type_id, model,
+                        authority_record_id, xml_id)
+
+    def _check_new_assertions(self):
+        """Check the invariants of the new property assertions
+        together."""
+        assertion_objects = [assertion_object for element, field,
+                             assertion_object in self._new_assertions]
+        invalid = set(map(id, self._assertion_validator.get_invalid_assertions(
+            assertion_objects)))
+        for element, field, assertion_object in self._new_assertions:
+            if id(assertion_object) in invalid:
+                self._add_problem(
+                    element, 'The %s assertion is not made by an authority '
+                    'record with an existence assertion for the entity'
+                    % (field.replace('_', ' ')))
+
+    def _check(self, element, check, *args, **kwargs):
+        """Call check with args and kwargs, recording any import
+        error it raises as a problem with element."""
+        self._current_element = element
+        try:
+            return check(*args, **kwargs)
+        except EATSImportError as e:
+            self._add_problem(element, str(e))
+
+    def _add_problem(self, element, message):
+        """Record a problem with element in the report."""
+        self._current_element = element
+        self._report['problem_count'] += 1
+        if len(self._report['problems']) < MAXIMUM_PROBLEMS:
+            self._report['problems'].append(
+                {'xml_id': self.get_current_xml_id(), 'message': message})
+
+    def _count(self, item_name, rows=1):
+        """Count a new item_name object in the report, to be inserted
+        in rows rows."""
+        counts = self._report['new']
+        counts[item_name] = counts.get(item_name, 0) + 1
+        self._report['estimated_rows'] += rows
+
+    def _count_existing(self, item_name):
+        """Count an existing item_name object in the report."""
+        counts = self._report['existing']
+        counts[item_name] = counts.get(item_name, 0) + 1
+
+    def _get_placeholder_id(self):
+        """Return a new placeholder ID for a new object."""
+        self._placeholder_id -= 1
+        return self._placeholder_id
+
+    @staticmethod
+    def _is_existing(eats_id):
+        """Return True if eats_id is the ID of an object in the
+        database, rather than a placeholder or None."""
+        return eats_id is not None and eats_id > 0
+
+    def _import_tree(self, tree):
+        """Import the data in XML tree, annotating it with the EATS
+        IDs of the objects created."""
+        self._import_infrastructure(tree)
+        self._import_entities(tree)
+        self._import_entity_relationships(tree)
+
     def _import_infrastructure(self, tree):
         """Import the non-entity information from XML tree."""
-        self._import_system_name_part_types(tree)
-        self._import_calendars(tree)
-        self._import_date_periods(tree)
-        self._import_date_types(tree)
-        self._import_languages(tree)
-        self._import_scripts(tree)
-        self._import_authorities(tree)
-        self._import_entity_types_list(tree)
-        self._import_entity_relationship_types(tree)
-        self._import_name_types(tree)
-        self._import_name_part_types(tree)
-        self._import_name_relationship_types(tree)
-        self._import_authority_records(tree)
+        import_sections = (
+            self._import_system_name_part_types,
+            self._import_calendars,
+            self._import_date_periods,
+            self._import_date_types,
+            self._import_languages,
+            self._import_scripts,
+            self._import_authorities,
+            self._import_entity_types_list,
+            self._import_entity_relationship_types,
+            self._import_name_types,
+            self._import_name_part_types,
+            self._import_name_relationship_types,
+            self._import_authority_records,
+        )
+        total = len(import_sections)
+        self._report_progress(INFRASTRUCTURE_PHASE, 0, total)
+        for count, import_section in enumerate(import_sections, 1):
+            import_section(tree)
+            self._report_progress(INFRASTRUCTURE_PHASE, count, total)
 
     def _import_authorities(self, tree):
         """Import the authority records from XML tree."""
@@ -172,6 +525,7 @@ class Importer (object):
                     default_script_id=default_script_id)
                 authority_object.save()
                 eats_id = authority_object.id
+                self._add_object(authority_object)
                 self._add_eats_id(authority_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -197,6 +551,7 @@ class Importer (object):
                                     authority_id=authority_id)
                 type_object.save()
                 eats_id = type_object.id
+                self._add_object(type_object)
                 self._add_eats_id(type_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -224,6 +579,7 @@ class Importer (object):
                     authority_id=authority_id)
                 type_object.save()
                 eats_id = type_object.id
+                self._add_object(type_object)
                 self._add_eats_id(type_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -251,6 +607,7 @@ class Importer (object):
                                        authority_id=authority_id)
                 type_object.save()
                 eats_id = type_object.id
+                self._add_object(type_object)
                 self._add_eats_id(type_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -278,6 +635,7 @@ class Importer (object):
                                     description=description)
                 type_object.save()
                 eats_id = type_object.id
+                self._add_object(type_object)
                 self._add_eats_id(type_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -307,6 +665,7 @@ class Importer (object):
                     system_name_part_type_id=system_name_part_type_id)
                 type_object.save()
                 eats_id = type_object.id
+                self._add_object(type_object)
                 self._add_eats_id(type_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -331,6 +690,7 @@ class Importer (object):
                                         language_name=name)
                 language_object.save()
                 eats_id = language_object.id
+                self._add_object(language_object)
                 self._add_eats_id(language_element, eats_id)
                 type_elements = language_element.xpath(
                     'e:system_name_part_types/e:system_name_part_type',
@@ -369,6 +729,7 @@ class Importer (object):
                 script_object = model(script_code=code, script_name=name)
                 script_object.save()
                 eats_id = script_object.id
+                self._add_object(script_object)
                 self._add_eats_id(script_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -396,6 +757,7 @@ class Importer (object):
                     authority_id=authority_id)
                 type_object.save()
                 eats_id = type_object.id
+                self._add_object(type_object)
                 self._add_eats_id(type_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -419,6 +781,7 @@ class Importer (object):
                 period_object = model(date_period=date_period)
                 period_object.save()
                 eats_id = period_object.id
+                self._add_object(period_object)
                 self._add_eats_id(period_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -441,6 +804,7 @@ class Importer (object):
                 type_object = model(date_type=date_type)
                 type_object.save()
                 eats_id = type_object.id
+                self._add_object(type_object)
                 self._add_eats_id(type_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -463,6 +827,7 @@ class Importer (object):
                 calendar_object = model(calendar=calendar)
                 calendar_object.save()
                 eats_id = calendar_object.id
+                self._add_object(calendar_object)
                 self._add_eats_id(calendar_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
@@ -474,6 +839,8 @@ class Importer (object):
         record_elements = tree.xpath(
             '/e:collection/e:authority_records/e:authority_record',
             namespaces=NSMAP)
+        reserved_details = self._reserve_authority_record_details(
+            record_elements)
         for record_element in record_elements:
             self._log_xml(item_name, record_element)
             xml_id = self._get_element_id(record_element)
@@ -485,8 +852,7 @@ class Importer (object):
                                                             'authority')
                 self._check_add_permission(authority=authority_id)
                 if record_element.get('auto_create_data'):
-                    authority = Authority.objects.get(pk=authority_id)
-                    record_data = get_new_authority_record_details(authority)
+                    record_data = reserved_details[authority_id].pop(0)
                     system_id = record_data['id']
                     is_complete_id = record_data['is_complete_id']
                     system_url = record_data['url']
@@ -521,35 +887,64 @@ class Importer (object):
                     is_complete_url=is_complete_url)
                 record_object.save()
                 eats_id = record_object.id
+                self._add_object(record_object)
                 self._add_eats_id(record_element, eats_id)
             self._create_mapping(item_name, xml_id, eats_id)
 
+    def _reserve_authority_record_details(self, record_elements):
+        """Return a dictionary, keyed by authority ID, of lists of
+        details for the new authority records to be created with
+        automatically generated data, reserving them in one block per
+        authority."""
+        counts = {}
+        for record_element in record_elements:
+            if not self._get_element_eats_id(record_element) and \
+                    record_element.get('auto_create_data'):
+                authority_id = self._get_referenced_eats_id(record_element,
+                                                            'authority')
+                self._check_add_permission(authority=authority_id)
+                counts[authority_id] = counts.get(authority_id, 0) + 1
+        reserved_details = {}
+        for authority_id, count in counts.items():
+            authority = Authority.objects.get(pk=authority_id)
+            reserved_details[authority_id] = \
+                reserve_authority_record_details(authority, count)
+        return reserved_details
+
     def _import_entities(self, tree):
         """Import entities from XML tree."""
-        item_name = 'entity'
-        model = Entity
-        self._log_start_items(item_name)
+        self._log_start_items('entity')
         entity_elements = tree.xpath('/e:collection/e:entities/e:entity',
                                      namespaces=NSMAP)
-        for entity_element in entity_elements:
-            self._log_xml(item_name, entity_element)
-            xml_id = self._get_element_id(entity_element)
-            eats_id = self._get_element_eats_id(entity_element)
-            if eats_id:
-                self._check_object_exists(model, eats_id, xml_id)
-            else:
-                entity_object = model()
-                entity_object.save(create_existence=False)
-                eats_id = entity_object.id
-                self._add_eats_id(entity_element, eats_id)
-            # Import all property assertions.
-            self._import_existences(entity_element, eats_id)
-            self._import_entity_types(entity_element, eats_id)
-            self._import_entity_notes(entity_element, eats_id)
-            self._import_entity_references(entity_element, eats_id)
-            self._import_names(entity_element, eats_id)
-            self._import_name_relationships(entity_element, eats_id)
-            self._create_mapping(item_name, xml_id, eats_id)
+        total = len(entity_elements)
+        self._report_progress(ENTITIES_PHASE, 0, total)
+        for count, entity_element in enumerate(entity_elements, 1):
+            self._import_entity(entity_element)
+            self._report_progress(ENTITIES_PHASE, count, total)
+
+    def _import_entity(self, entity_element):
+        """Import entity, other than its entity relationships, from
+        XML element."""
+        item_name = 'entity'
+        model = Entity
+        self._log_xml(item_name, entity_element)
+        xml_id = self._get_element_id(entity_element)
+        eats_id = self._get_element_eats_id(entity_element)
+        if eats_id:
+            self._check_object_exists(model, eats_id, xml_id)
+        else:
+            entity_object = model()
+            entity_object.save(create_existence=False)
+            eats_id = entity_object.id
+            self._add_eats_id(entity_element, eats_id)
+        # Import all property assertions.
+        self._import_existences(entity_element, eats_id)
+        self._import_entity_types(entity_element, eats_id)
+        self._import_entity_notes(entity_element, eats_id)
+        self._import_entity_references(entity_element, eats_id)
+        self._import_names(entity_element, eats_id)
+        self._import_name_relationships(entity_element, eats_id)
+        self._create_mapping(item_name, xml_id, eats_id)
 
     def _import_existences(self, entity_element, entity_id):
         """Import existences for entity from XML element."""
@@ -577,7 +972,7 @@ class Importer (object):
                     entity_id=entity_id,
                     authority_record_id=authority_record_id,
                     existence_id=existence_id, is_preferred=is_preferred)
-                assertion_object.save()
+                assertion_object.save(validator=self._assertion_validator)
                 self._add_eats_id(existence_element, assertion_object.id)
             self._import_dates(existence_element, assertion_object.id)
 
@@ -611,7 +1006,7 @@ class Importer (object):
                     authority_record_id=authority_record_id,
                     entity_type_id=type_object.id, is_preferred=is_preferred)
                 try:
-                    assertion_object.save()
+                    assertion_object.save(validator=self._assertion_validator)
                 except Exception:
                     raise EATSImportError(
                         'Could not save entity type assertion %s' % xml_id)
@@ -647,7 +1042,7 @@ class Importer (object):
                     authority_record_id=authority_record_id,
                     note_id=note_id, is_preferred=is_preferred)
                 try:
-                    assertion_object.save()
+                    assertion_object.save(validator=self._assertion_validator)
                 except Exception:
                     raise EATSImportError(
                         'Could not save entity note assertion %s' % xml_id)
@@ -685,7 +1080,7 @@ class Importer (object):
                     authority_record_id=authority_record_id,
                     reference_id=reference_id, is_preferred=is_preferred)
                 try:
-                    assertion_object.save()
+                    assertion_object.save(validator=self._assertion_validator)
                 except Exception:
                     raise EATSImportError(
                         'Could not save entity reference assertion %s' % xml_id)
@@ -730,13 +1125,14 @@ class Importer (object):
                     authority_record_id=authority_record_id,
                     name_id=name_id, is_preferred=is_preferred)
                 try:
-                    assertion_object.save()
+                    assertion_object.save(validator=self._assertion_validator)
                 except Exception:
                     raise EATSImportError(
                         'Could not save name assertion %s' % xml_id)
                 # Save the name again to generate the search names.
                 name_object.save()
                 eats_id = assertion_object.id
+                self._add_object(assertion_object)
                 self._add_eats_id(name_element, eats_id)
                 self._import_name_parts(name_element, name_id,
                                         authority_record_id)
@@ -766,52 +1162,60 @@ class Importer (object):
 
     def _import_entity_relationships(self, tree):
         """Import entity relationships from XML tree."""
-        item_name = 'entity relationship'
-        model = PropertyAssertion
         relationship_elements = tree.xpath(
             '/e:collection/e:entities/e:entity/e:entity_relationship_assertions/e:entity_relationship_assertion',
             namespaces=NSMAP)
-        for relationship_element in relationship_elements:
-            self._log_xml(item_name, relationship_element)
-            xml_id = self._get_element_id(relationship_element)
-            eats_id = self._get_element_eats_id(relationship_element)
-            if eats_id:
-                assertion_object = self._check_object_exists(model, eats_id,
-                                                             xml_id)
-            else:
-                entity_element = relationship_element.getparent().getparent()
-                entity_id = self._get_referenced_eats_id(
-                    entity_element, XML + 'id', 'entity')
-                authority_record_id = self._get_referenced_eats_id(
-                    relationship_element, 'authority_record')
-                self._check_add_permission(record=authority_record_id)
-                related_entity_id = self._get_referenced_eats_id(
-                    relationship_element, 'related_entity', 'entity')
-                relationship_type_id = self._get_referenced_eats_id(
-                    relationship_element, 'type', 'entity relationship type')
-                self._check_type_authority(relationship_type_id,
-                                           EntityRelationshipType,
-                                           authority_record_id, xml_id)
-                is_preferred = self._get_boolean(relationship_element,
-                                                 'is_preferred')
-                relationship_object = EntityRelationship(
-                    related_entity_id=related_entity_id,
-                    entity_relationship_type_id=relationship_type_id)
-                relationship_object.save()
-                assertion_object = PropertyAssertion(
-                    entity_id=entity_id,
-                    authority_record_id=authority_record_id,
-                    entity_relationship_id=relationship_object.id,
-                    is_preferred=is_preferred)
-                try:
-                    assertion_object.save()
-                except Exception:
-                    raise EATSImportError(
-                        'Could not save entity relationship assertion %s' % xml_id)
-                self._add_eats_id(relationship_element, assertion_object.id)
-                self._import_entity_relationship_notes(relationship_element,
-                                                       relationship_object.id)
-            self._import_dates(relationship_element, assertion_object.id)
+        total = len(relationship_elements)
+        self._report_progress(RELATIONSHIPS_PHASE, 0, total)
+        for count, relationship_element in enumerate(relationship_elements,
+                                                     1):
+            self._import_entity_relationship(relationship_element)
+            self._report_progress(RELATIONSHIPS_PHASE, count, total)
+
+    def _import_entity_relationship(self, relationship_element):
+        """Import entity relationship from XML element."""
+        item_name = 'entity relationship'
+        model = PropertyAssertion
+        self._log_xml(item_name, relationship_element)
+        xml_id = self._get_element_id(relationship_element)
+        eats_id = self._get_element_eats_id(relationship_element)
+        if eats_id:
+            assertion_object = self._check_object_exists(model, eats_id,
+                                                         xml_id)
+        else:
+            entity_element = relationship_element.getparent().getparent()
+            entity_id = self._get_referenced_eats_id(
+                entity_element, XML + 'id', 'entity')
+            authority_record_id = self._get_referenced_eats_id(
+                relationship_element, 'authority_record')
+            self._check_add_permission(record=authority_record_id)
+            related_entity_id = self._get_referenced_eats_id(
+                relationship_element, 'related_entity', 'entity')
+            relationship_type_id = self._get_referenced_eats_id(
+                relationship_element, 'type', 'entity relationship type')
+            self._check_type_authority(relationship_type_id,
+                                       EntityRelationshipType,
+                                       authority_record_id, xml_id)
+            is_preferred = self._get_boolean(relationship_element,
+                                             'is_preferred')
+            relationship_object = EntityRelationship(
+                related_entity_id=related_entity_id,
+                entity_relationship_type_id=relationship_type_id)
+            relationship_object.save()
+            assertion_object = PropertyAssertion(
+                entity_id=entity_id,
+                authority_record_id=authority_record_id,
+                entity_relationship_id=relationship_object.id,
+                is_preferred=is_preferred)
+            try:
+                assertion_object.save(validator=self._assertion_validator)
+            except Exception:
+                raise EATSImportError(
+                    'Could not save entity relationship assertion %s' % xml_id)
+            self._add_eats_id(relationship_element, assertion_object.id)
+            self._import_entity_relationship_notes(relationship_element,
+                                                   relationship_object.id)
+        self._import_dates(relationship_element, assertion_object.id)
 
     def _import_entity_relationship_notes(self, relationship_element,
                                           relationship_id):
@@ -872,7 +1276,7 @@ class Importer (object):
                     name_relationship_id=relationship_object.id,
                     is_preferred=is_preferred)
                 try:
-                    assertion_object.save()
+                    assertion_object.save(validator=self._assertion_validator)
                 except Exception:
                     raise EATSImportError(
                         'Could not save name relationship assertion %s' % xml_id)
@@ -926,6 +1330,28 @@ class Importer (object):
         eats_id = self._xml_object_map[map_key].get(import_id)
         return eats_id
 
+    def get_current_xml_id(self):
+        """Return the XML ID of the element being imported, or of its
+        nearest ancestor with one, or None if there is no such
+        element."""
+        if self._current_element is None:
+            return None
+        xml_ids = self._current_element.xpath(
+            'ancestor-or-self::*[@xml:id][1]/@xml:id')
+        return xml_ids[0] if xml_ids else None
+
+    def _report_progress(self, phase, count, total):
+        """Report to the progress function, if any, that count of the
+        total items of phase have been imported.
+
+        Progress is reported at the start and end of a phase, and
+        every PROGRESS_INTERVAL items.
+
+        """
+        if self._progress is not None and (
+                count in (0, total) or not count % PROGRESS_INTERVAL):
+            self._progress(phase, count, total)
+
     def _create_mapping(self, map_name, xml_id, object_id):
         """Add a mapping in map_name between xml_id and
         object_id. This allows for resolving references within the
@@ -952,19 +1378,55 @@ class Importer (object):
         """
         if not self._user.is_superuser:
             authority_id = authority or \
-                AuthorityRecord.objects.get(pk=record).authority_id
+                self._get_object(AuthorityRecord, record).authority_id
             if authority_id not in self._user_authority_ids:
-                authority = Authority.objects.get(pk=authority_id)
+                authority = self._get_object(Authority, authority_id)
                 message = 'The user performing the import does not have permission to add data associated with %s, as the import file demands' \
                     % (str(authority))
                 raise EATSImportError(message)
 
+    def _prefetch_objects(self, element):
+        """Fetch, with one query per model, the objects referenced by
+        EATS ID from element and its descendants, so that they need
+        not be fetched one at a time when checked."""
+        eats_ids = {}
+        for descendant in element.iter(tag=etree.Element):
+            eats_id = self._get_element_eats_id(descendant)
+            if not eats_id:
+                continue
+            if descendant.tag.endswith('_assertion'):
+                model = PropertyAssertion
+            else:
+                model = ELEMENT_MODELS.get(descendant.tag)
+            if model is not None:
+                eats_ids.setdefault(model, set()).add(eats_id)
+        for model, model_eats_ids in eats_ids.items():
+            self._objects.setdefault(model, {}).update(
+                model.objects.in_bulk(model_eats_ids))
+        logging.debug('Prefetched the objects of %d models'
+                      % (len(eats_ids)))
+
+    def _get_object(self, model, eats_id):
+        """Return the model object with eats_id, fetching it only if
+        it has not already been fetched. Raise model.DoesNotExist if
+        there is no such object."""
+        objects = self._objects.setdefault(model, {})
+        model_object = objects.get(eats_id)
+        if model_object is None:
+            model_object = model.objects.get(pk=eats_id)
+            objects[eats_id] = model_object
+        return model_object
+
+    def _add_object(self, model_object):
+        """Keep model_object, which has just been created, so that it
+        need not be fetched when checked."""
+        self._objects.setdefault(type(model_object), {})[model_object.pk] = \
+            model_object
+
     @staticmethod
     def _validate(tree):
         """Validate the XML document against the RelaxNG schema."""
-        logging.debug('Parsing RelaxNG schema')
-        relaxng_doc = etree.parse(RNG_PATH)
-        relaxng = etree.RelaxNG(relaxng_doc)
+        relaxng = get_relaxng()
         logging.debug('Validating import file')
         if not relaxng.validate(tree):
             message = 'RelaxNG validation of the import document failed: %s' % \
@@ -985,8 +1447,7 @@ class Importer (object):
             eats_id = int(eats_id)
         return eats_id
 
-    @staticmethod
-    def _check_object_exists(model, eats_id, xml_id, entity_id=None,
+    def _check_object_exists(self, model, eats_id, xml_id, entity_id=None,
                              relating_field=None):
         """Return object with eats_id in model. Raises an exception if
         that object does not exist. If entity_id and property_model
@@ -1006,7 +1467,7 @@ class Importer (object):
         logging.debug('Checking that %s object with EATS id %s and XML id %s exists'
                       % (model._meta.object_name, eats_id, xml_id))
         try:
-            model_object = model.objects.get(pk=eats_id)
+            model_object = self._get_object(model, eats_id)
         except model.DoesNotExist:
             message = '%s object with EATS ID %d, XML ID %s does not exist in EATS.' \
                 % (model._meta.object_name, eats_id, xml_id)
@@ -1015,7 +1476,8 @@ class Importer (object):
             message = '%s object with EATS ID %d, XML ID %s is not associated with the specified entity with EATS ID %s.' \
                 % (model._meta.object_name, eats_id, xml_id, entity_id)
             raise EATSImportError(message)
-        if relating_field and getattr(model_object, relating_field) is None:
+        if relating_field and getattr(model_object, model._meta.get_field(
+                relating_field).attname) is None:
             message = '%s object with EATS ID %d, XML ID %s is not asserting a %s property as it ought to be.' \
                 % (model._meta.object_name, eats_id, xml_id, relating_field)
             raise EATSImportError(message)
@@ -1032,13 +1494,14 @@ class Importer (object):
             text = ''
         return text
 
-    @staticmethod
-    def _check_type_authority(object_id, model, authority_record_id, xml_id):
+    def _check_type_authority(self, object_id, model, authority_record_id,
+                              xml_id):
         """Raise an error if the ID of the Authority object associated
         with model object with object_id does not match the authority
         referenced by the AuthorityRecord object with authority_id."""
-        type_object = model.objects.get(pk=object_id)
-        authority_record = AuthorityRecord.objects.get(pk=authority_record_id)
+        type_object = self._get_object(model, object_id)
+        authority_record = self._get_object(AuthorityRecord,
+                                            authority_record_id)
         if type_object.authority_id != authority_record.authority_id:
             message = 'Mismatched authorities: element with XML ID %s references authority with EATS ID %d in its authority record, but a %s type associated with authority with EATS ID %d' \
                 % (xml_id, authority_record.authority_id,
@@ -1064,12 +1527,10 @@ class Importer (object):
         an XML document using the XML Schema boolean datatype."""
         return str(boolean).lower()
 
-    @staticmethod
-    def _get_name_id_from_assertion_id(assertion_id):
+    def _get_name_id_from_assertion_id(self, assertion_id):
         """Return the ID of the Name object associated with the
         PropertyAssertion with id assertion_id)."""
-        assertion = PropertyAssertion.objects.get(pk=assertion_id)
-        return assertion.name_id
+        return self._get_object(PropertyAssertion, assertion_id).name_id
 
     @staticmethod
     def _add_eats_id(element, eats_id):
@@ -1081,8 +1542,8 @@ class Importer (object):
         """Log the start of importing item_name items."""
         logging.debug('Importing %s items' % (item_name))
 
-    @staticmethod
-    def _log_xml(item_name, element):
+    def _log_xml(self, item_name, element):
         """Log the importing of item_name XML from element."""
+        self._current_element = element
         logging.debug('Importing %s from XML: %s'
                       % (item_name, etree.tostring(element)))
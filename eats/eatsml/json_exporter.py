@@ -0,0 +1,465 @@
+"""This module implements the export of EATS entities as JSON.
+
+The JSON export carries the same data as EATSML, and is gathered
+with the same prefetching of each batch of entities, but no XML tree
+is built, and nothing is validated. Each entity is a JSON object in
+which other objects are referenced by their EATS ID. A compact
+document of the entities and the infrastructure objects they
+reference is returned by JSONExporter.export_entities; a stream of
+one JSON object per line (NDJSON), with no infrastructure objects, by
+JSONExporter.stream_entities."""
+
+import json
+import logging
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.query import QuerySet
+
+from eats.models import Authority, AuthorityRecord, Calendar, DatePeriod, \
+    DateType, Entity, EntityRelationship, EntityRelationshipType, \
+    EntityTypeList, Language, NamePartType, NameRelationshipType, NameType, \
+    Script, SystemNamePartType
+import eats.names
+from eats.eatsml.cache import get_fragment_keys, get_fragments, \
+    set_fragments
+from eats.eatsml.exporter import DATE_PARTS, USER_PREFERENCES, \
+    EATSExportError, Exporter, get_related_entity_ids
+
+JSON_CONTENT_TYPE = 'application/json'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# Infrastructure objects exported, in the order in which they are
+# exported, with the name of their list in the JSON document and the
+# fields exported for each. Foreign keys are exported as IDs, and
+# the referenced objects are exported in turn.
+INFRASTRUCTURE_FIELDS = (
+    (Authority, 'authorities', (
+        'authority', 'abbreviated_name', 'base_id', 'base_url',
+        'is_default', 'default_calendar', 'default_date_period',
+        'default_date_type', 'default_language', 'default_script',
+        'last_modified')),
+    (AuthorityRecord, 'authority_records', (
+        'authority', 'authority_system_id', 'is_complete_id',
+        'authority_system_url', 'is_complete_url', 'last_modified')),
+    (EntityTypeList, 'entity_types', (
+        'entity_type', 'authority', 'last_modified')),
+    (EntityRelationshipType, 'entity_relationship_types', (
+        'entity_relationship_type', 'authority', 'last_modified')),
+    (NameType, 'name_types', (
+        'name_type', 'authority', 'is_default', 'last_modified')),
+    (NamePartType, 'name_part_types', (
+        'name_part_type', 'authority', 'system_name_part_type',
+        'last_modified')),
+    (SystemNamePartType, 'system_name_part_types', (
+        'name_part_type', 'description')),
+    (Language, 'languages', (
+        'language_name', 'language_code', 'last_modified')),
+    (Script, 'scripts', ('script_name', 'script_code', 'last_modified')),
+    (NameRelationshipType, 'name_relationship_types', (
+        'name_relationship_type', 'authority', 'last_modified')),
+    (DatePeriod, 'date_periods', ('date_period', 'last_modified')),
+    (DateType, 'date_types', ('date_type', 'last_modified')),
+    (Calendar, 'calendars', ('calendar', 'last_modified')),
+)
+
+# Foreign keys of infrastructure objects, and the model name of the
+# objects they reference.
+INFRASTRUCTURE_REFERENCES = {
+    'default_calendar': 'Calendar',
+    'default_date_period': 'DatePeriod',
+    'default_date_type': 'DateType',
+    'default_language': 'Language',
+    'default_script': 'Script',
+    'authority': 'Authority',
+    'system_name_part_type': 'SystemNamePartType',
+}
+
+# Names of the lists of infrastructure objects in the JSON document,
+# keyed by the user preference for an object of that type.
+PREFERENCE_LISTS = {
+    'authority': 'authorities',
+    'calendar': 'calendars',
+    'date_period': 'date_periods',
+    'date_type': 'date_types',
+    'language': 'languages',
+    'name_type': 'name_types',
+    'script': 'scripts',
+}
+
+
+def dumps(data):
+    """Return data serialised as compact JSON."""
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+class JSONExporter (Exporter):
+
+    """Exporter of entities as JSON rather than as EATSML."""
+
+    def export_entities(self, entity_objects, annotated=False,
+                        full_details=False):
+        """Return a dictionary of the exported entities, and of the
+        infrastructure objects they reference, suitable for
+        serialising as JSON.
+
+        As in EATSML, the entities related to entity_objects are
+        included, marked as related.
+
+        Arguments:
+        entity_objects -- list or QuerySet of Entity objects
+        annotated -- optional Boolean indicating if the data exported
+                     should be annotated with the user's preferences
+        full_details -- optional Boolean indicating if non-standard
+                        data should be exported, such as all
+                        constructed name forms
+
+        """
+        self._set_options(annotated, full_details)
+        entities = []
+        for entity_batch in self._get_batches(entity_objects):
+            entities.extend(self._get_primary_entities_data(entity_batch))
+        ids = sorted(self._object_list['Entity'] - self._primary_entity_ids)
+        for entity_batch in self._get_batches(
+                Entity.objects.filter(pk__in=ids)):
+            entities.extend(self._get_entities_data(entity_batch, False))
+        data = {'entities': entities}
+        data.update(self._get_infrastructure_data())
+        return data
+
+    def stream_entities(self, entity_objects, annotated=False,
+                        full_details=False, progress=None):
+        """Return an iterator over the UTF-8 encoded lines of the
+        NDJSON export of entity_objects, and of the entities related
+        to them, one entity to a line.
+
+        Arguments:
+        entity_objects -- list or QuerySet of Entity objects
+        annotated -- optional Boolean indicating if the data exported
+                     should be annotated with the user's preferences
+        full_details -- optional Boolean indicating if non-standard
+                        data should be exported, such as all
+                        constructed name forms
+        progress -- optional callable, called with the number of
+                    primary entities written so far after each batch
+
+        """
+        self._set_options(annotated, full_details)
+        if not isinstance(entity_objects, QuerySet):
+            entity_objects = Entity.objects.filter(
+                pk__in=[entity_object.id for entity_object in entity_objects])
+        return self._stream_json_entities(entity_objects, progress)
+
+    def _stream_json_entities(self, entity_objects, progress):
+        logging.info('Starting NDJSON export')
+        primary_ids = entity_objects.values('pk')
+        exported = 0
+        for entity_batch in self._get_batches(entity_objects):
+            yield self._get_lines(
+                self._get_primary_entities_data(entity_batch))
+            exported += len(entity_batch)
+            if progress is not None:
+                progress(exported)
+        related_objects = Entity.objects.filter(
+            pk__in=get_related_entity_ids(primary_ids)).exclude(
+                pk__in=primary_ids)
+        for entity_batch in self._get_batches(related_objects):
+            # Relationships of related entities are only exported if
+            # they point to a primary entity.
+            batch_relationships = EntityRelationship.objects.filter(
+                assertion__entity__in=entity_batch).values('related_entity')
+            self._primary_entity_ids = set(entity_objects.filter(
+                pk__in=batch_relationships).values_list('pk', flat=True))
+            yield self._get_lines(self._get_entities_data(entity_batch,
+                                                          False))
+        logging.info('Finished NDJSON export')
+
+    @staticmethod
+    def _get_lines(entities):
+        """Return the UTF-8 encoded NDJSON lines of entities."""
+        return ''.join([dumps(entity) + '\n' for entity in entities])\
+            .encode('utf-8')
+
+    def _set_options(self, annotated, full_details):
+        if annotated and self._user_profile is None:
+            message = 'A user must be specified if the export is to be ' \
+                'annotated'
+            logging.error(message)
+            raise EATSExportError(message)
+        self._annotated = annotated
+        self._full_details = full_details
+
+    def _get_primary_entities_data(self, entity_objects):
+        """Return a list of the data of entity_objects as primary
+        entities.
+
+        As with the EATSML of primary entities, the data of each
+        entity is cached, along with the IDs of the objects it
+        references; only the entities not in the cache are
+        prefetched and exported afresh.
+
+        """
+        keys = get_fragment_keys(
+            [entity_object.id for entity_object in entity_objects],
+            'json-%s' % (self._get_fragment_variant()))
+        fragments = get_fragments(keys.values())
+        new_fragments = {}
+        missing_objects = [entity_object for entity_object in entity_objects
+                           if keys[entity_object.id] not in fragments]
+        if missing_objects:
+            self._prefetch_entities(missing_objects)
+        object_list = self._object_list
+        entities = []
+        for entity_object in entity_objects:
+            self._primary_entity_ids.add(entity_object.id)
+            key = keys[entity_object.id]
+            if key in fragments:
+                entity, object_ids = fragments[key]
+            else:
+                # Track the objects referenced by this entity alone.
+                self._object_list = dict(
+                    (model_name, set()) for model_name in object_list)
+                try:
+                    entity = self._get_entity_data(entity_object)
+                finally:
+                    object_ids = dict(
+                        (model_name, list(ids)) for model_name, ids
+                        in self._object_list.items() if ids)
+                    self._object_list = object_list
+                new_fragments[key] = (entity, object_ids)
+            entities.append(entity)
+            for model_name, ids in object_ids.items():
+                object_list[model_name].update(ids)
+        set_fragments(new_fragments)
+        return entities
+
+    def _get_entities_data(self, entity_objects, is_primary=True):
+        """Return a list of the data of entity_objects, without
+        using the cache."""
+        self._prefetch_entities(entity_objects)
+        return [self._get_entity_data(entity_object, is_primary)
+                for entity_object in entity_objects]
+
+    def _get_entity_data(self, entity_object, is_primary=True):
+        """Return a dictionary of the data of entity_object.
+
+        Arguments:
+        entity_object -- Entity object
+        is_primary -- Boolean indicator of whether to export all entity
+                      relationships, or only those that refer to primary
+                      entities
+
+        """
+        self._log_object('Entity', entity_object)
+        entity = {'id': entity_object.id,
+                  'last_modified': entity_object.last_modified}
+        if not is_primary:
+            entity['is_related'] = True
+        properties = (
+            ('existences', self._get_existences_data(entity_object)),
+            ('entity_types', self._get_entity_types_data(entity_object)),
+            ('notes', self._get_entity_notes_data(entity_object)),
+            ('references', self._get_entity_references_data(entity_object)),
+            ('names', self._get_names_data(entity_object)),
+            ('entity_relationships', self._get_entity_relationships_data(
+                entity_object, is_primary)),
+            ('name_relationships', self._get_name_relationships_data(
+                entity_object)),
+        )
+        for name, values in properties:
+            if values:
+                entity[name] = values
+        return entity
+
+    def _get_assertion_data(self, assertion_object, **data):
+        """Return a dictionary of the common PropertyAssertion data of
+        assertion_object, updated with data."""
+        assertion = {'id': assertion_object.id,
+                     'authority_record': assertion_object.authority_record_id,
+                     'is_preferred': assertion_object.is_preferred}
+        assertion.update(data)
+        dates = self._get_dates_data(assertion_object)
+        if dates:
+            assertion['dates'] = dates
+        return assertion
+
+    def _get_existences_data(self, entity_object):
+        existences = []
+        for assertion_object in self._get_assertions(entity_object,
+                                                     'existence'):
+            self._object_list['Authority'].add(
+                assertion_object.authority_record.authority_id)
+            self._object_list['AuthorityRecord'].add(
+                assertion_object.authority_record_id)
+            existences.append(self._get_assertion_data(assertion_object))
+        return existences
+
+    def _get_entity_types_data(self, entity_object):
+        entity_types = []
+        for assertion_object in self._get_assertions(entity_object,
+                                                     'entity_type'):
+            entity_type_id = assertion_object.entity_type.entity_type_id
+            self._object_list['EntityTypeList'].add(entity_type_id)
+            entity_types.append(self._get_assertion_data(
+                assertion_object, entity_type=entity_type_id))
+        return entity_types
+
+    def _get_entity_notes_data(self, entity_object):
+        return [self._get_assertion_data(
+            assertion_object, note=assertion_object.note.note,
+            is_internal=assertion_object.note.is_internal)
+            for assertion_object in self._get_assertions(entity_object,
+                                                         'note')]
+
+    def _get_entity_references_data(self, entity_object):
+        return [self._get_assertion_data(
+            assertion_object, label=assertion_object.reference.label,
+            url=assertion_object.reference.url)
+            for assertion_object in self._get_assertions(entity_object,
+                                                         'reference')]
+
+    def _get_names_data(self, entity_object):
+        assertion_objects = self._get_assertions(entity_object, 'name')
+        preferred_name = None
+        if self._annotated and assertion_objects:
+            defaults = {'authority': self._user_profile.authority,
+                        'language': self._user_profile.language,
+                        'script': self._user_profile.script}
+            preferred_name = entity_object.get_single_name_object(defaults)
+        names = []
+        for assertion_object in assertion_objects:
+            name_object = assertion_object.name
+            self._object_list['NameType'].add(name_object.name_type_id)
+            self._object_list['Language'].add(name_object.language_id)
+            self._object_list['Script'].add(name_object.script_id)
+            name = self._get_assertion_data(
+                assertion_object, type=name_object.name_type_id,
+                language=name_object.language_id,
+                script=name_object.script_id,
+                display_form=name_object.display_form)
+            if name_object == preferred_name:
+                name['user_default'] = True
+            name_parts = []
+            for part_object in name_object.name_parts.all():
+                part = {'type': part_object.name_part_type_id,
+                        'name_part': part_object.name_part}
+                self._object_list['NamePartType'].add(
+                    part_object.name_part_type_id)
+                if part_object.language_id:
+                    part['language'] = part_object.language_id
+                    self._object_list['Language'].add(part_object.language_id)
+                if part_object.script_id:
+                    part['script'] = part_object.script_id
+                    self._object_list['Script'].add(part_object.script_id)
+                name_parts.append(part)
+            if name_parts:
+                name['name_parts'] = name_parts
+            name['assembled_form'] = name_object.get_assembled_form()
+            if self._full_details:
+                name['variant_forms'] = list(
+                    eats.names.compile_variants(name_object))
+            notes = self._get_notes_data(name_object.notes.all())
+            if notes:
+                name['notes'] = notes
+            names.append(name)
+        return names
+
+    def _get_entity_relationships_data(self, entity_object, is_primary):
+        relationships = []
+        for assertion_object in self._get_assertions(entity_object,
+                                                     'entity_relationship'):
+            relationship_object = assertion_object.entity_relationship
+            entity_id = relationship_object.related_entity_id
+            if not (is_primary or entity_id in self._primary_entity_ids):
+                continue
+            type_id = relationship_object.entity_relationship_type_id
+            self._object_list['EntityRelationshipType'].add(type_id)
+            self._object_list['Entity'].add(entity_id)
+            relationship = self._get_assertion_data(
+                assertion_object, type=type_id, related_entity=entity_id)
+            notes = self._get_notes_data(relationship_object.notes.all())
+            if notes:
+                relationship['notes'] = notes
+            relationships.append(relationship)
+        if is_primary:
+            self._object_list['Entity'].update(
+                self._relating_entity_ids.get(entity_object.id, []))
+        return relationships
+
+    def _get_name_relationships_data(self, entity_object):
+        relationships = []
+        for assertion_object in self._get_assertions(entity_object,
+                                                     'name_relationship'):
+            relationship_object = assertion_object.name_relationship
+            type_id = relationship_object.name_relationship_type_id
+            self._object_list['NameRelationshipType'].add(type_id)
+            relationships.append(self._get_assertion_data(
+                assertion_object, type=type_id,
+                name=relationship_object.name.assertion.id,
+                related_name=relationship_object.related_name.assertion.id))
+        return relationships
+
+    @staticmethod
+    def _get_notes_data(note_objects):
+        return [{'note': note_object.note,
+                 'is_internal': note_object.is_internal}
+                for note_object in note_objects]
+
+    def _get_dates_data(self, assertion_object):
+        dates = []
+        for date_object in assertion_object.dates.all():
+            self._object_list['DatePeriod'].add(date_object.date_period_id)
+            date = {'id': date_object.id,
+                    'period': date_object.date_period_id}
+            for date_part in DATE_PARTS:
+                raw = getattr(date_object, date_part)
+                if not raw:
+                    continue
+                calendar_id = getattr(date_object, date_part + '_calendar_id')
+                type_id = getattr(date_object, date_part + '_type_id')
+                self._object_list['Calendar'].add(calendar_id)
+                self._object_list['DateType'].add(type_id)
+                date[date_part] = {
+                    'raw': raw,
+                    'calendar': calendar_id,
+                    'date_type': type_id,
+                    'normalised': getattr(date_object,
+                                          date_part + '_normalised'),
+                    'confident': getattr(date_object,
+                                         date_part + '_confident')}
+            if date_object.note:
+                date['note'] = date_object.note
+            date['assembled_form'] = date_object.get_assembled_form(
+                self._get_default_calendar())
+            dates.append(date)
+        return dates
+
+    def _get_infrastructure_data(self):
+        """Return a dictionary of lists of the data of the referenced
+        infrastructure objects, keyed by the name of their type."""
+        data = {}
+        for model, name, fields in INFRASTRUCTURE_FIELDS:
+            model_name = model._meta.object_name
+            ids = sorted(self._object_list[model_name])
+            objects = []
+            for batch_ids in self._get_batches(ids):
+                for values in model.objects.filter(pk__in=batch_ids)\
+                        .order_by('pk').values('id', *fields):
+                    for field, referenced_model in \
+                            INFRASTRUCTURE_REFERENCES.items():
+                        if field in values:
+                            self._object_list[referenced_model].add(
+                                values[field])
+                    objects.append(values)
+            if objects:
+                data[name] = objects
+        if self._annotated:
+            self._annotate_infrastructure_data(data)
+        return data
+
+    def _annotate_infrastructure_data(self, data):
+        """Mark the user's preferred infrastructure objects in data."""
+        for object_type in USER_PREFERENCES:
+            object_id = getattr(self._user_profile, object_type + '_id')
+            for values in data.get(PREFERENCE_LISTS[object_type], []):
+                if values['id'] == object_id:
+                    values['user_default'] = True
@@ -0,0 +1,303 @@
+"""This module implements an import of an EATSML XML document into
+EATS that matches the authority records of the document, and through
+them its entities, to those already in EATS.
+
+Documents from other projects identify their authority records by
+their system ID or URL rather than by EATS ID. MatchingImporter
+resolves all of those records with a single query, and treats each
+new entity of the document that has an existence assertion by a
+matched record as the entity that the record asserts the existence
+of, so that its assertions are added to that entity rather than to a
+duplicate.
+
+The assertions of the existing entities are fetched together, and an
+incoming assertion whose content matches that of one already made by
+the same authority record for the same entity is not created again;
+it, and those of its dates that match existing dates, are instead
+annotated with the EATS IDs of the existing objects. Content is
+compared by a key made of the values of the fields of the property
+(or date), so that no object is queried for individually."""
+
+import logging
+
+from django.db.models import Q
+
+from eats.models import AuthorityRecord, Date, Entity, PropertyAssertion
+from eats.eatsml.bulk_importer import BULK_BATCH_SIZE, BulkImporter
+from eats.eatsml.importer import ASSERTION_PATHS, NSMAP, EATSImportError
+
+# The fields of each kind of property whose values make up its
+# content key, keyed by the name of the PropertyAssertion field.
+CONTENT_FIELDS = {
+    'existence': (),
+    'entity_type': ('entity_type_id',),
+    'note': ('note', 'is_internal'),
+    'reference': ('url', 'label'),
+    'name': ('name_type_id', 'language_id', 'script_id', 'display_form'),
+    'entity_relationship': ('entity_relationship_type_id',
+                            'related_entity_id'),
+    'name_relationship': ('name_relationship_type_id', 'name_id',
+                          'related_name_id'),
+}
+
+# The fields of a name part that make up part of the content key of
+# its name.
+NAME_PART_FIELDS = ('name_part_type_id', 'language_id', 'script_id',
+                    'name_part')
+
+# The fields of a date that make up its content key.
+DATE_FIELDS = tuple(field.attname for field in Date._meta.concrete_fields
+                    if field.name not in ('id', 'assertion'))
+
+
+class MatchingImporter (BulkImporter):
+
+    """Class implementing a bulk import of an EATSML XML document into
+    EATS that matches authority records, entities and assertions to
+    those already in EATS."""
+
+    def _import_authority_records(self, tree):
+        self._matched_record_ids = self._match_authority_records(tree)
+        # IDs of the entities of the document that already existed.
+        self._existing_entity_ids = set()
+        super(MatchingImporter, self)._import_authority_records(tree)
+
+    def _import_entity_objects(self, entity_elements):
+        self._match_entities(entity_elements)
+        self._existing_entity_ids.update(
+            self._get_element_eats_id(entity_element) for entity_element
+            in entity_elements if self._get_element_eats_id(entity_element))
+        super(MatchingImporter, self)._import_entity_objects(entity_elements)
+
+    def _import_assertions(self, entity_elements, start=0, total=None):
+        # The assertions are matched only now that the entities
+        # related to from entity_elements, even those of a later
+        # batch, are mapped, so that the content keys of the entity
+        # relationships have their related entity.
+        entity_ids = set(
+            self._get_element_eats_id(entity_element)
+            for entity_element in entity_elements).intersection(
+                self._existing_entity_ids)
+        self._match_assertions(entity_elements, entity_ids)
+        super(MatchingImporter, self)._import_assertions(
+            entity_elements, start, total)
+
+    def _match_authority_records(self, tree):
+        """Annotate each new authority record element in tree with the
+        EATS ID of the existing record with the same authority and
+        system ID (or, lacking an ID, system URL), and return the set
+        of the IDs of the matched records."""
+        record_elements = tree.xpath(
+            '/e:collection/e:authority_records/e:authority_record'
+            '[not(@eats_id)]', namespaces=NSMAP)
+        # Values to match, keyed by authority ID.
+        system_ids = {}
+        system_urls = {}
+        element_keys = []
+        for record_element in record_elements:
+            authority_id = self._get_referenced_eats_id(record_element,
+                                                        'authority')
+            system_id = self._get_text_from_XML(record_element,
+                                                'e:authority_system_id')
+            system_url = self._get_text_from_XML(record_element,
+                                                 'e:authority_system_url')
+            if system_id:
+                key = ('id', authority_id, system_id)
+                system_ids.setdefault(authority_id, set()).add(system_id)
+            elif system_url:
+                key = ('url', authority_id, system_url)
+                system_urls.setdefault(authority_id, set()).add(system_url)
+            else:
+                continue
+            element_keys.append((record_element, key))
+        if not element_keys:
+            return set()
+        query = Q()
+        for authority_id, values in system_ids.items():
+            query |= Q(authority_id=authority_id,
+                       authority_system_id__in=values)
+        for authority_id, values in system_urls.items():
+            query |= Q(authority_id=authority_id,
+                       authority_system_url__in=values)
+        records = {}
+        record_objects = self._objects.setdefault(AuthorityRecord, {})
+        for record in AuthorityRecord.objects.filter(query).order_by('pk'):
+            record_objects[record.id] = record
+            records.setdefault(('id', record.authority_id,
+                                record.authority_system_id), record)
+            records.setdefault(('url', record.authority_id,
+                                record.authority_system_url), record)
+        matched_record_ids = set()
+        for record_element, key in element_keys:
+            record = records.get(key)
+            if record is not None:
+                self._add_eats_id(record_element, record.id)
+                matched_record_ids.add(record.id)
+        logging.debug('Matched %d of %d authority records'
+                      % (len(matched_record_ids), len(element_keys)))
+        return matched_record_ids
+
+    def _match_entities(self, entity_elements):
+        """Annotate each new entity element of entity_elements that
+        has an existence assertion by a matched authority record with
+        the EATS ID of the entity that record asserts the existence
+        of."""
+        if not self._matched_record_ids:
+            return
+        record_entity_ids = {}
+        for record_ids in self._get_batches(self._matched_record_ids):
+            existences = PropertyAssertion.objects.filter(
+                authority_record_id__in=record_ids, existence__isnull=False)\
+                .values_list('authority_record_id', 'entity_id')
+            for record_id, entity_id in existences:
+                record_entity_ids.setdefault(record_id, set()).add(entity_id)
+        matched_entity_ids = set()
+        for entity_element in entity_elements:
+            if self._get_element_eats_id(entity_element):
+                continue
+            entity_ids = set()
+            for existence_element in entity_element.xpath(
+                    'e:existence_assertions/e:existence_assertion',
+                    namespaces=NSMAP):
+                record_id = self._get_referenced_eats_id(existence_element,
+                                                         'authority_record')
+                entity_ids.update(record_entity_ids.get(record_id, ()))
+            if len(entity_ids) > 1:
+                raise EATSImportError(
+                    'Entity with XML ID %s matches more than one entity '
+                    'in EATS, with EATS IDs %s' % (
+                        self._get_element_id(entity_element),
+                        ', '.join(map(str, sorted(entity_ids)))))
+            if entity_ids:
+                entity_id = entity_ids.pop()
+                self._add_eats_id(entity_element, entity_id)
+                matched_entity_ids.add(entity_id)
+        for entity_ids in self._get_batches(matched_entity_ids):
+            self._objects.setdefault(Entity, {}).update(
+                Entity.objects.in_bulk(entity_ids))
+        logging.debug('Matched %d entities' % (len(matched_entity_ids)))
+
+    def _match_assertions(self, entity_elements, entity_ids):
+        """Annotate each new assertion element of the existing
+        entities, with entity_ids, of entity_elements whose content
+        matches that of an existing assertion with the EATS ID of that
+        assertion, and likewise its dates."""
+        existing_assertions = self._get_existing_assertions(entity_ids)
+        # IDs of the Name objects of the existing name assertions,
+        # keyed by the XML ID of their elements.
+        name_ids = {}
+        count = 0
+        for entity_element in entity_elements:
+            entity_id = self._get_element_eats_id(entity_element)
+            if entity_id not in entity_ids:
+                continue
+            for field, path in ASSERTION_PATHS:
+                for element in entity_element.xpath(path, namespaces=NSMAP):
+                    xml_id = self._get_element_id(element)
+                    eats_id = self._get_element_eats_id(element)
+                    if eats_id:
+                        if field == 'name':
+                            name_ids[xml_id] = \
+                                self._get_name_id_from_assertion_id(eats_id)
+                        continue
+                    self._log_xml(field, element)
+                    authority_record_id = self._get_referenced_eats_id(
+                        element, 'authority_record')
+                    property_object = getattr(self, '_get_%s' % (field))(
+                        element, authority_record_id, xml_id)
+                    name_parts = None
+                    if field == 'name':
+                        name_parts = self._get_name_parts(
+                            element, None, authority_record_id)
+                    elif field == 'name_relationship':
+                        property_object.name_id = name_ids.get(
+                            element.get('name'))
+                        property_object.related_name_id = name_ids.get(
+                            element.get('related_name'))
+                    key = (entity_id, authority_record_id, field,
+                           self._get_content_key(field, property_object,
+                                                 name_parts))
+                    assertion_object = existing_assertions.get(key)
+                    if assertion_object is None:
+                        continue
+                    self._add_eats_id(element, assertion_object.id)
+                    if field == 'name':
+                        name_ids[xml_id] = assertion_object.name_id
+                    self._match_dates(element, assertion_object)
+                    count += 1
+        logging.debug('Matched %d assertions' % (count))
+
+    def _get_existing_assertions(self, entity_ids):
+        """Return the assertions of the entities with entity_ids,
+        keyed by entity ID, authority record ID, property field name
+        and content key, caching them for the checks of the
+        import."""
+        existing_assertions = {}
+        assertion_objects = self._objects.setdefault(PropertyAssertion, {})
+        fields = [field for field, path in ASSERTION_PATHS]
+        for batch_ids in self._get_batches(entity_ids):
+            assertions = PropertyAssertion.objects.filter(
+                entity_id__in=batch_ids).select_related(*fields)\
+                .prefetch_related('name__name_parts', 'dates')\
+                .order_by('pk')
+            for assertion_object in assertions:
+                assertion_objects[assertion_object.id] = assertion_object
+                for field in fields:
+                    property_object = getattr(assertion_object, field)
+                    if property_object is None:
+                        continue
+                    name_parts = None
+                    if field == 'name':
+                        name_parts = property_object.name_parts.all()
+                    key = (assertion_object.entity_id,
+                           assertion_object.authority_record_id, field,
+                           self._get_content_key(field, property_object,
+                                                 name_parts))
+                    existing_assertions.setdefault(key, assertion_object)
+                    break
+        return existing_assertions
+
+    def _match_dates(self, assertion_element, assertion_object):
+        """Annotate each new date element of assertion_element whose
+        content matches that of an existing date of assertion_object
+        with the EATS ID of that date."""
+        dates = {}
+        date_objects = self._objects.setdefault(Date, {})
+        for date_object in assertion_object.dates.all():
+            date_objects[date_object.id] = date_object
+            dates.setdefault(self._get_field_values(date_object,
+                                                    DATE_FIELDS),
+                             date_object)
+        for date_element in assertion_element.xpath(
+                'e:dates/e:date[not(@eats_id)]', namespaces=NSMAP):
+            date_object = dates.get(self._get_field_values(
+                self._get_date(date_element, assertion_object.id),
+                DATE_FIELDS))
+            if date_object is not None:
+                self._add_eats_id(date_element, date_object.id)
+
+    def _get_content_key(self, field, property_object, name_parts=None):
+        """Return a key of the content of property_object, the
+        property of a field assertion, and of its name_parts if it is
+        a name."""
+        key = self._get_field_values(property_object, CONTENT_FIELDS[field])
+        if name_parts is not None:
+            key += tuple(sorted(
+                self._get_field_values(part_object, NAME_PART_FIELDS)
+                for part_object in name_parts))
+        return key
+
+    @staticmethod
+    def _get_field_values(model_object, fields):
+        """Return a tuple of the values of fields of model_object, with
+        a missing value given as an empty string."""
+        return tuple('' if value is None else value for value in
+                     (getattr(model_object, field) for field in fields))
+
+    @staticmethod
+    def _get_batches(ids):
+        """Return the sorted ids in lists of no more than
+        BULK_BATCH_SIZE."""
+        ids = sorted(ids)
+        return [ids[start:start + BULK_BATCH_SIZE]
+                for start in range(0, len(ids), BULK_BATCH_SIZE)]
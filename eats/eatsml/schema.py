@@ -0,0 +1,83 @@
+"""This module provides the RelaxNG schema for EATSML, compiled once
+and shared by the exporter and importer, and the choice of whether an
+export is to be validated against it."""
+
+import logging
+from os.path import abspath, dirname, join
+import random
+import threading
+
+from lxml import etree
+from django.conf import settings
+
+# Full path to this directory.
+PATH = abspath(dirname(__file__))
+
+# RelaxNG schema.
+RNG_FILENAME = 'eatsml.rng'
+RNG_PATH = join(PATH, RNG_FILENAME)
+
+# Modes for the validation of exported documents, selected by the
+# EATS_EXPORT_VALIDATION setting. Imported documents are always
+# validated, whatever the mode.
+#
+# Validate every export.
+VALIDATE_ALWAYS = 'always'
+# Validate a random sample of exports, in the proportion given by the
+# EATS_EXPORT_VALIDATION_SAMPLE_RATE setting.
+VALIDATE_SAMPLED = 'sampled'
+# Validate every export except those made for the public read views.
+VALIDATE_NOT_FOR_READS = 'not_for_reads'
+DEFAULT_VALIDATION_MODE = VALIDATE_ALWAYS
+DEFAULT_SAMPLE_RATE = 0.01
+
+# Parsed schema documents, keyed by path, shared by all threads.
+_schema_documents = {}
+_schema_lock = threading.Lock()
+# Compiled validators, keyed by path. A validator records the errors
+# of its last validation on itself, so it must not be shared between
+# threads; each thread compiles its own, once.
+_local = threading.local()
+
+
+def get_relaxng(path=RNG_PATH):
+    """Return the compiled RelaxNG validator for the schema at path.
+
+    Arguments:
+    path -- optional path of the schema file
+
+    """
+    validators = getattr(_local, 'validators', None)
+    if validators is None:
+        validators = _local.validators = {}
+    relaxng = validators.get(path)
+    if relaxng is None:
+        with _schema_lock:
+            document = _schema_documents.get(path)
+            if document is None:
+                logging.debug('Parsing RelaxNG schema')
+                document = etree.parse(path)
+                _schema_documents[path] = document
+            relaxng = etree.RelaxNG(document)
+        validators[path] = relaxng
+    return relaxng
+
+
+def should_validate_export(for_read=False):
+    """Return True if an export should be validated, according to the
+    EATS_EXPORT_VALIDATION setting.
+
+    Arguments:
+    for_read -- optional Boolean indicating if the export is made for
+                one of the public read views
+
+    """
+    mode = getattr(settings, 'EATS_EXPORT_VALIDATION',
+                   DEFAULT_VALIDATION_MODE)
+    if mode == VALIDATE_SAMPLED:
+        rate = getattr(settings, 'EATS_EXPORT_VALIDATION_SAMPLE_RATE',
+                       DEFAULT_SAMPLE_RATE)
+        return random.random() < rate
+    if mode == VALIDATE_NOT_FOR_READS:
+        return not for_read
+    return True
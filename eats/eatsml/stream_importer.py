@@ -0,0 +1,275 @@
+"""This module implements the streaming import of an EATSML XML
+document into EATS.
+
+Rather than parsing the whole document, and a copy of it to annotate,
+the document is read twice with iterparse: once to note the IDs of its
+entities, and once to import it, the infrastructure first and then
+each entity as it is completed. The annotated document is written out
+as it is made, and each entity is discarded once written, so that the
+memory used depends on the size of the largest entity rather than of
+the document."""
+
+import copy
+import logging
+
+from lxml import etree
+from django.db import transaction
+
+from eats.models import Date, Entity, PropertyAssertion, \
+    PropertyAssertionValidator
+from eats.eatsml.importer import EATS, ENTITIES_PHASE, NSMAP, XML, \
+    EATSImportError, Importer
+
+
+class StreamImporter (Importer):
+
+    """Class implementing a streaming import of an EATSML XML document
+    into EATS."""
+
+    def import_stream(self, eatsml, output):
+        """Import XML data from eatsml into EATS, writing the document
+        annotated with the EATS IDs for the elements imported to
+        output, and return the number of entities imported.
+
+        Since each entity is validated only when it is reached, the
+        import is made in a single transaction.
+
+        Arguments:
+        eatsml -- filename or seekable binary file
+        output -- filename or binary file to write to
+
+        """
+        logging.debug('Starting streaming import')
+        self._assertion_validator = PropertyAssertionValidator()
+        self._objects = {}
+        self._current_element = None
+        self._read_entity_ids(eatsml)
+        with transaction.atomic():
+            count = self._import_stream(eatsml, output)
+        logging.debug('Imported %d entities' % (count))
+        return count
+
+    def _read_entity_ids(self, eatsml):
+        """Note the EATS ID, if any, of each entity in eatsml, keyed
+        by XML ID, and the XML IDs of the entities and names that may
+        be referenced from other entities."""
+        self._entity_eats_ids = {}
+        self._entity_xml_ids = set()
+        for event, element in self._iterparse(
+                eatsml, tag=(EATS + 'entity', EATS + 'name_assertion')):
+            xml_id = self._get_element_id(element)
+            self._entity_xml_ids.add(xml_id)
+            if element.tag == EATS + 'entity':
+                self._entity_eats_ids[xml_id] = \
+                    self._get_element_eats_id(element)
+            self._discard(element)
+        logging.debug('Read the IDs of %d entities'
+                      % (len(self._entity_eats_ids)))
+
+    def _import_stream(self, eatsml, output):
+        """Import eatsml, writing the annotated document to output,
+        and return the number of entities imported."""
+        events = self._iterparse(eatsml, events=('start', 'end'))
+        event, root = next(events)
+        count = 0
+        with etree.xmlfile(output, encoding='utf-8') as xml_file:
+            xml_file.write_declaration()
+            with xml_file.element(root.tag, dict(root.attrib),
+                                  nsmap=root.nsmap):
+                entities_element = self._import_stream_infrastructure(
+                    root, events, xml_file)
+                if entities_element is not None:
+                    # Entity relationships are imported with their
+                    # entities.
+                    total = len(self._entity_eats_ids)
+                    self._report_progress(ENTITIES_PHASE, 0, total)
+                    with xml_file.element(entities_element.tag):
+                        for event, element in events:
+                            if event == 'end' and \
+                                    element.tag == EATS + 'entity':
+                                self._import_stream_entity(element, xml_file)
+                                count += 1
+                                self._report_progress(ENTITIES_PHASE, count,
+                                                      total)
+                    if not count:
+                        raise EATSImportError(
+                            'RelaxNG validation of the import document '
+                            'failed: the entities element is empty')
+        return count
+
+    def _import_stream_infrastructure(self, root, events, xml_file):
+        """Import and write out the infrastructure of the document,
+        which precedes its entities, and return the entities element,
+        or None if there is none.
+
+        Arguments:
+        root -- root element of the document being parsed
+        events -- iterparse iterator, positioned after the start of root
+        xml_file -- lxml xmlfile context to write to
+
+        """
+        entities_element = None
+        for event, element in events:
+            if event == 'start' and element.tag == EATS + 'entities':
+                entities_element = element
+                break
+        # The infrastructure has now all been parsed. Validate it, and
+        # keep an unannotated copy of it, from which to take the
+        # infrastructure each entity is validated with.
+        self._skeleton = etree.Element(root.tag, dict(root.attrib),
+                                       nsmap=root.nsmap)
+        for child in root:
+            if child.tag != EATS + 'entities':
+                self._skeleton.append(copy.deepcopy(child))
+                self._prefetch_objects(child)
+        self._validate_skeleton(self._skeleton)
+        self._index_skeleton()
+        self._import_infrastructure(root.getroottree())
+        for child in list(root):
+            if child.tag != EATS + 'entities':
+                xml_file.write(child, pretty_print=True)
+                root.remove(child)
+        xml_file.flush()
+        return entities_element
+
+    def _import_stream_entity(self, entity_element, xml_file):
+        """Validate, import and write out entity_element, and then
+        discard it."""
+        self._validate_entity(entity_element)
+        self._prefetch_objects(entity_element)
+        self._import_entity(entity_element)
+        self._map_related_entities(entity_element)
+        relationship_elements = entity_element.xpath(
+            'e:entity_relationship_assertions/e:entity_relationship_assertion',
+            namespaces=NSMAP)
+        for relationship_element in relationship_elements:
+            self._import_entity_relationship(relationship_element)
+        xml_file.write(entity_element, pretty_print=True)
+        xml_file.flush()
+        self._discard(entity_element)
+        # Keep only the infrastructure objects, which later entities
+        # are likely to reference.
+        for model in (Date, Entity, PropertyAssertion):
+            self._objects.pop(model, None)
+
+    def _import_entity(self, entity_element):
+        # A new entity may already have been created when an earlier
+        # entity was related to it.
+        xml_id = self._get_element_id(entity_element)
+        eats_id = self._xml_object_map['entity'].get(xml_id)
+        if eats_id and not self._get_element_eats_id(entity_element):
+            self._add_eats_id(entity_element, eats_id)
+        super(StreamImporter, self)._import_entity(entity_element)
+
+    def _map_related_entities(self, entity_element):
+        """Map the XML ID of each entity related to that of
+        entity_element which has not yet been imported, creating the
+        entity if it is new."""
+        related_xml_ids = entity_element.xpath(
+            'e:entity_relationship_assertions/e:entity_relationship_assertion'
+            '/@related_entity', namespaces=NSMAP)
+        for xml_id in related_xml_ids:
+            if xml_id in self._xml_object_map['entity']:
+                continue
+            eats_id = self._entity_eats_ids.get(xml_id)
+            if eats_id:
+                self._check_object_exists(Entity, eats_id, xml_id)
+            else:
+                entity_object = Entity()
+                entity_object.save(create_existence=False)
+                eats_id = entity_object.id
+            self._create_mapping('entity', xml_id, eats_id)
+
+    def _index_skeleton(self):
+        """Note the position in the skeleton of each infrastructure
+        item (such as an authority or an authority record), keyed by
+        the XML IDs of it and its descendants."""
+        # Positions of the items, as a tuple of the index of their
+        # section and their index within it, keyed by XML ID.
+        self._item_positions = {}
+        # Items, keyed by position.
+        self._items = {}
+        for section_index, section in enumerate(self._skeleton):
+            for item_index, item in enumerate(section):
+                position = (section_index, item_index)
+                self._items[position] = item
+                for element in item.iter():
+                    xml_id = self._get_element_id(element)
+                    if xml_id is not None:
+                        self._item_positions[xml_id] = position
+
+    def _get_item_positions(self, element):
+        """Return the set of the positions of the infrastructure items
+        referenced by element, directly or through other items."""
+        positions = set()
+        pending = [element]
+        while pending:
+            for descendant in pending.pop().iter():
+                for name, value in descendant.items():
+                    position = self._item_positions.get(value)
+                    if name == XML + 'id' or position is None or \
+                            position in positions:
+                        continue
+                    positions.add(position)
+                    pending.append(self._items[position])
+        return positions
+
+    def _validate_entity(self, entity_element):
+        """Validate entity_element against the RelaxNG schema, in a
+        document with the infrastructure it references.
+
+        The infrastructure itself has already been validated, so only
+        the items the entity references, rather than all of them, are
+        copied into its document, and the cost of validating it does
+        not grow with the infrastructure. References to the other
+        entities of the document, and to their names, are pointed at
+        the entity itself, so that they resolve.
+
+        """
+        entity_copy = copy.deepcopy(entity_element)
+        xml_id = self._get_element_id(entity_copy)
+        local_ids = set(entity_copy.xpath('descendant-or-self::*/@xml:id'))
+        for element in entity_copy.iter():
+            for name, value in element.items():
+                if name != XML + 'id' and value in self._entity_xml_ids \
+                        and value not in local_ids:
+                    element.set(name, xml_id)
+        skeleton = etree.Element(self._skeleton.tag,
+                                 dict(self._skeleton.attrib),
+                                 nsmap=self._skeleton.nsmap)
+        positions = sorted(self._get_item_positions(entity_copy))
+        for section_index, section in enumerate(self._skeleton):
+            section_copy = None
+            for position in positions:
+                if position[0] != section_index:
+                    continue
+                if section_copy is None:
+                    section_copy = etree.SubElement(skeleton, section.tag,
+                                                    dict(section.attrib))
+                section_copy.append(copy.deepcopy(self._items[position]))
+        etree.SubElement(skeleton, EATS + 'entities').append(entity_copy)
+        self._validate_skeleton(skeleton)
+
+    def _validate_skeleton(self, skeleton):
+        """Validate the skeleton document, with root element
+        skeleton, against the RelaxNG schema."""
+        # The skeleton is reparsed so that the IDs of the elements
+        # copied into it are known to libxml2.
+        self._validate(etree.ElementTree(etree.fromstring(
+            etree.tostring(skeleton))))
+
+    @staticmethod
+    def _iterparse(eatsml, **kwargs):
+        """Return an iterparse iterator over eatsml, from its start."""
+        if hasattr(eatsml, 'seek'):
+            eatsml.seek(0)
+        return etree.iterparse(eatsml, remove_blank_text=True, **kwargs)
+
+    @staticmethod
+    def _discard(element):
+        """Free the memory used by element, and by any siblings
+        preceding it."""
+        element.clear(keep_tail=True)
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
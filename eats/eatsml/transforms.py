@@ -0,0 +1,210 @@
+"""This module implements the transformation of exported EATSML into
+XTM topic maps and EAC-CPF records.
+
+The transformed document for a single entity is cached under a key
+that changes whenever the data of the entity, or of an entity related
+to it, does. Transforms of all of the entities of an authority are
+made a batch of entities at a time, with the XSLT applied in a pool of
+threads; lxml releases the GIL while transforming, so the batches are
+transformed in parallel while the next ones are exported."""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from os.path import join
+import threading
+
+from lxml import etree
+
+from eats.models import Entity
+from eats.settings import app_path
+from eats.eatsml.cache import get_document, get_document_key, set_document
+from eats.eatsml.exporter import EATS, NSMAP, Exporter, StreamBuffer, \
+    get_related_entity_ids
+
+# Output formats.
+XTM = 'xtm'
+EAC = 'eac'
+EAC_GROUP = 'eac-group'
+
+XSLT_PATHS = {
+    XTM: join(app_path, 'xsl', 'eatsml-to-xtm.xsl'),
+    EAC: join(app_path, 'xsl', 'eatsml-to-eac-individual.xsl'),
+    EAC_GROUP: join(app_path, 'xsl', 'eatsml-to-eac-group.xsl'),
+}
+
+# Number of entities to export and transform together when
+# transforming all of the entities of an authority.
+BATCH_NUMBER = 100
+
+# Default number of threads to transform batches in.
+DEFAULT_WORKERS = 4
+
+# Parsed XSLT documents, keyed by output format, shared by all
+# threads. As with the RelaxNG schema, each thread compiles its own
+# stylesheets, once.
+_xslt_documents = {}
+_xslt_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_transform(output_format):
+    """Return the compiled XSLT producing output_format."""
+    transforms = getattr(_local, 'transforms', None)
+    if transforms is None:
+        transforms = _local.transforms = {}
+    transform = transforms.get(output_format)
+    if transform is None:
+        with _xslt_lock:
+            document = _xslt_documents.get(output_format)
+            if document is None:
+                document = etree.parse(XSLT_PATHS[output_format])
+                _xslt_documents[output_format] = document
+            transform = etree.XSLT(document)
+        transforms[output_format] = transform
+    return transform
+
+
+def apply_transform(output_format, root, parameters):
+    """Return the root element of the result of transforming the
+    EATSML root into output_format.
+
+    Arguments:
+    output_format -- string output format
+    root -- root Element of an EATSML document
+    parameters -- dictionary of string XSLT parameters
+
+    """
+    parameters = dict((name, etree.XSLT.strparam(value))
+                      for name, value in parameters.items())
+    return get_transform(output_format)(root, **parameters).getroot()
+
+
+def transform_entity(entity_object, output_format, **parameters):
+    """Return the serialised transform of the EATSML of entity_object
+    into output_format, from the cache if possible.
+
+    Arguments:
+    entity_object -- Entity object
+    output_format -- XTM or EAC
+    parameters -- string XSLT parameters
+
+    """
+    # The document includes the entities related to entity_object.
+    entity_ids = [entity_object.id] + list(get_related_entity_ids(
+        [entity_object.id]).values_list('pk', flat=True))
+    variant = '%s-%d-%s' % (
+        output_format, entity_object.id, hashlib.sha1(repr(
+            sorted(parameters.items())).encode('utf-8')).hexdigest())
+    key = get_document_key(entity_ids, variant)
+    xml = get_document(key)
+    if xml is None:
+        eatsml_root = Exporter(for_read=True).export_entities(
+            [entity_object])
+        result = apply_transform(output_format, eatsml_root, parameters)
+        xml = etree.tostring(result, encoding='utf-8', pretty_print=True)
+        set_document(key, xml)
+    return xml
+
+
+def stream_authority_transform(authority_id, output_format, parameters,
+                               workers=DEFAULT_WORKERS):
+    """Generate the UTF-8 encoded chunks of the transform into
+    output_format of the EATSML of every entity with an authority
+    record of the authority with authority_id.
+
+    For XTM, the topic maps of each batch are merged into one, with
+    the topics and associations repeated between batches written
+    once. For EAC-CPF, using the group stylesheet, the records for
+    each of the entities' authority records in the authority are
+    written in a single records element.
+
+    Arguments:
+    authority_id -- ID of an Authority
+    output_format -- XTM or EAC_GROUP
+    parameters -- dictionary of string XSLT parameters
+    workers -- optional number of threads to transform in
+
+    """
+    entity_ids = list(Entity.objects.filter(
+        assertions__authority_record__authority=authority_id).distinct()
+        .order_by('pk').values_list('pk', flat=True))
+    # The transform of an empty document provides the root element,
+    # and any content that does not depend on the entities.
+    empty_root = apply_transform(output_format, etree.Element(
+        EATS + 'collection', nsmap=NSMAP), parameters)
+    written = set()
+    buffer = StreamBuffer()
+    with ThreadPoolExecutor(workers) as executor, \
+            etree.xmlfile(buffer, encoding='utf-8') as xml_file:
+        xml_file.write_declaration()
+        with xml_file.element(empty_root.tag, nsmap=empty_root.nsmap):
+            _write_merged_children(xml_file, empty_root, written)
+            yield buffer.drain()
+            pending = deque()
+            for lower_bound in range(0, len(entity_ids), BATCH_NUMBER):
+                upper_bound = lower_bound + BATCH_NUMBER
+                # The export, which queries the database, is made in
+                # this thread, and only the transform in the pool.
+                eatsml_root = Exporter(for_read=True).export_entities(
+                    Entity.objects.filter(
+                        pk__in=entity_ids[lower_bound:upper_bound]))
+                if output_format == EAC_GROUP:
+                    _limit_to_authority(eatsml_root, authority_id)
+                pending.append(executor.submit(
+                    apply_transform, output_format, eatsml_root, parameters))
+                # Keep each thread busy with a batch while the next is
+                # exported.
+                while len(pending) > workers:
+                    _write_merged_children(
+                        xml_file, pending.popleft().result(), written)
+                    yield buffer.drain()
+            while pending:
+                _write_merged_children(xml_file, pending.popleft().result(),
+                                       written)
+                yield buffer.drain()
+    yield buffer.drain()
+
+
+def _limit_to_authority(eatsml_root, authority_id):
+    """Remove from eatsml_root the related entities, and the existence
+    assertions of authority records not of the authority with
+    authority_id, so that EAC-CPF records are made only for the
+    primary entities' records in that authority."""
+    authority = 'authority-%s' % (authority_id)
+    other_records = set(eatsml_root.xpath(
+        'e:authority_records/e:authority_record[@authority != $authority]/'
+        '@xml:id', namespaces={'e': NSMAP[None]}, authority=authority))
+    for entity_element in list(eatsml_root.iterfind(
+            '{0}entities/{0}entity'.format(EATS))):
+        if entity_element.get('is_related') is not None:
+            entity_element.getparent().remove(entity_element)
+            continue
+        for existence_element in list(entity_element.iterfind(
+                '{0}existence_assertions/{0}existence_assertion'.format(
+                    EATS))):
+            if existence_element.get('authority_record') in other_records:
+                existence_element.getparent().remove(existence_element)
+
+
+def _write_merged_children(xml_file, root, written):
+    """Write those children of root to xml_file that have not already
+    been written, and flush it.
+
+    A child with an id attribute is identified by it; others by their
+    serialisation.
+
+    Arguments:
+    xml_file -- lxml xmlfile context
+    root -- Element whose children are to be written
+    written -- set of the identifiers of the children already written
+
+    """
+    for child in root:
+        identifier = child.get('id')
+        if identifier is None:
+            identifier = hashlib.sha1(etree.tostring(child)).digest()
+        if identifier not in written:
+            written.add(identifier)
+            xml_file.write(child, pretty_print=True)
+    xml_file.flush()
@@ -661,6 +661,16 @@ class ImportForm (forms.Form):
 
     import_file = forms.FileField()
     description = forms.CharField(max_length=200)
+    match_records = forms.BooleanField(
+        required=False, label='Match authority records',
+        help_text='Add to the existing entities with the same authority '
+        'records, rather than creating new ones, and skip the properties '
+        'they already have.')
+
+
+class ResumeImportForm (forms.Form):
+
+    import_file = forms.FileField(label='Fixed import file')
 
 
 def create_choice_list(qs, default=False):
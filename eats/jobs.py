@@ -0,0 +1,529 @@
+"""This module implements the database backed queue of jobs run by
+the run_eats_worker management command, and the jobs that export
+EATSML and NDJSON and import EATSML.
+
+A job's handler is looked up by its kind in JOB_HANDLERS, and is
+called with the Job object. Export jobs write a gzip compressed file
+under MEDIA_ROOT; a request for an export of data that has not
+changed since a previous export reuses that export's job.
+
+Import jobs import a document spooled under MEDIA_ROOT in batches of
+entities, each in its own transaction, recording a checkpoint in the
+job with each; the XML ID maps of each checkpoint, which hold only
+the mappings of its transaction, are stored as a JobCheckpointPart,
+so that a checkpoint costs no more as the import goes on. A failed
+import job may be resumed from its checkpoint with a fixed document.
+Since their updates to the job are not seen until a transaction is
+committed, their progress is recorded in the cache while they run.
+Import jobs may instead be streamed, without checkpoints, where
+memory matters more than resuming.
+
+A running job records a heartbeat with its committed progress. A job
+whose heartbeat is older than the stale timeout is taken to have been
+abandoned by its worker, and is marked as failed, so that it is
+neither reused nor waited on forever."""
+
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+from os.path import exists, join, relpath
+import tempfile
+
+from lxml import etree
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from eats.models import Entity, Job, JobCheckpointPart, RegisteredImport, \
+    UserProfile, get_changed_entities
+from eats.eatsml.bulk_importer import BulkImporter, merge_checkpoints
+from eats.eatsml.cache import get_dataset_version, \
+    get_infrastructure_version
+from eats.eatsml.exporter import Exporter
+from eats.eatsml.importer import EATSImportError
+from eats.eatsml.json_exporter import JSONExporter
+from eats.eatsml.matching_importer import MatchingImporter
+from eats.eatsml.stream_importer import StreamImporter
+
+# Kinds of job.
+EXPORT_EATSML = 'export_eatsml'
+EXPORT_BASE_EATSML = 'export_base_eatsml'
+IMPORT_EATSML = 'import_eatsml'
+
+# Format of an entity export other than EATSML.
+NDJSON = 'ndjson'
+
+# Directory, relative to MEDIA_ROOT, holding the files produced by
+# export jobs.
+EXPORT_DIRECTORY = join('eats', 'exports')
+
+# Directory, relative to MEDIA_ROOT, holding the uploaded documents
+# waiting to be imported by import jobs, and the gzip compressed
+# documents of the imports made.
+IMPORT_DIRECTORY = join('eats', 'imports')
+
+# Number of bytes to read from a file at a time.
+CHUNK_SIZE = 64 * 1024
+
+# Number of entities an import job imports in each transaction,
+# unless set by the EATS_IMPORT_BATCH_SIZE setting.
+DEFAULT_IMPORT_BATCH_SIZE = 1000
+
+# Whether import jobs that do not match their documents to the data
+# in EATS are made with StreamImporter rather than in batches, unless
+# set by the EATS_STREAM_IMPORTS setting.
+DEFAULT_STREAM_IMPORTS = False
+
+# Cache key under which the progress of a running import job is
+# recorded, and the number of seconds for which it is kept.
+PROGRESS_KEY = 'eats-job-progress-%d'
+PROGRESS_TIMEOUT = 24 * 60 * 60
+
+# Cache key under which a running import job records its heartbeat
+# while it runs, and the minimum number of seconds between the
+# records. A streamed import commits nothing until it is complete, so
+# its updates to the job would not be seen.
+HEARTBEAT_KEY = 'eats-job-heartbeat-%d'
+HEARTBEAT_INTERVAL = 60
+
+# Number of pending jobs to try to claim at a time.
+CLAIM_BATCH_SIZE = 10
+
+# Number of seconds after its last heartbeat that a running job is
+# taken to have been abandoned, unless set by the
+# EATS_JOB_STALE_TIMEOUT setting.
+DEFAULT_JOB_STALE_TIMEOUT = 60 * 60
+
+# Message of a job marked as failed for having been abandoned.
+STALE_JOB_MESSAGE = 'The job was abandoned by its worker'
+
+# Fields of a job recorded when it finishes.
+FINISHED_FIELDS = ('status', 'message', 'finished', 'phase', 'progress',
+                   'total', 'artifact', 'checkpoint')
+
+
+def get_job_stale_timeout():
+    """Return the number of seconds after its last heartbeat that a
+    running job is taken to have been abandoned."""
+    return getattr(settings, 'EATS_JOB_STALE_TIMEOUT',
+                   DEFAULT_JOB_STALE_TIMEOUT)
+
+
+def fail_stale_jobs():
+    """Mark as failed the running jobs that have been abandoned, and
+    return their number.
+
+    A failed import job may then be resumed from its checkpoint.
+
+    """
+    now = timezone.now()
+    cutoff = now - datetime.timedelta(seconds=get_job_stale_timeout())
+    stale = Q(heartbeat__lt=cutoff)
+    # Jobs claimed before heartbeats were recorded have none.
+    stale |= Q(heartbeat__isnull=True, started__lt=cutoff)
+    stale_jobs = Job.objects.filter(stale, status=Job.RUNNING)
+    # A job may have recorded a later heartbeat in the cache.
+    keys = dict((HEARTBEAT_KEY % (job_id), job_id) for job_id
+                in stale_jobs.values_list('pk', flat=True))
+    live_ids = [keys[key] for key, heartbeat in cache.get_many(keys).items()
+                if heartbeat >= cutoff]
+    return stale_jobs.exclude(pk__in=live_ids).update(
+        status=Job.FAILED, message=STALE_JOB_MESSAGE, finished=now)
+
+
+def get_job_dataset_version(kind):
+    """Return a string identifying the version of the data that a job
+    of kind exports."""
+    if kind == EXPORT_BASE_EATSML:
+        # The base EATSML is built only from the infrastructure, so
+        # changes to entities do not make it stale.
+        return 'infrastructure-%d' % (get_infrastructure_version())
+    return str(get_dataset_version())
+
+
+def get_job_key(kind, parameters):
+    """Return the key identifying the artifact of a job of kind with
+    parameters."""
+    parameters = json.dumps(parameters, sort_keys=True)
+    return '%s:%s' % (kind, hashlib.sha1(parameters.encode('utf-8'))
+                      .hexdigest())
+
+
+def enqueue_job(kind, user, parameters, reusable=False):
+    """Return a Job of kind, with the JSON serialisable dictionary
+    parameters, queued for user.
+
+    Arguments:
+    kind -- string kind of job, a key of JOB_HANDLERS
+    user -- User object, or None for an anonymous request
+    parameters -- dictionary of arguments for the job
+    reusable -- optional Boolean indicating if an existing job that
+                has or will produce the same artifact from the same
+                data may be returned instead of a new job
+
+    """
+    key = get_job_key(kind, parameters)
+    dataset_version = ''
+    if reusable:
+        fail_stale_jobs()
+        dataset_version = get_job_dataset_version(kind)
+        jobs = Job.objects.filter(key=key, dataset_version=dataset_version)\
+            .exclude(status=Job.FAILED).order_by('-pk')
+        for job in jobs:
+            if job.status != Job.COMPLETE or \
+                    exists(get_artifact_path(job.artifact)):
+                return job
+    return Job.objects.create(
+        kind=kind, user=user, parameters=json.dumps(parameters), key=key,
+        dataset_version=dataset_version)
+
+
+def get_artifact_path(artifact):
+    """Return the full path of the job artifact at the path artifact,
+    relative to MEDIA_ROOT."""
+    return join(settings.MEDIA_ROOT, artifact)
+
+
+def claim_job():
+    """Return the oldest pending Job, marked as running, or None if
+    there are no pending jobs.
+
+    A job is claimed with an update conditional on its still being
+    pending, so that concurrent workers never run the same job.
+    Abandoned jobs are marked as failed first.
+
+    """
+    fail_stale_jobs()
+    while True:
+        job_ids = list(Job.objects.filter(status=Job.PENDING).order_by(
+            'pk').values_list('pk', flat=True)[:CLAIM_BATCH_SIZE])
+        if not job_ids:
+            return None
+        for job_id in job_ids:
+            now = timezone.now()
+            claimed = Job.objects.filter(pk=job_id, status=Job.PENDING)\
+                .update(status=Job.RUNNING, started=now, heartbeat=now)
+            if claimed:
+                return Job.objects.get(pk=job_id)
+
+
+def run_job(job):
+    """Run job, recording whether it completed or failed."""
+    handler = JOB_HANDLERS[job.kind]
+    logging.info('Running %s' % (job))
+    try:
+        handler(job)
+    except Exception as e:
+        logging.exception('%s failed' % (job))
+        job.status = Job.FAILED
+        job.message = str(e)
+    else:
+        job.status = Job.COMPLETE
+    job.finished = timezone.now()
+    # The job may meanwhile have been marked as failed for having been
+    # abandoned, and even queued again to be resumed, in which case
+    # its row belongs to whoever did so.
+    fields = dict((name, getattr(job, name)) for name in FINISHED_FIELDS)
+    if not Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+            **fields):
+        logging.warning('%s was no longer running when it finished, and '
+                        'its result was not recorded' % (job))
+        return
+    if job.status == Job.COMPLETE:
+        remove_superseded_artifacts(job)
+
+
+def remove_superseded_artifacts(job):
+    """Remove the artifacts of the complete jobs that job supersedes,
+    being those with the same key."""
+    superseded_jobs = Job.objects.filter(
+        key=job.key, status=Job.COMPLETE, pk__lt=job.pk).exclude(artifact='')
+    for superseded_job in superseded_jobs:
+        path = get_artifact_path(superseded_job.artifact)
+        if exists(path):
+            os.remove(path)
+        superseded_job.artifact = ''
+        superseded_job.save()
+
+
+def write_artifact(job, chunks, extension='xml'):
+    """Write the gzip compressed concatenation of chunks to the
+    artifact file of job.
+
+    Arguments:
+    job -- Job object
+    chunks -- iterator over bytes
+    extension -- optional file extension of the uncompressed content
+
+    """
+    artifact = join(EXPORT_DIRECTORY, 'job-%d.%s.gz' % (job.id, extension))
+    write_gzip_file(artifact, chunks)
+    job.artifact = artifact
+
+
+def write_gzip_file(relative_path, chunks):
+    """Write the gzip compressed concatenation of chunks to the file
+    at relative_path, relative to MEDIA_ROOT.
+
+    The file is written under a temporary name, and renamed once
+    complete, so that a partial file is never served.
+
+    """
+    path = get_artifact_path(relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = path + '.partial'
+    try:
+        with gzip.open(partial_path, 'wb') as gzip_file:
+            for chunk in chunks:
+                gzip_file.write(chunk)
+    except Exception:
+        os.remove(partial_path)
+        raise
+    os.rename(partial_path, path)
+
+
+def export_eatsml(job):
+    """Export the entities specified by the parameters of job, as
+    EATSML, pruned if its prune parameter is set, or, if its format
+    parameter is NDJSON, as NDJSON."""
+    parameters = json.loads(job.parameters)
+    entity_objects = Entity.objects.all()
+    authority_id = parameters.get('authority_id')
+    if authority_id is not None:
+        entity_objects = entity_objects.filter(
+            assertions__authority_record__authority=authority_id).distinct()
+    if parameters.get('since') is not None:
+        entity_objects = entity_objects.filter(pk__in=get_changed_entities(
+            parameters['since'], parameters['until']).values('pk'))
+    job.set_progress(0, entity_objects.count())
+    if parameters.get('format') == NDJSON:
+        chunks = JSONExporter().stream_entities(entity_objects,
+                                                progress=job.set_progress)
+        write_artifact(job, chunks, NDJSON)
+    else:
+        exporter = Exporter(prune=parameters.get('prune', False))
+        chunks = exporter.stream_entities(entity_objects,
+                                          progress=job.set_progress)
+        write_artifact(job, chunks)
+
+
+def export_base_eatsml(job):
+    """Export the infrastructure elements for the user of job."""
+    exporter = Exporter()
+    exporter.set_user(job.user)
+    root = exporter.export_infrastructure(limited=True, annotated=True)
+    write_artifact(job, [etree.tostring(root, encoding='utf-8',
+                                        xml_declaration=True,
+                                        pretty_print=True)])
+
+
+def get_base_eatsml_parameters(user):
+    """Return the parameters of a base EATSML export for user, which
+    include the preferences the export is annotated and limited by."""
+    profile = UserProfile.objects.get(user=user)
+    return {
+        'user_id': user.id,
+        'authority_ids': sorted(profile.editable_authorities.values_list(
+            'pk', flat=True)),
+        'preferences': [profile.authority_id, profile.language_id,
+                        profile.script_id, profile.calendar_id,
+                        profile.date_type_id, profile.date_period_id,
+                        profile.name_type_id],
+    }
+
+
+def spool_upload(uploaded_file):
+    """Write uploaded_file to a new file under MEDIA_ROOT, for an
+    import job, and return its path relative to MEDIA_ROOT."""
+    directory = join(settings.MEDIA_ROOT, IMPORT_DIRECTORY)
+    os.makedirs(directory, exist_ok=True)
+    handle, path = tempfile.mkstemp(prefix='upload-', suffix='.xml',
+                                    dir=directory)
+    with os.fdopen(handle, 'wb') as spool_file:
+        for chunk in uploaded_file.chunks():
+            spool_file.write(chunk)
+    return relpath(path, settings.MEDIA_ROOT)
+
+
+def get_job_progress(job):
+    """Return a dictionary of the phase, progress and total of job,
+    from the cache for a running job that records them there."""
+    progress = None
+    if job.status == Job.RUNNING:
+        progress = cache.get(PROGRESS_KEY % (job.id))
+    if progress is None:
+        progress = {'phase': job.phase, 'progress': job.progress,
+                    'total': job.total}
+    return progress
+
+
+def get_progress_recorder(job):
+    """Return a function recording the progress of job, which runs
+    within a transaction, in the cache.
+
+    The progress is also set on job, so that it is saved when the job
+    finishes. The job's heartbeat is recorded in the cache, at most
+    once every HEARTBEAT_INTERVAL seconds, so that a job whose
+    transaction outlasts the stale timeout is not taken to have been
+    abandoned.
+
+    """
+    last_heartbeat = None
+
+    def record_progress(phase, progress, total):
+        nonlocal last_heartbeat
+        job.phase, job.progress, job.total = phase, progress, total
+        cache.set(PROGRESS_KEY % (job.id),
+                  {'phase': phase, 'progress': progress, 'total': total},
+                  PROGRESS_TIMEOUT)
+        now = timezone.now()
+        due = last_heartbeat is None or \
+            (now - last_heartbeat).total_seconds() >= HEARTBEAT_INTERVAL
+        if due:
+            cache.set(HEARTBEAT_KEY % (job.id), now, PROGRESS_TIMEOUT)
+            last_heartbeat = now
+    return record_progress
+
+
+def get_checkpoint_recorder(job):
+    """Return a function recording the checkpoint of an import job,
+    within the transaction committing the work it records.
+
+    The maps of the checkpoint are stored as a JobCheckpointPart, and
+    the rest of it is set on job only once that transaction is
+    committed, so that saving the job after a failure does not record
+    work that was rolled back.
+
+    """
+    def record_checkpoint(checkpoint):
+        checkpoint = dict(checkpoint)
+        JobCheckpointPart.objects.create(
+            job=job, maps=json.dumps(checkpoint.pop('maps')))
+        data = json.dumps(checkpoint)
+        Job.objects.filter(pk=job.pk).update(checkpoint=data,
+                                             heartbeat=timezone.now())
+        transaction.on_commit(lambda: setattr(job, 'checkpoint', data))
+    return record_checkpoint
+
+
+def get_import_batch_size():
+    """Return the number of entities an import job imports in each
+    transaction."""
+    return getattr(settings, 'EATS_IMPORT_BATCH_SIZE',
+                   DEFAULT_IMPORT_BATCH_SIZE)
+
+
+def get_stream_imports():
+    """Return True if import jobs that do not match are streamed."""
+    return getattr(settings, 'EATS_STREAM_IMPORTS', DEFAULT_STREAM_IMPORTS)
+
+
+def import_eatsml(job):
+    """Import the EATSML document spooled for job, and store it, with
+    its annotated form, as the documents of the job's
+    RegisteredImport.
+
+    If the job's match parameter is true, the document's authority
+    records, entities and assertions are matched to those in EATS.
+
+    The import is made in batches, and resumes from the job's
+    checkpoint if it has one. A failure rolls back only the batch
+    being imported, and is reported with the XML ID of the element
+    being imported; the spooled document is kept until the import
+    succeeds.
+
+    If the EATS_STREAM_IMPORTS setting is true, a job that does not
+    match is instead made with StreamImporter, in a single
+    transaction, so that the memory it uses depends on the size of
+    the largest entity rather than of the document.
+
+    """
+    parameters = json.loads(job.parameters)
+    path = get_artifact_path(parameters['path'])
+    stream = get_stream_imports() and not parameters.get('match')
+    if stream:
+        eats_importer = StreamImporter(job.user,
+                                       progress=get_progress_recorder(job))
+    else:
+        importer_class = BulkImporter
+        if parameters.get('match'):
+            importer_class = MatchingImporter
+        checkpoint = None
+        if job.checkpoint:
+            checkpoints = [{'maps': json.loads(part.maps)} for part in
+                           job.checkpoint_parts.order_by('pk')]
+            checkpoint = json.loads(job.checkpoint)
+            checkpoint['maps'] = {}
+            checkpoint = merge_checkpoints(checkpoints + [checkpoint])
+        eats_importer = importer_class(
+            job.user, progress=get_progress_recorder(job),
+            batch_size=get_import_batch_size(), checkpoint=checkpoint,
+            save_checkpoint=get_checkpoint_recorder(job))
+    try:
+        with tempfile.TemporaryFile() as processed_file:
+            if stream:
+                eats_importer.import_stream(path, processed_file)
+            else:
+                processed_root = eats_importer.import_file(path)[1]
+                processed_file.write(etree.tostring(
+                    processed_root, encoding='utf-8', xml_declaration=True,
+                    pretty_print=True))
+            processed_file.seek(0)
+            registered_import = RegisteredImport.objects.get(job=job)
+            with open(path, 'rb') as spool_file:
+                registered_import.raw_document = store_import_document(
+                    registered_import, 'raw',
+                    iter(lambda: spool_file.read(CHUNK_SIZE), b''))
+            registered_import.processed_document = store_import_document(
+                registered_import, 'processed',
+                iter(lambda: processed_file.read(CHUNK_SIZE), b''))
+        registered_import.save()
+    except Exception as e:
+        xml_id = eats_importer.get_current_xml_id()
+        if xml_id is None or xml_id in str(e):
+            raise
+        raise EATSImportError('%s (while importing the element with XML '
+                              'ID %s)' % (e, xml_id)) from e
+    finally:
+        cache.delete_many([PROGRESS_KEY % (job.id), HEARTBEAT_KEY % (job.id)])
+    os.remove(path)
+    job.checkpoint_parts.all().delete()
+    job.checkpoint = ''
+
+
+def resume_import_job(job, path):
+    """Queue the failed import job to be run again, from its
+    checkpoint, on the document spooled at path, relative to
+    MEDIA_ROOT, replacing the document it failed on."""
+    parameters = json.loads(job.parameters)
+    old_path = get_artifact_path(parameters['path'])
+    if exists(old_path):
+        os.remove(old_path)
+    parameters['path'] = path
+    job.parameters = json.dumps(parameters)
+    job.status = Job.PENDING
+    job.message = ''
+    job.started = job.heartbeat = job.finished = None
+    job.save()
+
+
+def store_import_document(registered_import, kind, chunks):
+    """Write the gzip compressed concatenation of chunks as the kind
+    ("raw" or "processed") document of registered_import, and return
+    its path relative to MEDIA_ROOT."""
+    document = join(IMPORT_DIRECTORY, 'import-%d-%s.xml.gz'
+                    % (registered_import.id, kind))
+    write_gzip_file(document, chunks)
+    return document
+
+
+JOB_HANDLERS = {
+    EXPORT_EATSML: export_eatsml,
+    EXPORT_BASE_EATSML: export_base_eatsml,
+    IMPORT_EATSML: import_eatsml,
+}
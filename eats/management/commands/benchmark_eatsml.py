@@ -0,0 +1,62 @@
+"""Management command to benchmark the import and export of synthetic
+EATSML corpora, writing the results as JSON so that runs may be
+compared across commits."""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from eats.models import User
+from eats.eatsml.benchmark import run_benchmarks
+from eats.eatsml.importer import EATSImportError
+
+
+class Command (BaseCommand):
+
+    help = 'Generates EATSML corpora of the given sizes, and times their ' \
+        'import and export phase by phase, without keeping the data ' \
+        'imported.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', required=True,
+            help='Username of the user to make the imports as, who must be '
+            'able to add infrastructure')
+        parser.add_argument(
+            '--entities', type=int, nargs='+', default=[1000],
+            help='Number of entities in each corpus to benchmark '
+            '(default: 1000)')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed for the generation of the corpora (default: 0)')
+        parser.add_argument(
+            '--output', help='Path of the JSON file to write the results '
+            'to (default: standard output)')
+        parser.add_argument(
+            '--corpus-directory',
+            help='Path of a directory to keep the generated corpora in')
+        parser.add_argument(
+            '--trace-memory', action='store_true',
+            help='Trace the Python memory allocated in each phase, which '
+            'slows the benchmark')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('No user with username %s exists'
+                               % (options['user']))
+        if min(options['entities']) < 1:
+            raise CommandError('Each corpus must have at least one entity')
+        try:
+            results = run_benchmarks(
+                user, options['entities'], options['seed'],
+                options['trace_memory'], options['corpus_directory'])
+        except EATSImportError as e:
+            raise CommandError(str(e))
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
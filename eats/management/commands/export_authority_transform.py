@@ -0,0 +1,47 @@
+"""Management command to export all of the entities of an authority
+as an XTM topic map or as EAC-CPF records."""
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+
+from eats.models import Authority, Entity
+from eats.eatsml.transforms import DEFAULT_WORKERS, EAC_GROUP, XTM, \
+    stream_authority_transform
+from eats.views.main import get_base_psi_url
+
+FORMATS = {'xtm': XTM, 'eac': EAC_GROUP}
+
+
+class Command (BaseCommand):
+
+    help = 'Exports all of the entities of an authority as an XTM topic ' \
+        'map or as EAC-CPF records.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('authority_id', type=int,
+                            help='ID of the authority')
+        parser.add_argument('format', choices=sorted(FORMATS),
+                            help='Format to export in')
+        parser.add_argument('output', help='Path of the file to write')
+        parser.add_argument(
+            '--workers', type=int, default=DEFAULT_WORKERS,
+            help='Number of threads to transform in (default: %d)'
+            % (DEFAULT_WORKERS))
+
+    def handle(self, *args, **options):
+        try:
+            authority = Authority.objects.get(pk=options['authority_id'])
+        except Authority.DoesNotExist:
+            raise CommandError('There is no authority with ID %d'
+                               % (options['authority_id']))
+        output_format = FORMATS[options['format']]
+        if output_format == XTM:
+            # Only the path leading to an entity's ID is used.
+            parameters = {'base_psi_url': get_base_psi_url(Entity())}
+        else:
+            parameters = {'base_url': Site.objects.get_current().domain}
+        chunks = stream_authority_transform(
+            authority.id, output_format, parameters, options['workers'])
+        with open(options['output'], 'wb') as output_file:
+            for chunk in chunks:
+                output_file.write(chunk)
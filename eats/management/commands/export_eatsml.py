@@ -0,0 +1,142 @@
+"""Management command to export all EATS entities into an EATSML
+document, using several processes."""
+
+import multiprocessing
+import os
+from os.path import getsize, join
+import shutil
+import tempfile
+
+from lxml import etree
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from eats.models import Entity
+from eats.eatsml.exporter import Exporter
+from eats.eatsml.schema import get_relaxng
+
+# Number of ranges of entities to divide the export into for each
+# process, so that a process given a range of entities with much data
+# does not hold up the others.
+RANGES_PER_PROCESS = 4
+
+
+def get_entity_id_ranges(number):
+    """Return a list of up to number (lowest ID, highest ID) tuples
+    dividing the entities into ranges of nearly equal size, in order
+    of ID."""
+    size, remainder = divmod(Entity.objects.count(), number)
+    entity_ids = Entity.objects.order_by('pk').values_list('pk', flat=True)
+    ranges = []
+    upper_id = None
+    for index in range(number):
+        range_size = size + (index < remainder)
+        if not range_size:
+            break
+        # Each range starts after the last one ended, so that the
+        # query reads no more than the range's own IDs.
+        if upper_id is not None:
+            entity_ids = entity_ids.filter(pk__gt=upper_id)
+        lower_id = entity_ids[0]
+        upper_id = entity_ids[range_size - 1]
+        ranges.append((lower_id, upper_id))
+    return ranges
+
+
+def export_range(arguments):
+    """Export the entities in a range of IDs to a fragment file, and
+    return the IDs of the objects they reference.
+
+    Arguments:
+    arguments -- tuple of the lowest and highest entity IDs, the path
+                 of the fragment file, and whether to export full
+                 details
+
+    """
+    lower_id, upper_id, fragment_path, full_details = arguments
+    entity_objects = Entity.objects.filter(pk__gte=lower_id,
+                                           pk__lte=upper_id)
+    with open(fragment_path, 'wb') as fragment_file:
+        return Exporter().export_fragment(entity_objects, fragment_file,
+                                          full_details)
+
+
+class Command (BaseCommand):
+
+    help = 'Exports all entities into an EATSML document, dividing the ' \
+        'work between several processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the EATSML file to write')
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of processes to export with (default: the number '
+            'of CPUs)')
+        parser.add_argument(
+            '--full-details', action='store_true',
+            help='Export non-standard data, such as all constructed name '
+            'forms')
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Leave out the infrastructure data that the entities do '
+            'not reference, such as the defaults of authorities')
+        parser.add_argument(
+            '--validate', action='store_true',
+            help='Validate the written document against the EATSML '
+            'schema, which reads the whole document into memory')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        processes = options['processes']
+        if processes < 1:
+            raise CommandError('At least one process is required')
+        ranges = get_entity_id_ranges(processes * RANGES_PER_PROCESS)
+        fragment_directory = tempfile.mkdtemp(prefix='eats-export-')
+        try:
+            arguments = [
+                (lower_id, upper_id,
+                 join(fragment_directory, '%d.xml' % (index)),
+                 options['full_details'])
+                for index, (lower_id, upper_id) in enumerate(ranges)]
+            object_lists = self._export_ranges(arguments, processes)
+            fragment_paths = [argument[2] for argument in arguments
+                              if getsize(argument[2])]
+            with open(options['output'], 'wb') as xml_file:
+                Exporter(prune=options['prune']).write_fragments(
+                    xml_file, fragment_paths, object_lists)
+        finally:
+            shutil.rmtree(fragment_directory)
+        if options['validate']:
+            self._validate(options['output'])
+        self.stdout.write('Exported %d ranges of entities to %s'
+                          % (len(ranges), options['output']))
+
+    def _export_ranges(self, arguments, processes):
+        """Export each range of entities described in arguments, and
+        return the list of the IDs of the objects referenced by each."""
+        if processes == 1:
+            return [export_range(argument) for argument in arguments]
+        # The workers are forked, so that they inherit the configured
+        # Django, and must not share this process's database
+        # connections; each opens its own.
+        connections.close_all()
+        pool = multiprocessing.get_context('fork').Pool(processes)
+        try:
+            object_lists = []
+            for object_list in pool.imap(export_range, arguments):
+                object_lists.append(object_list)
+                if self.verbosity > 1:
+                    self.stdout.write('Exported %d of %d ranges'
+                                      % (len(object_lists), len(arguments)))
+        finally:
+            pool.close()
+            pool.join()
+        return object_lists
+
+    @staticmethod
+    def _validate(path):
+        relaxng = get_relaxng()
+        if not relaxng.validate(etree.parse(path)):
+            raise CommandError(
+                'RelaxNG validation of the export document failed: %s'
+                % (relaxng.error_log.last_error))
@@ -0,0 +1,78 @@
+"""Management command to import an EATSML document into EATS, reading
+it as a stream so that documents too large to hold in memory may be
+imported. With --dry-run, the document is only checked, and a report
+of the import is written instead. With --match, its authority records
+and entities are matched to those in EATS, which requires the whole
+document to be read into memory."""
+
+import json
+
+from lxml import etree
+from django.core.management.base import BaseCommand, CommandError
+
+from eats.models import User
+from eats.eatsml.importer import NSMAP, EATSImportError, Importer
+from eats.eatsml.matching_importer import MatchingImporter
+from eats.eatsml.stream_importer import StreamImporter
+
+
+class Command (BaseCommand):
+
+    help = 'Imports an EATSML document, writing the document annotated ' \
+        'with the EATS IDs of the objects imported.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Path of the EATSML file to import')
+        parser.add_argument(
+            'output', nargs='?',
+            help='Path of the annotated EATSML file to write')
+        parser.add_argument(
+            '--user', required=True,
+            help='Username of the user to make the import as')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Check the import without making it, and write a JSON '
+            'report of what it would create and of any problems')
+        parser.add_argument(
+            '--match', action='store_true',
+            help='Add to the existing entities with the same authority '
+            'records, rather than creating new ones, and skip the '
+            'properties they already have')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('No user with username %s exists'
+                               % (options['user']))
+        if options['dry_run']:
+            report = Importer(user).import_file(options['input'],
+                                                dry_run=True)
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+            return
+        if not options['output']:
+            raise CommandError('An output path is required unless making '
+                               'a dry run')
+        try:
+            if options['match']:
+                count = self._import_matching(user, options['input'],
+                                              options['output'])
+            else:
+                count = StreamImporter(user).import_stream(
+                    options['input'], options['output'])
+        except EATSImportError as e:
+            raise CommandError(str(e))
+        self.stdout.write('Imported %d entities from %s'
+                          % (count, options['input']))
+
+    @staticmethod
+    def _import_matching(user, input_path, output_path):
+        """Import the document at input_path with MatchingImporter,
+        writing the annotated document to output_path, and return the
+        number of entities imported."""
+        processed_root = MatchingImporter(user).import_file(input_path)[1]
+        etree.ElementTree(processed_root).write(
+            output_path, encoding='utf-8', xml_declaration=True,
+            pretty_print=True)
+        return len(processed_root.xpath('/e:collection/e:entities/e:entity',
+                                        namespaces=NSMAP))
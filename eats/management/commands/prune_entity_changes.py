@@ -0,0 +1,29 @@
+"""Management command to delete the recorded changes to entities that
+are older than the retention period, which is meant to be run
+regularly, since otherwise the changes are kept forever."""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from eats.models import get_changes_retention, prune_entity_changes
+
+
+class Command (BaseCommand):
+
+    help = 'Deletes the recorded changes to entities that are older than ' \
+        'the retention period. A client that last fetched the changes ' \
+        'before then must fetch the entities afresh.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Number of days for which to keep the changes (default: '
+            'the EATS_CHANGES_RETENTION setting, or %d)'
+            % (get_changes_retention()))
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is not None and days < 0:
+            raise CommandError('The number of days must not be negative')
+        count = prune_entity_changes(days)
+        if options['verbosity'] > 0:
+            self.stdout.write('Deleted %d changes' % (count))
@@ -0,0 +1,42 @@
+"""Management command to run the jobs queued in the database."""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from eats.jobs import claim_job, run_job
+
+# Default number of seconds to wait before checking again for jobs
+# when there are none.
+DEFAULT_POLL_INTERVAL = 5
+
+
+class Command (BaseCommand):
+
+    help = 'Runs the EATS jobs queued in the database, such as exports ' \
+        'and imports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once there are no more pending jobs')
+        parser.add_argument(
+            '--interval', type=float, default=DEFAULT_POLL_INTERVAL,
+            help='Seconds to wait between checks for new jobs (default: '
+            '%d)' % (DEFAULT_POLL_INTERVAL))
+
+    def handle(self, *args, **options):
+        while True:
+            # The worker runs indefinitely, so drop connections that
+            # have outlived their maximum age or failed.
+            close_old_connections()
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            run_job(job)
+            if options['verbosity'] > 0:
+                self.stdout.write('%s: %s' % (job, job.message or 'done'))
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Prefix of the IDs of authority records created by the default
+# scheme (see eats.models.DEFAULT_AUTHORITY_RECORD_PREFIX).
+PREFIX = 'entity-'
+
+
+def seed_sequences(apps, schema_editor):
+    """Create a sequence for each authority, starting after the
+    highest number used by its existing records."""
+    Authority = apps.get_model('eats', 'Authority')
+    AuthorityRecord = apps.get_model('eats', 'AuthorityRecord')
+    AuthorityRecordSequence = apps.get_model('eats', 'AuthorityRecordSequence')
+    for authority in Authority.objects.all():
+        last_number = 0
+        record_ids = AuthorityRecord.objects.filter(
+            authority=authority, authority_system_id__startswith=PREFIX)\
+            .values_list('authority_system_id', flat=True)
+        for record_id in record_ids:
+            suffix = record_id[len(PREFIX):]
+            if suffix.isdigit():
+                last_number = max(last_number, int(suffix))
+        AuthorityRecordSequence.objects.create(authority=authority,
+                                               last_number=last_number)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eats', '0002_auto_20200324_1425'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorityRecordSequence',
+            fields=[
+                ('authority', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='record_sequence', serialize=False, to='eats.Authority')),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
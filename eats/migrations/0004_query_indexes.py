@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eats', '0003_authorityrecordsequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='authorityrecord',
+            index=models.Index(fields=['authority', 'authority_system_url'], name='eats_record_url_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='propertyassertion',
+            index=models.Index(fields=['entity', 'authority_record'], name='eats_pa_entity_record_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='propertyassertion',
+            index=models.Index(condition=models.Q(existence__isnull=False), fields=['entity', 'authority_record'], name='eats_pa_existence_idx'),
+        ),
+    ]
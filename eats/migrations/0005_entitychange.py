@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eats', '0004_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntityChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_id', models.IntegerField()),
+                ('kind', models.CharField(choices=[('changed', 'Changed'), ('deleted', 'Deleted')], max_length=7)),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eats', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='phase',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='registeredimport',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='eats.Job'),
+        ),
+    ]
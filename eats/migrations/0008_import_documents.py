@@ -0,0 +1,86 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:45
+
+import gzip
+import os
+from os.path import join
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Directory, relative to MEDIA_ROOT, holding the import documents
+# (see eats.jobs.IMPORT_DIRECTORY).
+IMPORT_DIRECTORY = join('eats', 'imports')
+
+
+def store_documents(apps, schema_editor):
+    """Move the XML of each import out of the database into gzip
+    compressed files."""
+    RegisteredImport = apps.get_model('eats', 'RegisteredImport')
+    os.makedirs(join(settings.MEDIA_ROOT, IMPORT_DIRECTORY), exist_ok=True)
+    for registered_import in RegisteredImport.objects.iterator():
+        for kind in ('raw', 'processed'):
+            xml = getattr(registered_import, kind + '_xml')
+            if not xml:
+                continue
+            document = join(IMPORT_DIRECTORY, 'import-%d-%s.xml.gz'
+                            % (registered_import.id, kind))
+            with gzip.open(join(settings.MEDIA_ROOT, document),
+                           'wb') as document_file:
+                document_file.write(xml.encode('utf-8'))
+            setattr(registered_import, kind + '_document', document)
+        registered_import.save()
+
+
+def load_documents(apps, schema_editor):
+    """Move the XML of each import back into the database."""
+    RegisteredImport = apps.get_model('eats', 'RegisteredImport')
+    for registered_import in RegisteredImport.objects.iterator():
+        for kind in ('raw', 'processed'):
+            document = getattr(registered_import, kind + '_document')
+            if not document:
+                continue
+            with gzip.open(join(settings.MEDIA_ROOT, document),
+                           'rb') as document_file:
+                setattr(registered_import, kind + '_xml',
+                        document_file.read().decode('utf-8'))
+        registered_import.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eats', '0007_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registeredimport',
+            name='processed_document',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='registeredimport',
+            name='raw_document',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='registeredimport',
+            name='processed_xml',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='registeredimport',
+            name='raw_xml',
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(store_documents, load_documents),
+        migrations.RemoveField(
+            model_name='registeredimport',
+            name='processed_xml',
+        ),
+        migrations.RemoveField(
+            model_name='registeredimport',
+            name='raw_xml',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eats', '0008_import_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='checkpoint',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eats', '0010_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobCheckpointPart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('maps', models.TextField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoint_parts', to='eats.Job')),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+# Name searches match with istartswith and icontains, which PostgreSQL
+# evaluates as UPPER(name_form::text) LIKE ...; a trigram index on
+# that expression serves both the prefix and the infix patterns.
+#
+# The index needs the pg_trgm extension. Creating it requires a
+# superuser (or, from PostgreSQL 13, a user with CREATE privilege on
+# the database, pg_trgm being a trusted extension), so where the
+# migrations are run by another user it must first be created by one
+# with "CREATE EXTENSION pg_trgm;".
+CREATE_EXTENSION = 'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+
+# The index is built concurrently, so that writes to the table are
+# not blocked while it is built, which a transaction does not allow.
+# It may already exist from an earlier form of migration 0004.
+CREATE_SEARCH_NAME_INDEX = (
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS eats_searchname_form_trgm_idx '
+    'ON eats_searchname USING gin ((UPPER(name_form::text)) gin_trgm_ops)')
+
+DROP_SEARCH_NAME_INDEX = (
+    'DROP INDEX CONCURRENTLY IF EXISTS eats_searchname_form_trgm_idx')
+
+
+def run_postgresql(statement):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('eats', '0011_job_checkpoint_part'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgresql(CREATE_EXTENSION),
+                             migrations.RunPython.noop),
+        migrations.RunPython(run_postgresql(CREATE_SEARCH_NAME_INDEX),
+                             run_postgresql(DROP_SEARCH_NAME_INDEX)),
+    ]
@@ -1,13 +1,16 @@
 """Model definitions for EATS."""
 
-from datetime import datetime
-from django import forms
-from django.db import models
+from datetime import datetime, timedelta
+import weakref
+
+from django.db import models, transaction
 from django.db.models import Q
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.conf import settings
 
 import eats.names as namehandler
+from eats.eatsml.cache import increment_global_version
 
 
 def get_default_object(model, authority=None):
@@ -55,6 +58,34 @@ def get_new_authority_record_details(authority):
     authority -- Authority object
 
     """
+    function = _get_authority_record_function(authority)
+    return function(AuthorityRecord, authority)
+
+
+def reserve_authority_record_details(authority, count):
+    """Return a list of count dictionaries of ID and URL details, as
+    returned by get_new_authority_record_details, for new authority
+    records linked to authority.
+
+    For authorities using the default scheme, the whole block of IDs
+    is reserved at once, which makes this suitable for bulk imports.
+
+    Arguments:
+    authority -- Authority object
+    count -- number of sets of details to return
+
+    """
+    function = _get_authority_record_function(authority)
+    if function is not default_get_new_authority_record_details:
+        return [function(AuthorityRecord, authority) for i in range(count)]
+    numbers = reserve_authority_record_numbers(authority, count)
+    return [get_default_authority_record_details(number)
+            for number in numbers]
+
+
+def _get_authority_record_function(authority):
+    """Return the function used to generate the details of new
+    authority records for authority."""
     # Different authorities will have different algorithms for
     # determining new details, so use the appropriate function for
     # each.
@@ -67,7 +98,7 @@ def get_new_authority_record_details(authority):
             function = function_name
     except (AttributeError, KeyError):
         function = default_get_new_authority_record_details
-    return function(AuthorityRecord, authority)
+    return function
 
 
 def _import_function(function_name):
@@ -81,6 +112,11 @@ def _import_function(function_name):
     return getattr(temp, function)
 
 
+# Prefix of the IDs of authority records created by the default
+# scheme, which is followed by a six digit number.
+DEFAULT_AUTHORITY_RECORD_PREFIX = 'entity-'
+
+
 def default_get_new_authority_record_details(model, authority):
     """Return a tuple of id and URL for a new authority record. This
     function provides a default implementation.
@@ -90,22 +126,70 @@ def default_get_new_authority_record_details(model, authority):
     authority -- Authority object
 
     """
-    prefix = 'entity-'
-    try:
-        last_id = model.objects.filter(authority=authority).order_by(
-            '-authority_system_id')[0].authority_system_id
-    except IndexError:
-        last_id = '%s000000' % prefix
-    number = int(last_id[-6:]) + 1
-    id = '%s%06d' % (prefix, number)
+    number = reserve_authority_record_numbers(authority)[0]
+    return get_default_authority_record_details(number)
+
+
+def get_default_authority_record_details(number):
+    """Return the dictionary of ID and URL details for the authority
+    record with number under the default scheme."""
     # QAZ: add a sanity check that the generated ID does not already
     # exist, due to using multiple schemes over time for ID
     # generation.
+    id = '%s%06d' % (DEFAULT_AUTHORITY_RECORD_PREFIX, number)
     data = {'id': id, 'is_complete_id': True,
             'url': '%s.html' % (id), 'is_complete_url': False}
     return data
 
 
+def reserve_authority_record_numbers(authority, count=1):
+    """Return a range of count numbers for new authority records
+    linked to authority under the default scheme.
+
+    The numbers are taken from the authority's
+    AuthorityRecordSequence, which is locked for the duration of the
+    update, so that concurrent callers never receive the same number.
+
+    Arguments:
+    authority -- Authority object
+    count -- optional number of numbers to reserve
+
+    """
+    def get_initial_number():
+        # Only used the first time an authority's numbers are
+        # reserved, if the sequence was not created by migration.
+        record_ids = AuthorityRecord.objects.filter(
+            authority=authority).values_list('authority_system_id', flat=True)
+        return get_last_authority_record_number(record_ids)
+    with transaction.atomic():
+        sequence, created = AuthorityRecordSequence.objects\
+            .select_for_update().get_or_create(
+                authority=authority,
+                defaults={'last_number': get_initial_number})
+        first_number = sequence.last_number + 1
+        sequence.last_number += count
+        sequence.save(update_fields=['last_number'])
+    return range(first_number, first_number + count)
+
+
+def get_last_authority_record_number(record_ids):
+    """Return the highest number used in record_ids under the default
+    scheme, or 0 if there is none such.
+
+    Arguments:
+    record_ids -- iterable of authority system ID strings
+
+    """
+    last_number = 0
+    prefix_length = len(DEFAULT_AUTHORITY_RECORD_PREFIX)
+    for record_id in record_ids:
+        suffix = record_id[prefix_length:]
+        if record_id.startswith(DEFAULT_AUTHORITY_RECORD_PREFIX) and \
+                suffix.isdigit():
+            last_number = max(last_number, int(suffix))
+    return last_number
+
+
 class Authority (models.Model):
     """An authority is an individual, organisation or group that
     asserts some information about entities. It is not necessarily the
@@ -228,6 +312,12 @@ class AuthorityRecord (models.Model):
     class Meta:
         unique_together = (('authority', 'authority_system_id',
                             'authority_system_url'),)
+        # Lookups by authority and ID are served by the index for
+        # unique_together; lookups by authority and URL need their own.
+        indexes = [
+            models.Index(fields=['authority', 'authority_system_url'],
+                         name='eats_record_url_idx'),
+        ]
 
 
 class Entity (models.Model):
@@ -241,24 +331,7 @@ class Entity (models.Model):
     def delete(self):
         """Override the default delete method to handle the deletion of all of
         the properties associated with the entity."""
-        properties = []
-        for klass in (EntityType, EntityRelationship, Name,
-                      NameRelationship, EntityNote, EntityReference,
-                      GenericProperty):
-            properties.append(klass.objects.filter(assertion__entity=self))
-        # Also delete those properties that are associated with other
-        # entities but refer to self.
-        properties.append(EntityRelationship.objects.filter(
-            related_entity=self))
-        # QAZ: This should not be necessary, since name relationship
-        # are within names of the same entity.
-        properties.append(NameRelationship.objects.filter(
-            related_name__assertion__entity=self))
-        # Delete Existences last, since other properties depend on them.
-        properties.append(Existence.objects.filter(assertion__entity=self))
-        for object_property in properties:
-            object_property.delete()
-        super(Entity, self).delete()
+        delete_entities([self.id])
 
     def save(self, authority=None, create_existence=True, *args, **kwargs):
         """Override the default save method to allow for the automatic
@@ -449,6 +522,121 @@ class Entity (models.Model):
         verbose_name_plural = 'Entities'
 
 
+# The property fields of PropertyAssertion, in the order in which the
+# properties they link to can safely be deleted.
+ASSERTION_PROPERTY_FIELDS = ('name_relationship', 'entity_relationship',
+                             'name', 'entity_type', 'note', 'reference',
+                             'generic_property', 'existence')
+
+# Lookups from PropertyAssertion to the entities at either end of a
+# relationship property.
+RELATIONSHIP_ENTITY_LOOKUPS = (
+    'entity_relationship__related_entity',
+    'name_relationship__name__assertion__entity',
+    'name_relationship__related_name__assertion__entity',
+)
+
+# Maximum number of IDs to put into a single DELETE statement.
+DELETE_BATCH_SIZE = 500
+
+
+def delete_entities(entity_ids, dry_run=False):
+    """Delete the entities with entity_ids, along with all of their
+    properties and the relationships of other entities that refer to
+    them. Return a dictionary of the number of objects deleted (or to
+    be deleted, if dry_run), keyed by model name.
+
+    Each table is cleared with set-based DELETE statements inside a
+    single transaction, bypassing Django's deletion collector, which
+    loads every related object into memory in order to send signals.
+
+    Arguments:
+    entity_ids -- sequence of Entity IDs
+    dry_run -- optional Boolean indicating that nothing is to be
+               deleted, and only the counts reported
+
+    """
+    entity_ids = list(set(entity_ids))
+    property_fields = ASSERTION_PROPERTY_FIELDS
+    with transaction.atomic():
+        # Find every assertion that must go: those of the entities,
+        # and those of other entities with relationships pointing to
+        # them.
+        assertion_ids = []
+        # IDs of the entities of those assertions.
+        changed_ids = set()
+        property_ids = dict([(field, []) for field in property_fields])
+        for index in range(0, len(entity_ids), DELETE_BATCH_SIZE):
+            batch_ids = entity_ids[index:index + DELETE_BATCH_SIZE]
+            assertion_filter = Q(entity__in=batch_ids)
+            for lookup in RELATIONSHIP_ENTITY_LOOKUPS:
+                assertion_filter |= Q(**{lookup + '__in': batch_ids})
+            assertion_rows = PropertyAssertion.objects.filter(
+                assertion_filter).values_list('id', 'entity',
+                                              *property_fields)
+            for row in assertion_rows:
+                assertion_ids.append(row[0])
+                changed_ids.add(row[1])
+                for field, value in zip(property_fields, row[2:]):
+                    if value is not None:
+                        property_ids[field].append(value)
+        # An assertion may have been found from more than one batch.
+        assertion_ids = list(set(assertion_ids))
+        for field in property_fields:
+            property_ids[field] = list(set(property_ids[field]))
+        name_ids = property_ids['name']
+        # Delete in dependency order: objects hanging off assertions
+        # and properties, then the assertions, then the properties
+        # and finally the entities themselves.
+        plan = [
+            (Date, 'assertion', assertion_ids),
+            (Source, 'assertion', assertion_ids),
+            (SearchName, 'entity', entity_ids),
+            (NamePart, 'name', name_ids),
+            (NameNote, 'name', name_ids),
+            (EntityRelationshipNote, 'entity_relationship',
+             property_ids['entity_relationship']),
+            (PropertyAssertion, 'pk', assertion_ids),
+        ]
+        for field in property_fields:
+            model = PropertyAssertion._meta.get_field(field).related_model
+            plan.append((model, 'pk', property_ids[field]))
+        plan.append((Entity, 'pk', entity_ids))
+        counts = {}
+        for model, field, ids in plan:
+            count = 0
+            for index in range(0, len(ids), DELETE_BATCH_SIZE):
+                batch_ids = ids[index:index + DELETE_BATCH_SIZE]
+                lookup = {'%s__in' % field: batch_ids}
+                queryset = model.objects.filter(**lookup)
+                if dry_run:
+                    count += queryset.count()
+                else:
+                    count += queryset._raw_delete(queryset.db)
+            counts[model._meta.object_name] = count
+        if not dry_run:
+            record_entity_changes(changed_ids.difference(entity_ids))
+            record_entity_changes(entity_ids, EntityChange.DELETED)
+    if not dry_run:
+        # No signals are sent for the deleted objects, and entities
+        # other than those deleted may have lost relationships, so
+        # mark the cached EATSML of every entity as stale.
+        increment_global_version()
+    return counts
+
+
+class AuthorityRecordSequence (models.Model):
+    """The last number used for an authority's records under the
+    default authority record ID scheme."""
+    authority = models.OneToOneField(
+        Authority, primary_key=True, related_name='record_sequence',
+        on_delete=models.CASCADE)
+    last_number = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '%s: %d' % (self.authority.get_short_name(), self.last_number)
+
+
 class EntityTypeList (models.Model):
     entity_type = models.CharField(max_length=30)
     authority = models.ForeignKey(Authority, on_delete=models.CASCADE)
@@ -669,11 +857,18 @@ class Name (models.Model):
             entity = self.assertion.entity
         except AttributeError:
             return
-        language_code = self.language.language_code
-        script_code = self.script.script_code
         # First delete any existing search names for this name.
         self.search_names.all().delete()
         # Create the new search names and insert them.
+        for search_form in self.get_search_forms():
+            search_name = SearchName(entity=entity, name=self,
+                                     name_form=search_form)
+            search_name.save()
+
+    def get_search_forms(self):
+        """Return a list of the forms of name to search on."""
+        language_code = self.language.language_code
+        script_code = self.script.script_code
         search_forms = []
         if self.display_form:
             new_search_forms = namehandler.create_search_forms(
@@ -683,10 +878,7 @@ class Name (models.Model):
         new_search_forms = namehandler.create_search_forms(
             assembled_name, language_code, script_code)
         search_forms.extend(new_search_forms)
-        for search_form in search_forms:
-            search_name = SearchName(entity=entity, name=self,
-                                     name_form=search_form)
-            search_name.save()
+        return search_forms
 
     def __str__(self):
         return self.get_display_form()
@@ -878,49 +1070,124 @@ class PropertyAssertion (models.Model):
             klass = GenericProperty
         return klass._meta.verbose_name
 
-    def is_valid(self):
-        validity_check = PropertyAssertionValidationForm(
-            forms.model_to_dict(self))
-        return validity_check.is_valid()
+    def is_valid(self, validator=None):
+        """Return True if this assertion may be saved.
 
-    def save(self, *args, **kwargs):
+        Arguments:
+        validator -- optional PropertyAssertionValidator, whose memo
+                     of known existences is used and updated
+
+        """
+        if validator is None:
+            validator = PropertyAssertionValidator()
+        return validator.is_valid(self)
+
+    def save(self, *args, validator=None, **kwargs):
         # QAZ: Only one Existence is allowed per Entity and AuthorityRecord
         # combination - implement this.
         #
         # Model validation is what is required here; for now, fake it
-        # as per http://www.pointy-stick.com/blog/2008/10/15/
-        # django-tip-poor-mans-model-validation/
-        #
-        # Note that this does break in Django 1.2.
-        if not self.is_valid():
+        # with a check of the one invariant that the database does
+        # not enforce.
+        if validator is None:
+            validator = PropertyAssertionValidator()
+        if not self.is_valid(validator):
             raise Exception('Attempting to save an invalid model.')
-        return super(PropertyAssertion, self).save(*args, **kwargs)
+        result = super(PropertyAssertion, self).save(*args, **kwargs)
+        if self.existence_id is not None:
+            validator.add_existence(self.entity_id, self.authority_record_id)
+        return result
 
     def __str__(self):
         return 'assertion that entity %s has %s property authorised in %s' \
             % (self.entity, self.get_type(), self.authority_record)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['entity', 'authority_record'],
+                         name='eats_pa_entity_record_idx'),
+            # Supports the check for an existing Existence for an
+            # entity and authority record.
+            models.Index(fields=['entity', 'authority_record'],
+                         condition=Q(existence__isnull=False),
+                         name='eats_pa_existence_idx'),
+        ]
+
+
+class PropertyAssertionValidator (object):
+
+    """Validator for the invariant that a non-existence property
+    assertion may only be made by an authority record that is
+    associated with the same entity through an existence property
+    assertion.
+
+    The validator remembers every (entity, authority record) pair
+    that it has found or been told to have an existence, so that
+    repeated checks for the same pair cost no queries. Since a
+    remembered existence may be deleted by another transaction, a
+    validator should not be kept for longer than a single transaction
+    (an import, or the handling of a single request).
+
+    """
 
-class PropertyAssertionValidationForm (forms.ModelForm):
+    def __init__(self):
+        self._known_pairs = set()
 
-    """Form for performing model validation for property assertions,
-    until we get real model validation."""
+    def add_existence(self, entity_id, authority_record_id):
+        """Record that an existence property assertion exists for the
+        entity and authority record."""
+        self._known_pairs.add((entity_id, authority_record_id))
 
-    class Meta:
-        model = PropertyAssertion
-        fields = '__all__'
-
-    def clean(self):
-        authority_record = self.cleaned_data.get('authority_record')
-        entity = self.cleaned_data.get('entity')
-        if not self.cleaned_data.get('existence'):
-            existences = Existence.objects.filter(
-                assertion__entity=entity,
-                assertion__authority_record=authority_record)
-            if not existences.count():
-                raise forms.ValidationError(
-                    'an existence property assertion associated with this '
-                    'authority record must already exist')
+    def is_valid(self, assertion):
+        """Return True if the PropertyAssertion assertion is valid."""
+        return not self.get_invalid_assertions([assertion])
+
+    def get_invalid_assertions(self, assertions):
+        """Return a list of those of assertions that are invalid.
+
+        All of the (entity, authority record) pairs not already known
+        are checked with a single query. Existence assertions among
+        assertions count towards the validity of the other members of
+        the batch, so the batch must be saved as a whole.
+
+        Arguments:
+        assertions -- sequence of unsaved or changed PropertyAssertion
+                      objects
+
+        """
+        invalid = []
+        pending = []
+        for assertion in assertions:
+            if assertion.entity_id is None or \
+                    assertion.authority_record_id is None:
+                invalid.append(assertion)
+            elif assertion.existence_id is not None:
+                self.add_existence(assertion.entity_id,
+                                   assertion.authority_record_id)
+            else:
+                pending.append(assertion)
+        pending = [assertion for assertion in pending
+                   if self._get_key(assertion) not in self._known_pairs]
+        if pending:
+            entity_ids = set([assertion.entity_id for assertion in pending])
+            record_ids = set([assertion.authority_record_id
+                              for assertion in pending])
+            # This may find pairs that were not asked about (from the
+            # cross product of the two ID sets), but those are just as
+            # true and are worth remembering.
+            existences = PropertyAssertion.objects.filter(
+                existence__isnull=False, entity_id__in=entity_ids,
+                authority_record_id__in=record_ids).values_list(
+                    'entity_id', 'authority_record_id')
+            self._known_pairs.update(existences)
+            invalid.extend([assertion for assertion in pending
+                            if self._get_key(assertion) not in
+                            self._known_pairs])
+        return invalid
+
+    @staticmethod
+    def _get_key(assertion):
+        return (assertion.entity_id, assertion.authority_record_id)
 
 
 class DatePeriod (models.Model):
@@ -1083,10 +1350,9 @@ class Date (models.Model):
         return affix
 
     @staticmethod
-    def _get_calendar_affix(calendar):
+    def _get_calendar_affix(calendar, default_calendar):
         """Return a date affix based on the calendar."""
         affix = ''
-        default_calendar = get_default_object(Calendar)
         if calendar != default_calendar:
             affix = ' (%s calendar)' % (calendar)
         return affix
@@ -1098,12 +1364,13 @@ class Date (models.Model):
             affix = 'fl. '
         return affix
 
-    def _assemble_date_part(self, date_part):
+    def _assemble_date_part(self, date_part, default_calendar):
         """Return a string form of a date part (point date, end
         terminus post, etc).
 
         Arguments:
         date_part -- string name of date part
+        default_calendar -- Calendar object for which no affix is added
 
         """
         assembled_date_part = ''
@@ -1114,24 +1381,26 @@ class Date (models.Model):
             confidence_affix = self._get_confidence_affix(
                 getattr(self, date_part + '_confident'))
             calendar_affix = self._get_calendar_affix(
-                getattr(self, date_part + '_calendar'))
+                getattr(self, date_part + '_calendar'), default_calendar)
             assembled_date_part = '%s%s%s%s' % (
                 type_affix, date, confidence_affix, calendar_affix)
         return assembled_date_part
 
-    def _assemble_date_segment(self, date_segment):
+    def _assemble_date_segment(self, date_segment, default_calendar):
         """Return a string form of a date segment (start, end, or point).
 
         Arguments:
         date_segment -- string name of date segment
+        default_calendar -- Calendar object for which no affix is added
 
         """
-        date = self._assemble_date_part(date_segment + '_date')
+        date = self._assemble_date_part(date_segment + '_date',
+                                        default_calendar)
         if not date:
             post_date = self._assemble_date_part(
-                date_segment + '_terminus_post')
+                date_segment + '_terminus_post', default_calendar)
             ante_date = self._assemble_date_part(
-                date_segment + '_terminus_ante')
+                date_segment + '_terminus_ante', default_calendar)
             if post_date:
                 date = 'at or after %s' % post_date
                 if ante_date:
@@ -1140,13 +1409,24 @@ class Date (models.Model):
                 date = '%sat or before %s' % (date, ante_date)
         return date
 
-    def __str__(self):
+    def get_assembled_form(self, default_calendar=None):
+        """Return a string form of the date.
+
+        Arguments:
+        default_calendar -- optional Calendar object for which no
+                            affix is added; defaults to the
+                            system-wide default calendar
+
+        """
+        if default_calendar is None:
+            default_calendar = get_default_object(Calendar)
         if self.point_date or self.point_terminus_post or \
            self.point_terminus_ante:
-            date = self._assemble_date_segment('point')
+            date = self._assemble_date_segment('point', default_calendar)
         else:
-            start_date = self._assemble_date_segment('start')
-            end_date = self._assemble_date_segment('end')
+            start_date = self._assemble_date_segment('start',
+                                                     default_calendar)
+            end_date = self._assemble_date_segment('end', default_calendar)
             date = '%s \N{EN DASH} %s' % (start_date, end_date)
         if date:
             period_prefix = self._get_period_affix()
@@ -1156,6 +1436,9 @@ class Date (models.Model):
             date = '[unspecified]'
         return date
 
+    def __str__(self):
+        return self.get_assembled_form()
+
 
 class Source (models.Model):
     assertion = models.ForeignKey(PropertyAssertion, on_delete=models.CASCADE)
@@ -1196,6 +1479,243 @@ class UserProfile (models.Model):
 class RegisteredImport (models.Model):
     importer = models.ForeignKey(User, on_delete=models.CASCADE)
     description = models.CharField(max_length=200)
-    raw_xml = models.TextField()
-    processed_xml = models.TextField()
+    # Paths, relative to MEDIA_ROOT, of the gzip compressed imported
+    # document and of that document annotated with the EATS IDs of
+    # the objects created; blank until the import has been made.
+    raw_document = models.CharField(max_length=255, blank=True)
+    processed_document = models.CharField(max_length=255, blank=True)
     import_date = models.DateTimeField(auto_now_add=True)
+    # The job that performs the import, which fills in the XML.
+    job = models.ForeignKey('Job', blank=True, null=True,
+                            on_delete=models.SET_NULL)
+
+
+class EntityChange (models.Model):
+    """A change to the data of an entity, recorded so that clients
+    mirroring EATS can fetch only what has changed since they last
+    did so. The ID of a change serves as the token from which the
+    next request for changes continues."""
+    CHANGED = 'changed'
+    DELETED = 'deleted'
+    KIND_CHOICES = ((CHANGED, 'Changed'), (DELETED, 'Deleted'))
+    # Not a foreign key, since deleted entities are recorded.
+    entity_id = models.IntegerField()
+    kind = models.CharField(max_length=7, choices=KIND_CHOICES)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return 'Entity %d %s at %s' % (self.entity_id, self.kind,
+                                       self.timestamp)
+
+
+# Number of seconds within which a change is taken to be committed
+# once it is recorded, unless set by the EATS_CHANGES_SAFETY_LAG
+# setting.
+DEFAULT_CHANGES_SAFETY_LAG = 30
+
+
+# Number of days for which recorded changes are kept by the
+# prune_entity_changes command, unless set by the
+# EATS_CHANGES_RETENTION setting. A client that last fetched the
+# changes before then may have missed some, and must fetch the
+# entities afresh.
+DEFAULT_CHANGES_RETENTION = 90
+
+
+def get_changes_safety_lag():
+    """Return the number of seconds within which a change is taken to
+    be committed once it is recorded."""
+    return getattr(settings, 'EATS_CHANGES_SAFETY_LAG',
+                   DEFAULT_CHANGES_SAFETY_LAG)
+
+
+class PendingEntityChanges (object):
+    """The changes to entities made in a transaction, which are
+    recorded once it is committed."""
+
+    def __init__(self):
+        self.kinds = {}
+
+    def __call__(self):
+        EntityChange.objects.bulk_create(
+            [EntityChange(entity_id=entity_id, kind=kind)
+             for entity_id, kind in sorted(self.kinds.items())])
+
+
+def record_entity_changes(entity_ids, kind=EntityChange.CHANGED):
+    """Record a change of kind to each of the entities with IDs
+    entity_ids, once the current transaction, if any, is committed.
+
+    The changes made in a transaction are recorded together, with one
+    change per entity, in a statement of their own. A change is
+    therefore never held back, uncommitted, for the length of the
+    transaction, while later changes are committed and read.
+
+    """
+    if not entity_ids:
+        return
+    connection = transaction.get_connection()
+    # The connection keeps only a weak reference to the pending
+    # changes, whose callback is otherwise referenced only by the
+    # transaction. They are therefore gone once the callback has been
+    # run on commit, or discarded with the transaction or savepoint
+    # they were first made in.
+    pending_ref = getattr(connection, 'eats_entity_changes', None)
+    pending = pending_ref and pending_ref()
+    is_new = pending is None
+    if is_new:
+        pending = PendingEntityChanges()
+        connection.eats_entity_changes = weakref.ref(pending)
+    for entity_id in entity_ids:
+        pending.kinds[entity_id] = kind
+    if is_new:
+        transaction.on_commit(pending)
+
+
+def get_changes_retention():
+    """Return the number of days for which recorded changes are
+    kept."""
+    return getattr(settings, 'EATS_CHANGES_RETENTION',
+                   DEFAULT_CHANGES_RETENTION)
+
+
+def prune_entity_changes(days=None):
+    """Delete the changes recorded more than days, by default the
+    retention, days ago, and return the number deleted."""
+    if days is None:
+        days = get_changes_retention()
+    cutoff = timezone.now() - timedelta(days=days)
+    return EntityChange.objects.filter(timestamp__lt=cutoff).delete()[0]
+
+
+def get_changes_watermark(since=0):
+    """Return the ID of the last change that is certainly committed,
+    along with every change before it, or since if no change after
+    since is.
+
+    A change recorded within the safety lag may yet be preceded by
+    one with a lower ID that is not yet committed, and so is not
+    included.
+
+    """
+    cutoff = timezone.now() - timedelta(seconds=get_changes_safety_lag())
+    watermark = EntityChange.objects.filter(
+        pk__gt=since, timestamp__lte=cutoff).aggregate(
+            last=models.Max('pk'))['last']
+    return watermark or since
+
+
+def get_entity_changes(since=0, limit=None, until=None):
+    """Return a tuple of the sorted IDs of the entities changed and of
+    those deleted after the change with ID since, the ID of the last
+    change included, and whether there are further changes beyond it.
+
+    An entity that was changed and then deleted is only listed as
+    deleted. Only changes up to the watermark are included.
+
+    Arguments:
+    since -- optional ID of the last change already known
+    limit -- optional maximum number of changes to include
+    until -- optional ID of the last change to include
+
+    """
+    watermark = get_changes_watermark(since)
+    if until is not None:
+        watermark = min(watermark, until)
+    changes = EntityChange.objects.filter(pk__gt=since, pk__lte=watermark)
+    changes = changes.order_by('pk').values_list('pk', 'entity_id', 'kind')
+    if limit is not None:
+        # Fetch one more change than is wanted, to find whether
+        # there are more.
+        changes = list(changes[:limit + 1])
+        more = len(changes) > limit
+        changes = changes[:limit]
+    else:
+        more = False
+    kinds = {}
+    token = since
+    for token, entity_id, kind in changes:
+        kinds[entity_id] = kind
+    changed_ids = sorted(entity_id for entity_id, kind in kinds.items()
+                         if kind == EntityChange.CHANGED)
+    deleted_ids = sorted(entity_id for entity_id, kind in kinds.items()
+                         if kind == EntityChange.DELETED)
+    return changed_ids, deleted_ids, token, more
+
+
+def get_changed_entities(since, until):
+    """Return a QuerySet of the existing entities changed after the
+    change with ID since, up to and including the change with ID
+    until."""
+    changed_ids = EntityChange.objects.filter(
+        pk__gt=since, pk__lte=until).values('entity_id')
+    return Entity.objects.filter(pk__in=changed_ids)
+
+
+class Job (models.Model):
+    """A task queued to be run by the run_eats_worker command, rather
+    than within a request."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((PENDING, 'Pending'), (RUNNING, 'Running'),
+                      (COMPLETE, 'Complete'), (FAILED, 'Failed'))
+    kind = models.CharField(max_length=30)
+    # The user who requested the job, if not anonymous.
+    user = models.ForeignKey(User, blank=True, null=True,
+                             on_delete=models.CASCADE)
+    # JSON encoded arguments for the job.
+    parameters = models.TextField(blank=True)
+    # Jobs with the same key and dataset version produce the same
+    # artifact.
+    key = models.CharField(max_length=255)
+    dataset_version = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES,
+                              default=PENDING)
+    # The stage of the job that progress and total count the items
+    # of, for jobs with more than one.
+    phase = models.CharField(max_length=20, blank=True)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True)
+    # Path of the file produced by the job, relative to MEDIA_ROOT.
+    artifact = models.CharField(max_length=255, blank=True)
+    # JSON encoded record of the work committed by a job that may be
+    # resumed if it fails. The XML ID maps of an import job's
+    # checkpoint are held in its JobCheckpointParts.
+    checkpoint = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    # When the running job last recorded committed progress, by which
+    # an abandoned job is recognised.
+    heartbeat = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status'], name='eats_job_status_idx'),
+            models.Index(fields=['key', 'dataset_version'],
+                         name='eats_job_key_idx'),
+        ]
+
+    def __str__(self):
+        return '%s job %d (%s)' % (self.kind, self.id, self.status)
+
+    def set_progress(self, progress, total=None):
+        """Record the progress of the running job."""
+        self.progress = progress
+        fields = {'progress': progress, 'heartbeat': timezone.now()}
+        if total is not None:
+            self.total = fields['total'] = total
+        Job.objects.filter(pk=self.pk).update(**fields)
+
+
+class JobCheckpointPart (models.Model):
+    """The XML ID to EATS ID mappings made in one transaction of an
+    import job, which together with those of its other transactions
+    make up the maps of its checkpoint."""
+    job = models.ForeignKey(Job, on_delete=models.CASCADE,
+                            related_name='checkpoint_parts')
+    # JSON encoded maps, keyed by map name.
+    maps = models.TextField()
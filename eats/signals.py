@@ -0,0 +1,116 @@
+"""Signal handlers that mark the cached EATSML of entities and of the
+infrastructure elements as stale, and record the entities as changed,
+when the data their EATSML is built from changes."""
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from eats.eatsml.cache import increment_entity_versions, \
+    increment_global_version, increment_infrastructure_version
+from eats.models import Authority, AuthorityRecord, Calendar, Date, \
+    DatePeriod, DateType, Entity, EntityChange, EntityNote, \
+    EntityReference, EntityRelationship, EntityRelationshipNote, \
+    EntityRelationshipType, EntityType, EntityTypeList, Existence, \
+    GenericProperty, Language, Name, NameNote, NamePart, NamePartType, \
+    NameRelationship, NameRelationshipType, NameType, PropertyAssertion, \
+    Script, SystemNamePartType, record_entity_changes
+
+# Models whose objects are used in the EATSML of many entities.
+SHARED_MODELS = (Authority, Calendar, DatePeriod, DateType, Language,
+                 NamePartType, Script, SystemNamePartType)
+
+# Models whose objects are exported as infrastructure elements.
+INFRASTRUCTURE_MODELS = (Authority, Calendar, DatePeriod, DateType,
+                         EntityRelationshipType, EntityTypeList, Language,
+                         NamePartType, NameRelationshipType, NameType,
+                         Script, SystemNamePartType)
+
+# Property models, whose objects belong to the entity of their
+# assertion.
+PROPERTY_MODELS = (EntityNote, EntityReference, EntityType, Existence,
+                   GenericProperty, Name, NameRelationship)
+
+
+def _get_assertion_entity_ids(property_object):
+    """Return a list of the ID of the entity of property_object's
+    assertion, or an empty list if it has none (yet, or any more)."""
+    try:
+        return [property_object.assertion.entity_id]
+    except (AttributeError, ObjectDoesNotExist):
+        return []
+
+
+def get_entity_ids(instance):
+    """Return a list of the IDs of the entities whose EATSML includes
+    instance."""
+    if isinstance(instance, Entity):
+        return [instance.id]
+    if isinstance(instance, AuthorityRecord):
+        return list(PropertyAssertion.objects.filter(
+            authority_record=instance).values_list(
+                'entity_id', flat=True).distinct())
+    if isinstance(instance, PropertyAssertion):
+        entity_ids = [instance.entity_id]
+        if instance.entity_relationship_id:
+            entity_ids.extend(get_entity_ids(instance.entity_relationship))
+        return entity_ids
+    if isinstance(instance, EntityRelationship):
+        # The related entity's EATSML records which entities relate
+        # to it.
+        return [instance.related_entity_id] + \
+            _get_assertion_entity_ids(instance)
+    if isinstance(instance, Date):
+        return [instance.assertion.entity_id]
+    if isinstance(instance, (NameNote, NamePart)):
+        return _get_assertion_entity_ids(instance.name)
+    if isinstance(instance, EntityRelationshipNote):
+        return _get_assertion_entity_ids(instance.entity_relationship)
+    return _get_assertion_entity_ids(instance)
+
+
+def mark_entities_changed(sender, instance, **kwargs):
+    try:
+        entity_ids = get_entity_ids(instance)
+    except ObjectDoesNotExist:
+        # The object's entity has already been deleted.
+        return
+    increment_entity_versions(entity_ids)
+    record_entity_changes(entity_ids)
+
+
+def mark_entity_deleted(sender, instance, **kwargs):
+    increment_entity_versions([instance.id])
+    record_entity_changes([instance.id], EntityChange.DELETED)
+
+
+def mark_shared_data_changed(sender, instance, **kwargs):
+    increment_global_version()
+
+
+def mark_infrastructure_changed(sender, **kwargs):
+    increment_infrastructure_version()
+
+
+for model in (Date, EntityRelationship, EntityRelationshipNote, NameNote,
+              NamePart, PropertyAssertion) + PROPERTY_MODELS:
+    post_save.connect(mark_entities_changed, sender=model)
+    post_delete.connect(mark_entities_changed, sender=model)
+
+post_save.connect(mark_entities_changed, sender=Entity)
+post_delete.connect(mark_entity_deleted, sender=Entity)
+
+# Deleting an authority record deletes its assertions, which mark
+# their entities as changed.
+post_save.connect(mark_entities_changed, sender=AuthorityRecord)
+
+for model in SHARED_MODELS:
+    post_save.connect(mark_shared_data_changed, sender=model)
+    post_delete.connect(mark_shared_data_changed, sender=model)
+
+for model in INFRASTRUCTURE_MODELS:
+    post_save.connect(mark_infrastructure_changed, sender=model)
+    post_delete.connect(mark_infrastructure_changed, sender=model)
+
+# A language's system name part types are saved after the language.
+m2m_changed.connect(mark_infrastructure_changed,
+                    sender=Language.system_name_part_types.through)
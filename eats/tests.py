@@ -1,11 +1,21 @@
 import unittest
 import eats.testsuites.names as names
+import eats.testsuites.corpus as corpus
 import eats.testsuites.imports as imports
+import eats.testsuites.exports as exports
+import eats.testsuites.jobs as jobs
+import eats.testsuites.models as models
+import eats.testsuites.query_plans as query_plans
 
 
 def suite():
     suites = []
     suites.append(names.suite())
     suites.append(imports.suite())
+    suites.append(exports.suite())
+    suites.append(jobs.suite())
+    suites.append(models.suite())
+    suites.append(query_plans.suite())
+    suites.append(corpus.suite())
     all_tests = unittest.TestSuite(suites)
     return all_tests
@@ -0,0 +1,89 @@
+"""Tests of the generation of synthetic EATSML corpora, and of the
+benchmark of their import and export."""
+
+import io
+import tracemalloc
+import unittest
+
+from lxml import etree
+from django.core.management import call_command
+
+from eats.models import Entity, Language, User
+from eats.eatsml.benchmark import run_benchmarks
+from eats.eatsml.corpus import generate_corpus, get_existing_ids
+from eats.eatsml.importer import NSMAP, Importer
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(CorpusTestCase('test_generate_corpus'))
+    suite.addTest(CorpusTestCase('test_existing_ids'))
+    suite.addTest(CorpusTestCase('test_benchmark'))
+    suite.addTest(CorpusTestCase('test_benchmark_trace_memory'))
+    return suite
+
+
+class CorpusTestCase (unittest.TestCase):
+
+    def setUp(self):
+        call_command('flush', verbosity=0, interactive=False)
+        self._user = User(username='superuser', email='superuser@example.org',
+                          password='', is_staff=True, is_active=True,
+                          is_superuser=True)
+        self._user.save()
+
+    @staticmethod
+    def _generate(entity_count, seed=0, existing_ids=None):
+        """Return the root element of a generated corpus."""
+        corpus = io.BytesIO()
+        generate_corpus(corpus, entity_count, seed, existing_ids)
+        return etree.fromstring(corpus.getvalue())
+
+    def test_generate_corpus(self):
+        root = self._generate(40, seed=3)
+        Importer._validate(root.getroottree())
+        self.assertEqual(len(root.xpath('e:entities/e:entity',
+                                        namespaces=NSMAP)), 40)
+        # The same seed generates the same corpus.
+        self.assertEqual(etree.tostring(root),
+                         etree.tostring(self._generate(40, seed=3)))
+        self.assertNotEqual(etree.tostring(root),
+                            etree.tostring(self._generate(40, seed=4)))
+
+    def test_existing_ids(self):
+        language = Language(language_code='en', language_name='English')
+        language.save()
+        root = self._generate(5, existing_ids=get_existing_ids())
+        self.assertEqual(root.xpath('e:languages/e:language/@eats_id',
+                                    namespaces=NSMAP), [str(language.id)])
+        processed_root = Importer(self._user).import_file(
+            io.BytesIO(etree.tostring(root)))[1]
+        self.assertEqual(Language.objects.count(), 2)
+        self.assertEqual(len(processed_root.xpath(
+            'e:entities/e:entity[@eats_id]', namespaces=NSMAP)), 5)
+
+    def test_benchmark(self):
+        results = run_benchmarks(self._user, [10, 20])
+        self.assertEqual([run['entities'] for run in results['runs']],
+                         [10, 20])
+        run = results['runs'][0]
+        self.assertEqual(run['exported_entities'], 10)
+        self.assertEqual(
+            [phase['phase'] for phase in run['import']['phases']],
+            ['parse', 'infrastructure', 'entities', 'relationships'])
+        self.assertEqual(
+            [phase['phase'] for phase in run['export']['phases']][0],
+            'entities')
+        self.assertEqual(run['import']['queries'], sum(
+            phase['queries'] for phase in run['import']['phases']))
+        self.assertTrue(run['import']['queries'] > 0)
+        # The data imported is not kept.
+        self.assertEqual(Entity.objects.count(), 0)
+
+    def test_benchmark_trace_memory(self):
+        run = run_benchmarks(self._user, [10], trace_memory=True)['runs'][0]
+        phases = run['import']['phases'] + run['export']['phases']
+        for phase in phases:
+            self.assertTrue(phase['peak_traced_kb'] >= phase['traced_kb'])
+        self.assertTrue(max(phase['peak_traced_kb'] for phase in phases) > 0)
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+from io import StringIO
+from os.path import abspath, dirname, join
+import shutil
+import tempfile
+import threading
+import unittest
+
+from lxml import etree
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from eats.models import Authority, Calendar, DatePeriod, DateType, Entity, \
+    EntityRelationship, Language, Name, NameType, PropertyAssertion, Script, \
+    User, UserProfile, delete_entities
+from eats.eatsml.cache import get_fragment_keys, get_fragments
+import eats.eatsml.importer as importer
+import eats.eatsml.exporter as exporter
+import eats.eatsml.json_exporter as json_exporter
+import eats.eatsml.schema as schema
+import eats.eatsml.transforms as transforms
+from eats.management.commands.export_eatsml import get_entity_id_ranges
+from eats.views.main import get_response_format, lookup
+
+# Full path to this directory.
+PATH = abspath(dirname(__file__))
+
+# Caches for the tests that count queries, so that the cache is not
+# itself queried, as the database cache of the test settings would be.
+LOCAL_MEMORY_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'eats-tests',
+    }
+}
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(StreamedExportTestCase('test_stream_matches_tree'))
+    suite.addTest(StreamedExportTestCase('test_stream_batches'))
+    suite.addTest(QueryCountTestCase('test_query_count'))
+    suite.addTest(QueryCountTestCase('test_keyset_batches'))
+    suite.addTest(QueryCountTestCase('test_ordered_batches'))
+    suite.addTest(FragmentCacheTestCase('test_cached_export'))
+    suite.addTest(FragmentCacheTestCase('test_changed_entity'))
+    suite.addTest(FragmentCacheTestCase('test_uncommitted_change'))
+    suite.addTest(FragmentCacheTestCase('test_rolled_back_change'))
+    suite.addTest(FragmentCacheTestCase('test_deleted_entities'))
+    suite.addTest(ParallelExportTestCase('test_entity_id_ranges'))
+    suite.addTest(ParallelExportTestCase('test_export_command'))
+    suite.addTest(TransformTestCase('test_cached_entity_transform'))
+    suite.addTest(TransformTestCase('test_changed_infrastructure_transform'))
+    suite.addTest(TransformTestCase('test_authority_transform'))
+    suite.addTest(InfrastructureCacheTestCase('test_cached_infrastructure'))
+    suite.addTest(InfrastructureCacheTestCase('test_changed_infrastructure'))
+    suite.addTest(JSONExportTestCase('test_json_matches_eatsml'))
+    suite.addTest(JSONExportTestCase('test_ndjson_stream'))
+    suite.addTest(JSONExportTestCase('test_response_format'))
+    suite.addTest(PruneTestCase('test_matches_xslt'))
+    suite.addTest(PruneTestCase('test_stream_matches_tree'))
+    suite.addTest(PruneTestCase('test_lookup'))
+    suite.addTest(SchemaTestCase('test_shared_schema'))
+    suite.addTest(SchemaTestCase('test_validation_modes'))
+    return suite
+
+
+class ExportTestCase (unittest.TestCase):
+
+    """Base class for tests that export the data in import1.xml and
+    import2.xml."""
+
+    def setUp(self):
+        call_command('flush', verbosity=0, interactive=False)
+        cache.clear()
+        user = User(username='superuser', first_name='super', last_name='user',
+                    email='superuser@example.org', password='', is_staff=True,
+                    is_active=True, is_superuser=True)
+        user.save()
+        eats_importer = importer.Importer(user)
+        eats_importer.import_file(join(PATH, 'import1.xml'))
+        eats_importer.import_file(join(PATH, 'import2.xml'))
+
+    @staticmethod
+    def get_c14n_string(root):
+        """Return the canonical form of root, ignoring whitespace."""
+        parser = etree.XMLParser(remove_blank_text=True)
+        root = etree.fromstring(etree.tostring(root), parser)
+        return etree.tostring(root, method='c14n')
+
+
+class StreamedExportTestCase (ExportTestCase):
+
+    def _get_streamed_root(self, entity_objects):
+        chunks = exporter.Exporter().stream_entities(entity_objects)
+        return etree.fromstring(b''.join(chunks))
+
+    def test_stream_matches_tree(self):
+        entity_objects = Entity.objects.all()
+        expected = exporter.Exporter().export_entities(entity_objects)
+        result = self._get_streamed_root(entity_objects)
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+    def test_stream_batches(self):
+        # Export a single entity, so that the document includes
+        # related entities, a batch at a time.
+        entity_objects = Entity.objects.filter(
+            pk=Entity.objects.order_by('pk')[0].pk)
+        expected = exporter.Exporter().export_entities(entity_objects)
+        batch_number = exporter.BATCH_NUMBER
+        exporter.BATCH_NUMBER = 1
+        try:
+            chunks = list(exporter.Exporter().stream_entities(entity_objects))
+        finally:
+            exporter.BATCH_NUMBER = batch_number
+        self.assertTrue(len(chunks) > 3)
+        result = etree.fromstring(b''.join(chunks))
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+
+class LocalMemoryCacheTestCase (ExportTestCase):
+
+    """Base class for export tests that count queries, which use a
+    local memory cache whatever the configured cache."""
+
+    def setUp(self):
+        self.cache_settings = override_settings(CACHES=LOCAL_MEMORY_CACHES)
+        self.cache_settings.enable()
+        super(LocalMemoryCacheTestCase, self).setUp()
+
+    def tearDown(self):
+        self.cache_settings.disable()
+
+
+class QueryCountTestCase (LocalMemoryCacheTestCase):
+
+    def _get_query_count(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            exporter.Exporter().export_entities(Entity.objects.all())
+        return len(context.captured_queries)
+
+    def test_query_count(self):
+        # The number of queries should not depend on the number of
+        # entities in a batch.
+        expected = self._get_query_count()
+        authority = Authority.objects.all()[0]
+        for i in range(5):
+            Entity().save(authority=authority)
+        self.assertEqual(self._get_query_count(), expected)
+
+    def test_keyset_batches(self):
+        entity_objects = Entity.objects.all()
+        expected = exporter.Exporter().export_entities(entity_objects)
+        batch_number = exporter.BATCH_NUMBER
+        exporter.BATCH_NUMBER = 1
+        try:
+            with CaptureQueriesContext(connection) as context:
+                result = exporter.Exporter().export_entities(entity_objects)
+        finally:
+            exporter.BATCH_NUMBER = batch_number
+        for query in context.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+    def test_ordered_batches(self):
+        # The order of an ordered QuerySet is kept across batches.
+        entity_objects = Entity.objects.order_by('-pk')
+        batch_number = exporter.BATCH_NUMBER
+        exporter.BATCH_NUMBER = 1
+        try:
+            result = exporter.Exporter().export_entities(entity_objects)
+        finally:
+            exporter.BATCH_NUMBER = batch_number
+        entity_ids = [int(eats_id) for eats_id in result.xpath(
+            'e:entities/e:entity/@eats_id', namespaces=importer.NSMAP)]
+        self.assertEqual(entity_ids, list(entity_objects.values_list(
+            'pk', flat=True)))
+
+
+class FragmentCacheTestCase (ExportTestCase):
+
+    def _export(self, entity_objects):
+        with CaptureQueriesContext(connection) as context:
+            root = exporter.Exporter().export_entities(entity_objects)
+        return root, len(context.captured_queries)
+
+    def test_cached_export(self):
+        entity_objects = Entity.objects.all()
+        expected, uncached_count = self._export(entity_objects)
+        result, cached_count = self._export(entity_objects)
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+        self.assertTrue(cached_count < uncached_count)
+        # The streamed export assembles the same fragments.
+        streamed = etree.fromstring(b''.join(
+            exporter.Exporter().stream_entities(entity_objects)))
+        self.assertEqual(self.get_c14n_string(streamed),
+                         self.get_c14n_string(expected))
+
+    def test_changed_entity(self):
+        name = Name.objects.all()[0]
+        entity_objects = Entity.objects.filter(pk=name.assertion.entity_id)
+        self._export(entity_objects)
+        name.display_form = 'Changed display form'
+        name.save()
+        result, count = self._export(entity_objects)
+        self.assertEqual(len(result.xpath(
+            '//e:display_form[. = "Changed display form"]',
+            namespaces={'e': exporter.EATS_NAMESPACE})), 1)
+
+    def test_uncommitted_change(self):
+        name = Name.objects.all()[0]
+        entity_id = name.assertion.entity_id
+        entity_objects = Entity.objects.filter(pk=entity_id)
+        self._export(entity_objects)
+        keys = get_fragment_keys([entity_id], '')
+        with transaction.atomic():
+            name.display_form = 'Changed display form'
+            name.save()
+            # Until the change is committed, a reader would cache the
+            # data from before it, and so must use the old version.
+            self.assertEqual(get_fragment_keys([entity_id], ''), keys)
+        self.assertNotEqual(get_fragment_keys([entity_id], ''), keys)
+        result, count = self._export(entity_objects)
+        self.assertEqual(len(result.xpath(
+            '//e:display_form[. = "Changed display form"]',
+            namespaces={'e': exporter.EATS_NAMESPACE})), 1)
+
+    def test_rolled_back_change(self):
+        name = Name.objects.all()[0]
+        entity_id = name.assertion.entity_id
+        entity_objects = Entity.objects.filter(pk=entity_id)
+        keys = get_fragment_keys([entity_id], '')
+        try:
+            with transaction.atomic():
+                name.display_form = 'Rolled back display form'
+                name.save()
+                self._export(entity_objects)
+                raise DatabaseError
+        except DatabaseError:
+            pass
+        # The EATSML exported within the transaction would be read
+        # under the unchanged version, and so must not have been
+        # cached.
+        self.assertEqual(get_fragment_keys([entity_id], ''), keys)
+        self.assertEqual(get_fragments(keys.values()), {})
+        result, count = self._export(entity_objects)
+        self.assertEqual(len(result.xpath(
+            '//e:display_form[. = "Rolled back display form"]',
+            namespaces={'e': exporter.EATS_NAMESPACE})), 0)
+
+    def test_deleted_entities(self):
+        # Delete an entity that other entities have relationships to.
+        relationship = EntityRelationship.objects.all()[0]
+        deleted_id = relationship.related_entity_id
+        self._export(Entity.objects.all())
+        delete_entities([deleted_id])
+        result, count = self._export(Entity.objects.all())
+        self.assertNotIn('entity-%d' % deleted_id,
+                         result.xpath('//@related_entity'))
+        cache.clear()
+        expected, count = self._export(Entity.objects.all())
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+
+class ParallelExportTestCase (ExportTestCase):
+
+    def setUp(self):
+        super(ParallelExportTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entity_id_ranges(self):
+        entity_ids = list(Entity.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        ranges = get_entity_id_ranges(2)
+        self.assertEqual(len(ranges), 2)
+        self.assertEqual(ranges[0][0], entity_ids[0])
+        self.assertEqual(ranges[-1][1], entity_ids[-1])
+        self.assertEqual(entity_ids.index(ranges[1][0]),
+                         entity_ids.index(ranges[0][1]) + 1)
+        # There are never more ranges than entities.
+        self.assertEqual(len(get_entity_id_ranges(len(entity_ids) + 5)),
+                         len(entity_ids))
+
+    def test_export_command(self):
+        # Worker processes cannot share the in-memory test database,
+        # so export the ranges in this process.
+        path = join(self.directory, 'export.xml')
+        call_command('export_eatsml', path, processes=1, validate=True,
+                     stdout=StringIO())
+        result = etree.parse(path).getroot()
+        expected = exporter.Exporter().export_entities(Entity.objects.all())
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+
+class TransformTestCase (ExportTestCase):
+
+    BASE_PSI_URL = 'http://www.example.org/eats/'
+
+    def _get_children(self, xml):
+        return sorted(etree.tostring(child) for child in
+                      etree.fromstring(xml))
+
+    def test_cached_entity_transform(self):
+        for entity_object in Entity.objects.all():
+            eatsml_root = exporter.Exporter().export_entities(
+                [entity_object])
+            expected = etree.tostring(transforms.apply_transform(
+                transforms.XTM, eatsml_root,
+                {'base_psi_url': self.BASE_PSI_URL}),
+                encoding='utf-8', pretty_print=True)
+            for i in range(2):
+                result = transforms.transform_entity(
+                    entity_object, transforms.XTM,
+                    base_psi_url=self.BASE_PSI_URL)
+                self.assertEqual(result, expected)
+        # A change to an entity changes the transforms of the
+        # entities related to it.
+        name = Name.objects.all()[0]
+        name.display_form = 'Changed display form'
+        name.save()
+        for entity_object in Entity.objects.all():
+            result = transforms.transform_entity(
+                entity_object, transforms.XTM,
+                base_psi_url=self.BASE_PSI_URL)
+            self.assertIn(b'Changed display form', result)
+
+    def test_changed_infrastructure_transform(self):
+        # A change to the infrastructure or to an authority record
+        # changes the transforms that include it.
+        assertion = PropertyAssertion.objects.filter(
+            entity_type__isnull=False)[0]
+        entity_object = assertion.entity
+        transforms.transform_entity(entity_object, transforms.XTM,
+                                    base_psi_url=self.BASE_PSI_URL)
+        entity_type = assertion.entity_type.entity_type
+        entity_type.entity_type = 'Changed entity type'
+        entity_type.save()
+        result = transforms.transform_entity(
+            entity_object, transforms.XTM, base_psi_url=self.BASE_PSI_URL)
+        self.assertIn(b'Changed entity type', result)
+        record = assertion.authority_record
+        record.authority_system_url = 'changed-record-url'
+        record.save()
+        result = transforms.transform_entity(
+            entity_object, transforms.XTM, base_psi_url=self.BASE_PSI_URL)
+        self.assertIn(b'changed-record-url', result)
+
+    def test_authority_transform(self):
+        parameters = {'base_psi_url': self.BASE_PSI_URL}
+        authority = Authority.objects.all()[0]
+        expected = b''.join(transforms.stream_authority_transform(
+            authority.id, transforms.XTM, parameters))
+        batch_number = transforms.BATCH_NUMBER
+        transforms.BATCH_NUMBER = 1
+        try:
+            result = b''.join(transforms.stream_authority_transform(
+                authority.id, transforms.XTM, parameters, workers=2))
+        finally:
+            transforms.BATCH_NUMBER = batch_number
+        self.assertEqual(self._get_children(result),
+                         self._get_children(expected))
+        eac = etree.fromstring(b''.join(transforms.stream_authority_transform(
+            authority.id, transforms.EAC_GROUP, {'base_url': 'example.org'})))
+        self.assertEqual(eac.tag, 'records')
+
+
+class InfrastructureCacheTestCase (LocalMemoryCacheTestCase):
+
+    def setUp(self):
+        super(InfrastructureCacheTestCase, self).setUp()
+        self.user = User.objects.get(username='superuser')
+        self.profile = UserProfile.objects.create(
+            user=self.user, authority=Authority.objects.all()[0],
+            language=Language.objects.all()[0],
+            script=Script.objects.all()[0],
+            calendar=Calendar.objects.all()[0],
+            date_type=DateType.objects.all()[0],
+            date_period=DatePeriod.objects.all()[0],
+            name_type=NameType.objects.all()[0])
+        self.profile.editable_authorities.set(Authority.objects.all()[:1])
+
+    def _export_infrastructure(self):
+        eats_exporter = exporter.Exporter()
+        eats_exporter.set_user(self.user)
+        return eats_exporter.export_infrastructure(limited=True,
+                                                   annotated=True)
+
+    def test_cached_infrastructure(self):
+        expected = self._export_infrastructure()
+        eats_exporter = exporter.Exporter()
+        eats_exporter.set_user(self.user)
+        # Only the user's editable authorities are queried.
+        with CaptureQueriesContext(connection) as context:
+            result = eats_exporter.export_infrastructure(limited=True,
+                                                         annotated=True)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+        defaults = result.xpath('//*[@user_default = "true"]/@xml:id')
+        self.assertIn('language-%d' % (self.profile.language_id), defaults)
+        self.assertIn('authority-%d' % (self.profile.authority_id), defaults)
+        # A change of preference is reflected without a new export.
+        self.profile.language = Language.objects.exclude(
+            pk=self.profile.language_id)[0]
+        self.profile.save()
+        result = self._export_infrastructure()
+        defaults = result.xpath('//*[@user_default = "true"]/@xml:id')
+        self.assertEqual(defaults.count(
+            'language-%d' % (self.profile.language_id)), 1)
+        self.assertEqual(len(result.xpath(
+            '//e:language[@user_default]', namespaces={
+                'e': exporter.EATS_NAMESPACE})), 1)
+
+    def test_changed_infrastructure(self):
+        self._export_infrastructure()
+        language = self.profile.language
+        language.language_name = 'Changed language'
+        language.save()
+        result = self._export_infrastructure()
+        self.assertEqual(result.xpath(
+            '//*[@xml:id = $id]/e:name/text()', namespaces={
+                'e': exporter.EATS_NAMESPACE},
+            id='language-%d' % (language.id)), ['Changed language'])
+
+
+class JSONExportTestCase (ExportTestCase):
+
+    def test_json_matches_eatsml(self):
+        entity_objects = Entity.objects.filter(
+            pk=Entity.objects.order_by('pk')[0].pk)
+        root = exporter.Exporter().export_entities(entity_objects)
+        data = json_exporter.JSONExporter().export_entities(entity_objects)
+        # The same entities and infrastructure objects are exported.
+        for model, name, fields in json_exporter.INFRASTRUCTURE_FIELDS:
+            prefix = 'authority' if name == 'authorities' else name[:-1]
+            expected = sorted(int(eats_id) for eats_id in root.xpath(
+                '/e:collection/e:%s/e:%s/@eats_id' % (name, prefix),
+                namespaces={'e': exporter.EATS_NAMESPACE}))
+            result = sorted(values['id'] for values in data.get(name, []))
+            self.assertEqual(result, expected, name)
+        expected = root.xpath('//e:entity/@eats_id | //e:entity/@is_related',
+                              namespaces={'e': exporter.EATS_NAMESPACE})
+        result = []
+        for entity in data['entities']:
+            result.append(str(entity['id']))
+            if entity.get('is_related'):
+                result.append('true')
+        self.assertEqual(result, expected)
+        expected = root.xpath('//e:name_assertion/e:display_form/text()',
+                              namespaces={'e': exporter.EATS_NAMESPACE})
+        result = [name['display_form'] for entity in data['entities']
+                  for name in entity.get('names', [])]
+        self.assertEqual(result, expected)
+
+    def test_ndjson_stream(self):
+        data = json_exporter.JSONExporter().export_entities(
+            Entity.objects.all())
+        chunks = json_exporter.JSONExporter().stream_entities(
+            Entity.objects.all())
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        self.assertEqual(lines, [json_exporter.dumps(entity)
+                                 for entity in data['entities']])
+
+    def test_response_format(self):
+        factory = RequestFactory()
+        formats = ['eatsml', 'json']
+        request = factory.get('/lookup/')
+        self.assertEqual(get_response_format(request, formats), 'eatsml')
+        request = factory.get('/lookup/', HTTP_ACCEPT='application/json')
+        self.assertEqual(get_response_format(request, formats), 'json')
+        request = factory.get(
+            '/lookup/', HTTP_ACCEPT='text/xml;q=0.5, application/json')
+        self.assertEqual(get_response_format(request, formats), 'json')
+        request = factory.get(
+            '/lookup/', HTTP_ACCEPT='text/xml, application/json;q=0.9')
+        self.assertEqual(get_response_format(request, formats), 'eatsml')
+        request = factory.get('/lookup/', {'format': 'json'},
+                              HTTP_ACCEPT='text/xml')
+        self.assertEqual(get_response_format(request, formats), 'json')
+
+
+class PruneTestCase (ExportTestCase):
+
+    @staticmethod
+    def _transform(root):
+        """Return root transformed as the EATSML client does, with the
+        XSLTs that remove redundant data."""
+        tree = root.getroottree()
+        for name in ('remove-redundant-eatsml-infrastructure-data',
+                     'remove-redundant-eatsml-system-name-parts'):
+            transform = etree.XSLT(etree.parse(join(exporter.PATH,
+                                                    name + '.xsl')))
+            tree = transform(tree)
+        return tree.getroot()
+
+    def test_matches_xslt(self):
+        entity_objects = Entity.objects.all()
+        expected = self._transform(exporter.Exporter().export_entities(
+            entity_objects))
+        result = exporter.Exporter(prune=True).export_entities(entity_objects)
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+        self.assertFalse(result.xpath('//@default_calendar'))
+
+    def test_stream_matches_tree(self):
+        # Export a single entity, so that the document includes a
+        # related entity.
+        entity_objects = Entity.objects.filter(
+            pk=Entity.objects.order_by('pk')[0].pk)
+        expected = exporter.Exporter(prune=True).export_entities(
+            entity_objects)
+        chunks = exporter.Exporter(prune=True).stream_entities(entity_objects)
+        result = etree.fromstring(b''.join(chunks))
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+    def test_lookup(self):
+        user = User.objects.get(username='superuser')
+        UserProfile.objects.create(
+            user=user, authority=Authority.objects.all()[0],
+            language=Language.objects.all()[0],
+            script=Script.objects.all()[0],
+            calendar=Calendar.objects.all()[0],
+            date_type=DateType.objects.all()[0],
+            date_period=DatePeriod.objects.all()[0],
+            name_type=NameType.objects.all()[0])
+        factory = RequestFactory()
+        roots = []
+        for parameters in ({'name': 'Beaglehole'},
+                           {'name': 'Beaglehole', 'prune': 'true'}):
+            request = factory.get('/lookup/', parameters)
+            request.user = user
+            response = lookup(request)
+            self.assertEqual(response.status_code, 200)
+            roots.append(etree.fromstring(response.content))
+        self.assertTrue(roots[0].xpath('//@default_calendar'))
+        self.assertFalse(roots[1].xpath('//@default_calendar'))
+        self.assertTrue(roots[1].xpath('//@user_default'))
+        self.assertEqual(len(roots[1].xpath(
+            '/e:collection/e:entities/e:entity', namespaces=importer.NSMAP)),
+            len(roots[0].xpath('/e:collection/e:entities/e:entity',
+                               namespaces=importer.NSMAP)))
+
+
+class SchemaTestCase (unittest.TestCase):
+
+    def test_shared_schema(self):
+        relaxng = schema.get_relaxng()
+        self.assertIs(schema.get_relaxng(), relaxng)
+        # Each thread has its own compiled validator.
+        thread_relaxngs = []
+        thread = threading.Thread(
+            target=lambda: thread_relaxngs.append(schema.get_relaxng()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(thread_relaxngs[0], relaxng)
+
+    def test_validation_modes(self):
+        with override_settings(EATS_EXPORT_VALIDATION=schema.VALIDATE_ALWAYS):
+            self.assertTrue(schema.should_validate_export(for_read=True))
+        with override_settings(
+                EATS_EXPORT_VALIDATION=schema.VALIDATE_NOT_FOR_READS):
+            self.assertFalse(schema.should_validate_export(for_read=True))
+            self.assertTrue(schema.should_validate_export())
+        with override_settings(
+                EATS_EXPORT_VALIDATION=schema.VALIDATE_SAMPLED,
+                EATS_EXPORT_VALIDATION_SAMPLE_RATE=0):
+            self.assertFalse(schema.should_validate_export())
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 from os.path import abspath, dirname, join
+import copy
 import io
+import json
 import unittest
 
 from lxml import etree
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from eats.models import Entity, User
+from eats.models import Authority, AuthorityRecord, Date, Entity, \
+    EntityRelationship, EntityTypeList, Name, NamePart, PropertyAssertion, \
+    SearchName, User
+import eats.eatsml.bulk_importer as bulk_importer
 import eats.eatsml.importer as importer
+import eats.eatsml.matching_importer as matching_importer
+import eats.eatsml.stream_importer as stream_importer
 import eats.eatsml.exporter as exporter
 
 # Full path to this directory.
@@ -19,6 +28,23 @@ def suite():
     suite.addTest(KnownValuesTestCase('test_import_export'))
     suite.addTest(KnownValuesTestCase('test_import_results'))
     suite.addTest(BadInputTestCase('test_missing_existence'))
+    suite.addTest(PrefetchTestCase('test_prefetched_checks'))
+    suite.addTest(PrefetchTestCase('test_created_objects'))
+    suite.addTest(BulkImportTestCase('test_bulk_import'))
+    suite.addTest(BulkImportTestCase('test_missing_existence'))
+    suite.addTest(StreamImportTestCase('test_stream_import'))
+    suite.addTest(StreamImportTestCase('test_forward_reference'))
+    suite.addTest(StreamImportTestCase('test_entity_validation'))
+    suite.addTest(StreamImportTestCase('test_missing_existence'))
+    suite.addTest(DryRunTestCase('test_new_data'))
+    suite.addTest(DryRunTestCase('test_existing_data'))
+    suite.addTest(DryRunTestCase('test_missing_existence'))
+    suite.addTest(MatchingImportTestCase('test_matching_import'))
+    suite.addTest(MatchingImportTestCase('test_new_assertion'))
+    suite.addTest(MatchingImportTestCase(
+        'test_batched_forward_relationship'))
+    suite.addTest(CheckpointTestCase('test_batches'))
+    suite.addTest(CheckpointTestCase('test_resume'))
     return suite
 
 
@@ -93,3 +119,367 @@ class BadInputTestCase (unittest.TestCase):
         import_filepath = join(PATH, 'import-missing-existence.xml')
         self.assertRaises(importer.EATSImportError, self._importer.import_file,
                           import_filepath)
+
+
+class PrefetchTestCase (unittest.TestCase):
+
+    def setUp(self):
+        call_command('flush', verbosity=0, interactive=False)
+        self._user = User(username='superuser', first_name='super',
+                          last_name='user', email='superuser@example.org',
+                          password='', is_staff=True, is_active=True,
+                          is_superuser=True)
+        self._user.save()
+        self._importer = importer.Importer(self._user)
+        self._importer.import_file(join(PATH, 'import1.xml'))
+
+    def test_prefetched_checks(self):
+        eats_importer = importer.Importer(self._user)
+        root = etree.parse(join(PATH, 'import2.xml')).getroot()
+        eats_importer._prefetch_objects(root)
+        with CaptureQueriesContext(connection) as queries:
+            eats_importer._check_object_exists(Entity, 1, 'entity-1')
+            eats_importer._check_object_exists(
+                PropertyAssertion, 3, 'name_assertion-3', 1, 'name')
+            eats_importer._check_type_authority(
+                1, EntityTypeList, 1, 'entity_type_assertion-2')
+        self.assertEqual(len(queries), 0)
+        self.assertRaises(importer.EATSImportError,
+                          eats_importer._check_object_exists,
+                          PropertyAssertion, 3, 'name_assertion-3', 1,
+                          'existence')
+
+    def test_created_objects(self):
+        # The objects created by an import are kept for checking.
+        created_ids = [
+            (model, list(model.objects.values_list('pk', flat=True)))
+            for model in (Authority, AuthorityRecord, EntityTypeList)]
+        with CaptureQueriesContext(connection) as queries:
+            for model, model_ids in created_ids:
+                for model_id in model_ids:
+                    self._importer._get_object(model, model_id)
+        self.assertEqual(len(queries), 0)
+
+
+class ImportComparisonTestCase (unittest.TestCase):
+
+    """Base class for tests comparing the results of alternative
+    importers with those of Importer."""
+
+    def setUp(self):
+        call_command('flush', verbosity=0, interactive=False)
+        self._user = User(username='superuser', first_name='super',
+                          last_name='user', email='superuser@example.org',
+                          password='', is_staff=True, is_active=True,
+                          is_superuser=True)
+        self._user.save()
+
+    def _import(self, import_file):
+        """Import the test data with import_file, and return a summary
+        of the data created and of the elements annotated with EATS
+        IDs.
+
+        Arguments:
+        import_file -- function taking the path of a file to import
+                       and returning the annotated root element
+
+        """
+        annotated = []
+        for filename in ('import1.xml', 'import2.xml'):
+            processed_root = import_file(join(PATH, filename))
+            tree = processed_root.getroottree()
+            annotated.append(sorted(
+                tree.getpath(element) for element in
+                processed_root.xpath('//*[@eats_id]')))
+        summary = {
+            'assertions': PropertyAssertion.objects.count(),
+            'entities': Entity.objects.count(),
+            'names': sorted(Name.objects.values_list(
+                'display_form', 'language__language_code',
+                'assertion__is_preferred')),
+            'name parts': sorted(NamePart.objects.values_list(
+                'name_part', 'name_part_type__name_part_type')),
+            'search names': sorted(SearchName.objects.values_list(
+                'name_form', flat=True)),
+            'dates': sorted(Date.objects.values_list(
+                'start_date', 'end_date', 'point_date')),
+            'relationships': EntityRelationship.objects.count(),
+        }
+        return summary, annotated
+
+    def _import_expected(self):
+        """Import the test data with Importer, and return its summary,
+        then flush the database."""
+        eats_importer = importer.Importer(self._user)
+        expected = self._import(
+            lambda path: eats_importer.import_file(path)[1])
+        call_command('flush', verbosity=0, interactive=False)
+        self._user.save()
+        return expected
+
+
+class BulkImportTestCase (ImportComparisonTestCase):
+
+    def test_bulk_import(self):
+        eats_importer = importer.Importer(self._user)
+        expected = self._import(
+            lambda path: eats_importer.import_file(path)[1])
+        # The object by object import does not create search names
+        # for names without name parts, so regenerate them all as the
+        # update_name_search_forms view does.
+        for name in Name.objects.all():
+            name.save()
+        expected[0]['search names'] = sorted(SearchName.objects.values_list(
+            'name_form', flat=True))
+        call_command('flush', verbosity=0, interactive=False)
+        self._user.save()
+        eats_importer = bulk_importer.BulkImporter(self._user)
+        result = self._import(
+            lambda path: eats_importer.import_file(path)[1])
+        self.assertEqual(result, expected)
+
+    def test_missing_existence(self):
+        eats_importer = bulk_importer.BulkImporter(self._user)
+        self.assertRaises(importer.EATSImportError, eats_importer.import_file,
+                          join(PATH, 'import-missing-existence.xml'))
+        # Nothing from the failed import remains.
+        self.assertEqual(Entity.objects.count(), 0)
+        self.assertEqual(Authority.objects.count(), 0)
+
+
+class StreamImportTestCase (ImportComparisonTestCase):
+
+    def _import_stream(self, eatsml):
+        """Import eatsml with StreamImporter, and return the annotated
+        root element."""
+        output = io.BytesIO()
+        stream_importer.StreamImporter(self._user).import_stream(
+            eatsml, output)
+        return etree.fromstring(output.getvalue())
+
+    def test_stream_import(self):
+        expected = self._import_expected()
+        result = self._import(self._import_stream)
+        self.assertEqual(result, expected)
+
+    def test_forward_reference(self):
+        self._import_stream(join(PATH, 'import1.xml'))
+        # Put the entity with the relationship before the entity it
+        # relates to.
+        tree = etree.parse(join(PATH, 'import2.xml'))
+        entities_element = tree.getroot().find(importer.EATS + 'entities')
+        entities_element.insert(0, entities_element[-1])
+        processed_root = self._import_stream(io.BytesIO(etree.tostring(tree)))
+        self.assertEqual(EntityRelationship.objects.get().related_entity_id,
+                         1)
+        self.assertEqual(Entity.objects.count(), 2)
+        self.assertEqual(len(processed_root.xpath(
+            '//e:entity[@eats_id]', namespaces=importer.NSMAP)), 2)
+
+    def test_entity_validation(self):
+        # Add an authority record that no entity references.
+        tree = etree.parse(join(PATH, 'import1.xml'))
+        records_element = tree.getroot().find(
+            importer.EATS + 'authority_records')
+        record_element = copy.deepcopy(records_element[0])
+        record_element.set(importer.XML + 'id', 'authority_record-2')
+        record_element[0].text = 'entity-000002'
+        records_element.append(record_element)
+        eats_importer = stream_importer.StreamImporter(self._user)
+        skeletons = []
+        validate_skeleton = eats_importer._validate_skeleton
+        eats_importer._validate_skeleton = lambda skeleton: (
+            skeletons.append(skeleton), validate_skeleton(skeleton))
+        eats_importer.import_stream(io.BytesIO(etree.tostring(tree)),
+                                    io.BytesIO())
+        # The infrastructure is validated once, and each entity only
+        # with the infrastructure it references.
+        self.assertEqual(len(skeletons), 2)
+        record_xpath = 'e:authority_records/e:authority_record/@xml:id'
+        self.assertEqual(skeletons[0].xpath(record_xpath,
+                                            namespaces=importer.NSMAP),
+                         ['authority_record-1', 'authority_record-2'])
+        self.assertEqual(skeletons[1].xpath(record_xpath,
+                                            namespaces=importer.NSMAP),
+                         ['authority_record-1'])
+        self.assertEqual(len(skeletons[1].xpath(
+            'e:entities/e:entity', namespaces=importer.NSMAP)), 1)
+
+    def test_missing_existence(self):
+        self.assertRaises(importer.EATSImportError, self._import_stream,
+                          join(PATH, 'import-missing-existence.xml'))
+        self.assertEqual(Entity.objects.count(), 0)
+        self.assertEqual(Authority.objects.count(), 0)
+
+
+class DryRunTestCase (ImportComparisonTestCase):
+
+    def test_new_data(self):
+        eats_importer = importer.Importer(self._user)
+        report = eats_importer.import_file(join(PATH, 'import1.xml'),
+                                           dry_run=True)
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['problems'], [])
+        self.assertEqual(Entity.objects.count(), 0)
+        self.assertEqual(Authority.objects.count(), 0)
+        importer.Importer(self._user).import_file(join(PATH, 'import1.xml'))
+        new = report['new']
+        self.assertEqual(new['entity'], Entity.objects.count())
+        self.assertEqual(new.get('name part', 0), NamePart.objects.count())
+        self.assertEqual(sum(count for item_name, count in new.items()
+                             if item_name.endswith(' assertion')),
+                         PropertyAssertion.objects.count())
+
+    def test_existing_data(self):
+        importer.Importer(self._user).import_file(join(PATH, 'import1.xml'))
+        entity_count = Entity.objects.count()
+        report = importer.Importer(self._user).import_file(
+            join(PATH, 'import2.xml'), dry_run=True)
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['existing']['entity'], 1)
+        self.assertEqual(report['new']['entity'], 1)
+        self.assertEqual(Entity.objects.count(), entity_count)
+
+    def test_missing_existence(self):
+        report = importer.Importer(self._user).import_file(
+            join(PATH, 'import-missing-existence.xml'), dry_run=True)
+        self.assertFalse(report['valid'])
+        self.assertEqual(report['problem_count'], 2)
+        self.assertEqual([problem['xml_id'] for problem in report['problems']],
+                         ['entity_type_assertion-2', 'name_assertion-3'])
+        self.assertEqual(Entity.objects.count(), 0)
+
+
+class MatchingImportTestCase (ImportComparisonTestCase):
+
+    def setUp(self):
+        super(MatchingImportTestCase, self).setUp()
+        eats_importer = importer.Importer(self._user)
+        eats_importer.import_file(join(PATH, 'import1.xml'))
+        eats_importer.import_file(join(PATH, 'import2.xml'))
+        # An export of the data, as a partner project would have it,
+        # referencing the infrastructure but not the authority
+        # records, entities or assertions by EATS ID.
+        self._root = exporter.Exporter().export_entities(
+            Entity.objects.all())
+        for element in self._root.xpath(
+                '/e:collection/e:authority_records/e:authority_record | '
+                '/e:collection/e:entities//*', namespaces=importer.NSMAP):
+            element.attrib.pop('eats_id', None)
+        self._counts = self._get_counts()
+
+    @staticmethod
+    def _get_counts():
+        return [model.objects.count() for model in
+                (Entity, PropertyAssertion, Date, NamePart)]
+
+    def _import_matching(self, batch_size=None):
+        eats_importer = matching_importer.MatchingImporter(
+            self._user, batch_size=batch_size)
+        return eats_importer.import_file(
+            io.BytesIO(etree.tostring(self._root)))[1]
+
+    def test_matching_import(self):
+        with CaptureQueriesContext(connection) as queries:
+            processed_root = self._import_matching()
+        self.assertEqual(self._get_counts(), self._counts)
+        self.assertEqual(
+            len(processed_root.xpath('//*[@xml:id][not(@eats_id)]')), 0)
+        # The existing objects are fetched together, rather than
+        # queried for one at a time.
+        self.assertLess(len(queries), 30)
+
+    def test_batched_forward_relationship(self):
+        # Put the entity with the relationship before the entity it
+        # relates to, in a batch of its own.
+        entity_element = self._root.xpath(
+            '//e:entity[e:entity_relationship_assertions/*]',
+            namespaces=importer.NSMAP)[0]
+        entity_element.getparent().insert(0, entity_element)
+        self._import_matching(batch_size=1)
+        self.assertEqual(self._get_counts(), self._counts)
+
+    def test_new_assertion(self):
+        # Change a name that is not in a name relationship, which
+        # would then be new too.
+        name_element = self._root.xpath(
+            '//e:name_assertion[not(@xml:id = //@name or '
+            '@xml:id = //@related_name)]', namespaces=importer.NSMAP)[0]
+        name_element.find(importer.EATS + 'display_form').text = 'Petrograd'
+        processed_root = self._import_matching()
+        entity_count, assertion_count = self._get_counts()[:2]
+        self.assertEqual([entity_count, assertion_count],
+                         [self._counts[0], self._counts[1] + 1])
+        entity_id = processed_root.xpath(
+            '//e:entity[e:name_assertions/e:name_assertion/e:display_form'
+            '= "Petrograd"]/@eats_id', namespaces=importer.NSMAP)[0]
+        name = Name.objects.get(display_form='Petrograd')
+        self.assertEqual(name.assertion.entity_id, int(entity_id))
+
+
+class CheckpointTestCase (ImportComparisonTestCase):
+
+    def _get_importer(self, checkpoints, checkpoint=None):
+        """Return a BulkImporter importing an entity at a time, which
+        appends its checkpoints to the list checkpoints."""
+        return bulk_importer.BulkImporter(
+            self._user, batch_size=1, checkpoint=checkpoint,
+            save_checkpoint=lambda data: checkpoints.append(
+                json.loads(json.dumps(data))))
+
+    @staticmethod
+    def _get_document(with_existence=True):
+        """Return the first test document, with a copy of its entity
+        that has an existence assertion only if with_existence."""
+        tree = etree.parse(join(PATH, 'import1.xml'))
+        entities_element = tree.getroot().find(importer.EATS + 'entities')
+        entity_element = copy.deepcopy(entities_element[0])
+        for element in entity_element.xpath('descendant-or-self::*[@xml:id]'):
+            element.set(importer.XML + 'id',
+                        element.get(importer.XML + 'id') + '-copy')
+        if not with_existence:
+            entity_element.remove(entity_element.find(
+                importer.EATS + 'existence_assertions'))
+        entities_element.append(entity_element)
+        return io.BytesIO(etree.tostring(tree))
+
+    def test_batches(self):
+        # The batched import gives the same results as one made in a
+        # single transaction.
+        eats_importer = bulk_importer.BulkImporter(self._user)
+        expected = self._import(
+            lambda path: eats_importer.import_file(path)[1])
+        call_command('flush', verbosity=0, interactive=False)
+        self._user.save()
+        checkpoints = []
+        eats_importer = self._get_importer(checkpoints)
+        result = self._import(
+            lambda path: eats_importer.import_file(path)[1])
+        self.assertEqual(result, expected)
+        # A checkpoint is recorded after the infrastructure and after
+        # each entity, of each document.
+        self.assertEqual([checkpoint['count'] for checkpoint in checkpoints],
+                         [0, 1, 0, 1, 2])
+        self.assertEqual(checkpoints[-1]['entity'], 'entity-2')
+
+    def test_resume(self):
+        checkpoints = []
+        self.assertRaises(
+            importer.EATSImportError,
+            self._get_importer(checkpoints).import_file,
+            self._get_document(with_existence=False))
+        # The batch of the first entity is committed.
+        self.assertEqual(Entity.objects.count(), 1)
+        self.assertEqual(Authority.objects.count(), 1)
+        # Each checkpoint has only the mappings made since the one
+        # before it.
+        self.assertNotIn('authority', checkpoints[-1]['maps'])
+        checkpoint = bulk_importer.merge_checkpoints(checkpoints)
+        self.assertEqual(checkpoint['entity'], 'entity-1')
+        processed_root = self._get_importer(
+            checkpoints, checkpoint).import_file(self._get_document())[1]
+        self.assertEqual(Entity.objects.count(), 2)
+        self.assertEqual(Authority.objects.count(), 1)
+        self.assertEqual(PropertyAssertion.objects.count(), 6)
+        self.assertEqual(len(processed_root.xpath(
+            '//e:entity[@eats_id]', namespaces=importer.NSMAP)), 2)
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+import datetime
+import gzip
+import json
+import os
+from os.path import join
+import shutil
+import tempfile
+import unittest
+
+from lxml import etree
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from eats.models import Authority, Calendar, DatePeriod, DateType, Entity, \
+    EntityTypeList, Job, Language, Name, NameType, RegisteredImport, Script, \
+    User, UserProfile
+import eats.eatsml.exporter as exporter
+import eats.eatsml.importer as importer
+from eats.jobs import EXPORT_DIRECTORY, EXPORT_EATSML, HEARTBEAT_KEY, \
+    IMPORT_DIRECTORY, IMPORT_EATSML, NDJSON, STALE_JOB_MESSAGE, claim_job, \
+    enqueue_job, fail_stale_jobs, get_artifact_path, get_job_progress, \
+    get_job_stale_timeout, get_progress_recorder, run_job
+from eats.testsuites.exports import ExportTestCase
+from eats.testsuites.imports import PATH
+from eats.views import edit
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(ExportJobTestCase('test_claim_job'))
+    suite.addTest(ExportJobTestCase('test_export_job'))
+    suite.addTest(ExportJobTestCase('test_failed_export_job'))
+    suite.addTest(ExportJobTestCase('test_ndjson_export_job'))
+    suite.addTest(ExportJobTestCase('test_pruned_export_job'))
+    suite.addTest(ExportJobTestCase('test_reuse_job'))
+    suite.addTest(ExportJobTestCase('test_reuse_base_export_job'))
+    suite.addTest(ExportJobTestCase('test_stale_job'))
+    suite.addTest(ExportJobTestCase('test_finish_stale_job'))
+    suite.addTest(ExportJobTestCase('test_cached_heartbeat'))
+    suite.addTest(ExportJobTestCase('test_download_range'))
+    suite.addTest(ImportJobTestCase('test_import_job'))
+    suite.addTest(ImportJobTestCase('test_import_document'))
+    suite.addTest(ImportJobTestCase('test_stream_import_job'))
+    suite.addTest(ImportJobTestCase('test_failed_import_job'))
+    suite.addTest(ImportJobTestCase('test_resume_import_job'))
+    suite.addTest(ImportJobTestCase('test_running_progress'))
+    suite.addTest(ImportJobTestCase('test_import_progress'))
+    return suite
+
+
+class ExportJobTestCase (ExportTestCase):
+
+    def setUp(self):
+        super(ExportJobTestCase, self).setUp()
+        self.user = User.objects.get(username='superuser')
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def _run_export_job(self):
+        job = enqueue_job(EXPORT_EATSML, self.user, {'authority_id': None},
+                          reusable=True)
+        if job.status == Job.PENDING:
+            run_job(claim_job())
+            job.refresh_from_db()
+        return job
+
+    def test_claim_job(self):
+        job = enqueue_job(EXPORT_EATSML, self.user, {'authority_id': None})
+        claimed_job = claim_job()
+        self.assertEqual(claimed_job.pk, job.pk)
+        self.assertEqual(claimed_job.status, Job.RUNNING)
+        self.assertIsNone(claim_job())
+
+    def test_export_job(self):
+        job = self._run_export_job()
+        self.assertEqual(job.status, Job.COMPLETE, job.message)
+        self.assertEqual(job.progress, Entity.objects.count())
+        self.assertEqual(job.total, Entity.objects.count())
+        with gzip.open(get_artifact_path(job.artifact)) as artifact_file:
+            result = etree.parse(artifact_file).getroot()
+        expected = exporter.Exporter().export_entities(Entity.objects.all())
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+    def test_failed_export_job(self):
+        stream_entities = exporter.Exporter._stream_entities
+
+        def fail_stream(eats_exporter, *args, **kwargs):
+            chunks = stream_entities(eats_exporter, *args, **kwargs)
+            yield next(chunks)
+            raise exporter.EATSExportError('Failed part way')
+        exporter.Exporter._stream_entities = fail_stream
+        try:
+            job = self._run_export_job()
+        finally:
+            exporter.Exporter._stream_entities = stream_entities
+        # A failure part way through the export fails the job, and
+        # leaves no partial artifact to be served.
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.message, 'Failed part way')
+        self.assertEqual(job.artifact, '')
+        self.assertEqual(os.listdir(get_artifact_path(EXPORT_DIRECTORY)), [])
+
+    def test_ndjson_export_job(self):
+        job = enqueue_job(EXPORT_EATSML, self.user,
+                          {'authority_id': None, 'format': NDJSON})
+        run_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.COMPLETE, job.message)
+        self.assertTrue(job.artifact.endswith('.ndjson.gz'))
+        with gzip.open(get_artifact_path(job.artifact)) as artifact_file:
+            entities = [json.loads(line.decode('utf-8'))
+                        for line in artifact_file]
+        self.assertEqual(sorted(entity['id'] for entity in entities),
+                         sorted(Entity.objects.values_list('pk', flat=True)))
+
+    def test_pruned_export_job(self):
+        response = Client().get(reverse(edit.export_eatsml),
+                                {'prune': 'true'})
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get()
+        self.assertTrue(json.loads(job.parameters)['prune'])
+        run_job(claim_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.COMPLETE, job.message)
+        with gzip.open(get_artifact_path(job.artifact)) as artifact_file:
+            result = etree.parse(artifact_file).getroot()
+        expected = exporter.Exporter(prune=True).export_entities(
+            Entity.objects.all())
+        self.assertEqual(self.get_c14n_string(result),
+                         self.get_c14n_string(expected))
+
+    def test_reuse_job(self):
+        job = self._run_export_job()
+        self.assertEqual(self._run_export_job().pk, job.pk)
+        name = Name.objects.all()[0]
+        name.display_form = 'Changed display form'
+        name.save()
+        new_job = self._run_export_job()
+        self.assertNotEqual(new_job.pk, job.pk)
+        # The superseded artifact is removed.
+        job.refresh_from_db()
+        self.assertEqual(job.artifact, '')
+        # A change to the infrastructure also changes the dataset.
+        self.assertEqual(self._run_export_job().pk, new_job.pk)
+        entity_type = EntityTypeList.objects.all()[0]
+        entity_type.entity_type = 'Changed entity type'
+        entity_type.save()
+        self.assertNotEqual(self._run_export_job().pk, new_job.pk)
+
+    def test_reuse_base_export_job(self):
+        profile = UserProfile.objects.create(
+            user=self.user, authority=Authority.objects.all()[0],
+            language=Language.objects.all()[0],
+            script=Script.objects.all()[0],
+            calendar=Calendar.objects.all()[0],
+            date_type=DateType.objects.all()[0],
+            date_period=DatePeriod.objects.all()[0],
+            name_type=NameType.objects.all()[0])
+        profile.editable_authorities.set(Authority.objects.all())
+        client = Client()
+        client.force_login(self.user)
+        url = reverse(edit.export_base_eatsml)
+        self.assertEqual(client.get(url).status_code, 202)
+        job = Job.objects.get()
+        run_job(claim_job())
+        # The base EATSML does not include entities, so a change to
+        # one leaves the export in use.
+        name = Name.objects.all()[0]
+        name.display_form = 'Changed display form'
+        name.save()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Job.objects.get().pk, job.pk)
+        entity_type = EntityTypeList.objects.all()[0]
+        entity_type.entity_type = 'Changed entity type'
+        entity_type.save()
+        self.assertEqual(client.get(url).status_code, 202)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_stale_job(self):
+        job = enqueue_job(EXPORT_EATSML, self.user, {'authority_id': None},
+                          reusable=True)
+        claim_job()
+        # A running job is reused while its worker records progress.
+        self.assertEqual(enqueue_job(EXPORT_EATSML, self.user,
+                                     {'authority_id': None},
+                                     reusable=True).pk, job.pk)
+        Job.objects.filter(pk=job.pk).update(
+            heartbeat=timezone.now() - datetime.timedelta(
+                seconds=get_job_stale_timeout() + 1))
+        new_job = enqueue_job(EXPORT_EATSML, self.user,
+                              {'authority_id': None}, reusable=True)
+        self.assertNotEqual(new_job.pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.message, STALE_JOB_MESSAGE)
+        self.assertEqual(claim_job().pk, new_job.pk)
+
+    def test_finish_stale_job(self):
+        job = enqueue_job(EXPORT_EATSML, self.user, {'authority_id': None})
+        job = claim_job()
+        # The job is taken to have been abandoned while it runs.
+        Job.objects.filter(pk=job.pk).update(status=Job.FAILED,
+                                             message=STALE_JOB_MESSAGE)
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.message, STALE_JOB_MESSAGE)
+
+    def test_cached_heartbeat(self):
+        job = enqueue_job(EXPORT_EATSML, self.user, {'authority_id': None})
+        claim_job()
+        job.refresh_from_db()
+        # The heartbeat of a job running in a single transaction is
+        # recorded only in the cache.
+        Job.objects.filter(pk=job.pk).update(
+            heartbeat=timezone.now() - datetime.timedelta(
+                seconds=get_job_stale_timeout() + 1))
+        get_progress_recorder(job)(importer.ENTITIES_PHASE, 1, 2)
+        self.assertEqual(fail_stale_jobs(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+        cache.delete(HEARTBEAT_KEY % (job.id))
+        self.assertEqual(fail_stale_jobs(), 1)
+
+    def test_download_range(self):
+        job = self._run_export_job()
+        with open(get_artifact_path(job.artifact), 'rb') as artifact_file:
+            data = artifact_file.read()
+        client = Client()
+        url = reverse('download_job', args=[job.id])
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), data)
+        response = client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'],
+                         'bytes 10-19/%d' % (len(data)))
+        self.assertEqual(b''.join(response.streaming_content), data[10:20])
+        response = client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), data[-5:])
+        response = client.get(url, HTTP_RANGE='bytes=%d-' % (len(data)))
+        self.assertEqual(response.status_code, 416)
+
+
+class ImportJobTestCase (unittest.TestCase):
+
+    def setUp(self):
+        call_command('flush', verbosity=0, interactive=False)
+        self.user = User(username='superuser', first_name='super',
+                         last_name='user', email='superuser@example.org',
+                         password='', is_staff=True, is_active=True,
+                         is_superuser=True)
+        self.user.save()
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def _queue_import(self, filename):
+        """Upload the test data file filename for import, and return
+        the RegisteredImport made for it."""
+        with open(join(PATH, filename), 'rb') as import_file:
+            response = self.client.post(
+                reverse(edit.import_eatsml),
+                {'import_file': import_file, 'description': filename})
+        self.assertEqual(response.status_code, 302)
+        return RegisteredImport.objects.get(description=filename)
+
+    def _run_import_job(self, registered_import):
+        job = registered_import.job
+        self.assertEqual(job.status, Job.PENDING)
+        run_job(claim_job())
+        job.refresh_from_db()
+        registered_import.refresh_from_db()
+        return job
+
+    def test_import_job(self):
+        registered_import = self._queue_import('import1.xml')
+        # Nothing is imported until the job is run.
+        self.assertEqual(Entity.objects.count(), 0)
+        job = self._run_import_job(registered_import)
+        self.assertEqual(job.status, Job.COMPLETE, job.message)
+        self.assertEqual(job.phase, importer.RELATIONSHIPS_PHASE)
+        self.assertEqual(Entity.objects.count(), 1)
+        with gzip.open(get_artifact_path(
+                registered_import.processed_document)) as document_file:
+            processed_root = etree.parse(document_file).getroot()
+        self.assertEqual(len(processed_root.xpath(
+            '//e:entity[@eats_id]', namespaces=importer.NSMAP)), 1)
+        with gzip.open(get_artifact_path(
+                registered_import.raw_document)) as document_file, \
+                open(join(PATH, 'import1.xml'), 'rb') as import_file:
+            self.assertEqual(document_file.read(), import_file.read())
+        # The spooled upload is removed, leaving only the documents.
+        self.assertEqual(
+            sorted(os.listdir(join(self.media_root, IMPORT_DIRECTORY))),
+            ['import-%d-processed.xml.gz' % (registered_import.id),
+             'import-%d-raw.xml.gz' % (registered_import.id)])
+
+    def test_import_document(self):
+        registered_import = self._queue_import('import1.xml')
+        url = reverse(edit.display_import_raw,
+                      kwargs={'import_id': registered_import.id})
+        # There is no document until the import has been made.
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self._run_import_job(registered_import)
+        with open(join(PATH, 'import1.xml'), 'rb') as import_file:
+            data = import_file.read()
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/xml')
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)), data)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_stream_import_job(self):
+        registered_import = self._queue_import('import1.xml')
+        with override_settings(EATS_STREAM_IMPORTS=True):
+            job = self._run_import_job(registered_import)
+        self.assertEqual(job.status, Job.COMPLETE, job.message)
+        self.assertEqual(Entity.objects.count(), 1)
+        self.assertFalse(job.checkpoint_parts.exists())
+        with gzip.open(get_artifact_path(
+                registered_import.processed_document)) as document_file:
+            processed_root = etree.parse(document_file).getroot()
+        self.assertEqual(len(processed_root.xpath(
+            '//e:entity[@eats_id]', namespaces=importer.NSMAP)), 1)
+
+    def test_failed_import_job(self):
+        registered_import = self._queue_import(
+            'import-missing-existence.xml')
+        job = self._run_import_job(registered_import)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('entity_type_assertion-2', job.message)
+        # The batch of the entity is rolled back, but the
+        # infrastructure, imported before it, is not.
+        self.assertEqual(Entity.objects.count(), 0)
+        self.assertEqual(Authority.objects.count(), 1)
+        self.assertEqual(json.loads(job.checkpoint)['count'], 0)
+        # The maps of the infrastructure's checkpoint are stored apart.
+        self.assertNotIn('maps', json.loads(job.checkpoint))
+        self.assertIn('authority',
+                      json.loads(job.checkpoint_parts.get().maps))
+        self.assertEqual(registered_import.processed_document, '')
+
+    def test_resume_import_job(self):
+        registered_import = self._queue_import(
+            'import-missing-existence.xml')
+        job = self._run_import_job(registered_import)
+        self.assertEqual(job.status, Job.FAILED)
+        with open(join(PATH, 'import1.xml'), 'rb') as import_file:
+            response = self.client.post(
+                reverse(edit.resume_import,
+                        kwargs={'import_id': registered_import.id}),
+                {'import_file': import_file})
+        self.assertEqual(response.status_code, 302)
+        job = self._run_import_job(registered_import)
+        self.assertEqual(job.status, Job.COMPLETE, job.message)
+        self.assertEqual(job.checkpoint, '')
+        self.assertFalse(job.checkpoint_parts.exists())
+        # The infrastructure is not imported again.
+        self.assertEqual(Authority.objects.count(), 1)
+        self.assertEqual(Entity.objects.count(), 1)
+        # Only the documents of the import remain.
+        self.assertEqual(
+            sorted(os.listdir(join(self.media_root, IMPORT_DIRECTORY))),
+            ['import-%d-processed.xml.gz' % (registered_import.id),
+             'import-%d-raw.xml.gz' % (registered_import.id)])
+
+    def test_running_progress(self):
+        job = enqueue_job(IMPORT_EATSML, self.user, {'path': ''})
+        job = claim_job()
+        get_progress_recorder(job)(importer.ENTITIES_PHASE, 5, 10)
+        # The progress is seen from outside the job's transaction.
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual(job.progress, 0)
+        self.assertEqual(get_job_progress(job),
+                         {'phase': importer.ENTITIES_PHASE, 'progress': 5,
+                          'total': 10})
+
+    def test_import_progress(self):
+        reports = []
+        eats_importer = importer.Importer(
+            self.user, progress=lambda *report: reports.append(report))
+        eats_importer.import_file(join(PATH, 'import1.xml'))
+        eats_importer.import_file(join(PATH, 'import2.xml'))
+        # Each phase is reported at its start and end, which are the
+        # same for a phase with nothing to import.
+        self.assertEqual(reports, [
+            (importer.INFRASTRUCTURE_PHASE, 0, 13),
+            (importer.INFRASTRUCTURE_PHASE, 13, 13),
+            (importer.ENTITIES_PHASE, 0, 1),
+            (importer.ENTITIES_PHASE, 1, 1),
+            (importer.RELATIONSHIPS_PHASE, 0, 0),
+            (importer.INFRASTRUCTURE_PHASE, 0, 13),
+            (importer.INFRASTRUCTURE_PHASE, 13, 13),
+            (importer.ENTITIES_PHASE, 0, 2),
+            (importer.ENTITIES_PHASE, 2, 2),
+            (importer.RELATIONSHIPS_PHASE, 0, 1),
+            (importer.RELATIONSHIPS_PHASE, 1, 1),
+        ])
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+import datetime
+from os.path import abspath, dirname, join
+import unittest
+
+from django.contrib import admin
+from django.contrib.auth.models import Permission
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from eats.models import Authority, AuthorityRecord, Entity, EntityChange, \
+    EntityRelationship, Name, PropertyAssertion, PropertyAssertionValidator, \
+    SearchName, User, delete_entities, get_changed_entities, \
+    get_entity_changes, prune_entity_changes, \
+    reserve_authority_record_details
+from eats.admin import EntityAdmin, format_deletion_counts
+import eats.eatsml.importer as importer
+
+# Full path to this directory.
+PATH = abspath(dirname(__file__))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(AssertionValidatorTestCase('test_known_existence'))
+    suite.addTest(AssertionValidatorTestCase('test_missing_existence'))
+    suite.addTest(AssertionValidatorTestCase('test_batch'))
+    suite.addTest(AssertionValidatorTestCase('test_save_arguments'))
+    suite.addTest(DeleteEntitiesTestCase('test_dry_run'))
+    suite.addTest(DeleteEntitiesTestCase('test_delete'))
+    suite.addTest(DeleteEntitiesTestCase('test_admin_action'))
+    suite.addTest(EntityChangeTestCase('test_changed_entity'))
+    suite.addTest(EntityChangeTestCase('test_deleted_entities'))
+    suite.addTest(EntityChangeTestCase('test_limit'))
+    suite.addTest(EntityChangeTestCase('test_transaction_changes'))
+    suite.addTest(EntityChangeTestCase('test_prune'))
+    suite.addTest(EntityChangeTestCase('test_safety_lag'))
+    suite.addTest(EntityChangeTestCase('test_changed_entities'))
+    suite.addTest(AuthorityRecordSequenceTestCase('test_initial_number'))
+    suite.addTest(AuthorityRecordSequenceTestCase('test_reserve_block'))
+    return suite
+
+
+class ImportedDataTestCase (unittest.TestCase):
+
+    """Base class for tests that run against the data in import1.xml."""
+
+    def setUp(self):
+        # It is not sufficient just to delete the data in the test
+        # database, as the sequences for the IDs will be modified, and
+        # they need to be reset. Therefore flush the test database.
+        call_command('flush', verbosity=0, interactive=False)
+        user = User(username='superuser', first_name='super', last_name='user',
+                    email='superuser@example.org', password='', is_staff=True,
+                    is_active=True, is_superuser=True)
+        user.save()
+        importer.Importer(user).import_file(join(PATH, 'import1.xml'))
+
+
+class AssertionValidatorTestCase (ImportedDataTestCase):
+
+    def _get_existence(self):
+        return PropertyAssertion.objects.filter(existence__isnull=False)[0]
+
+    def _create_record(self, existence):
+        record = AuthorityRecord(
+            authority=existence.authority_record.authority,
+            authority_system_id='unused')
+        record.save()
+        return record
+
+    def test_known_existence(self):
+        existence = self._get_existence()
+        assertion = PropertyAssertion(
+            entity_id=existence.entity_id,
+            authority_record_id=existence.authority_record_id,
+            is_preferred=False)
+        validator = PropertyAssertionValidator()
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(validator.is_valid(assertion))
+            self.assertTrue(validator.is_valid(assertion))
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_missing_existence(self):
+        existence = self._get_existence()
+        assertion = PropertyAssertion(
+            entity_id=existence.entity_id,
+            authority_record=self._create_record(existence),
+            is_preferred=False)
+        self.assertFalse(assertion.is_valid())
+        self.assertRaises(Exception, assertion.save)
+
+    def test_batch(self):
+        existence = self._get_existence()
+        valid = PropertyAssertion(
+            entity_id=existence.entity_id,
+            authority_record_id=existence.authority_record_id,
+            is_preferred=False)
+        invalid = PropertyAssertion(
+            entity_id=existence.entity_id,
+            authority_record=self._create_record(existence),
+            is_preferred=False)
+        validator = PropertyAssertionValidator()
+        with CaptureQueriesContext(connection) as context:
+            result = validator.get_invalid_assertions([valid, invalid])
+        self.assertEqual(result, [invalid])
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_save_arguments(self):
+        # Positional arguments are passed on to Model.save, rather
+        # than being taken for the validator.
+        existence = self._get_existence()
+        existence.is_preferred = not existence.is_preferred
+        existence.save(False, True)
+        self.assertEqual(
+            PropertyAssertion.objects.get(pk=existence.pk).is_preferred,
+            existence.is_preferred)
+        assertion = PropertyAssertion(
+            entity_id=existence.entity_id,
+            authority_record_id=existence.authority_record_id,
+            is_preferred=False)
+        self.assertRaises(ValueError, assertion.save, False, True)
+
+
+class DeleteEntitiesTestCase (ImportedDataTestCase):
+
+    def test_dry_run(self):
+        entity_ids = list(Entity.objects.values_list('pk', flat=True))
+        counts = delete_entities(entity_ids, dry_run=True)
+        self.assertEqual(counts['Entity'], len(entity_ids))
+        self.assertEqual(counts['PropertyAssertion'],
+                         PropertyAssertion.objects.count())
+        self.assertEqual(Entity.objects.count(), len(entity_ids))
+
+    def test_delete(self):
+        entity_ids = list(Entity.objects.values_list('pk', flat=True))
+        expected = delete_entities(entity_ids, dry_run=True)
+        counts = delete_entities(entity_ids)
+        self.assertEqual(counts, expected)
+        self.assertEqual(Entity.objects.count(), 0)
+        self.assertEqual(PropertyAssertion.objects.count(), 0)
+        self.assertEqual(Name.objects.count(), 0)
+        self.assertEqual(SearchName.objects.count(), 0)
+
+    def test_admin_action(self):
+        entity_admin = EntityAdmin(Entity, admin.site)
+        factory = RequestFactory()
+        # Only a user who may delete entities is offered the action.
+        request = factory.get('/')
+        request.user = User.objects.create(username='editor', is_staff=True)
+        request.user.user_permissions.add(Permission.objects.get(
+            codename='change_entity'))
+        self.assertNotIn('delete_selected_entities',
+                         entity_admin.get_actions(request))
+        request.user = User.objects.get(username='superuser')
+        self.assertIn('delete_selected_entities',
+                      entity_admin.get_actions(request))
+        # The deletion is first reported, to be confirmed.
+        entity_count = Entity.objects.count()
+        request = factory.post('/', {'action': 'delete_selected_entities'})
+        request.user = User.objects.get(username='superuser')
+        response = entity_admin.delete_selected_entities(
+            request, Entity.objects.all())
+        self.assertEqual(response.context_data['counts'],
+                         format_deletion_counts(delete_entities(
+                             Entity.objects.values_list('pk', flat=True),
+                             dry_run=True)))
+        self.assertIn(b'delete_selected_entities', response.render().content)
+        self.assertEqual(Entity.objects.count(), entity_count)
+        request = factory.post('/', {'action': 'delete_selected_entities',
+                                     'post': 'yes'})
+        request.user = User.objects.get(username='superuser')
+        request._messages = CookieStorage(request)
+        self.assertIsNone(entity_admin.delete_selected_entities(
+            request, Entity.objects.all()))
+        self.assertEqual(Entity.objects.count(), 0)
+
+
+class EntityChangeTestCase (ImportedDataTestCase):
+
+    def setUp(self):
+        super(EntityChangeTestCase, self).setUp()
+        # import2.xml adds entities with relationships to each other.
+        user = User.objects.get(username='superuser')
+        importer.Importer(user).import_file(join(PATH, 'import2.xml'))
+        self.settings = override_settings(EATS_CHANGES_SAFETY_LAG=0)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def _get_token(self):
+        return get_entity_changes()[2]
+
+    def test_changed_entity(self):
+        token = self._get_token()
+        self.assertEqual(get_entity_changes(token), ([], [], token, False))
+        name = Name.objects.all()[0]
+        name.display_form = 'Changed display form'
+        name.save()
+        changed_ids, deleted_ids, new_token, more = get_entity_changes(token)
+        self.assertEqual(changed_ids, [name.assertion.entity_id])
+        self.assertEqual(deleted_ids, [])
+        self.assertTrue(new_token > token)
+        self.assertEqual(get_entity_changes(new_token)[:2], ([], []))
+
+    def test_deleted_entities(self):
+        relationship = EntityRelationship.objects.all()[0]
+        deleted_id = relationship.related_entity_id
+        relating_id = relationship.assertion.entity_id
+        token = self._get_token()
+        delete_entities([deleted_id])
+        changed_ids, deleted_ids, token, more = get_entity_changes(token)
+        self.assertEqual(changed_ids, [relating_id])
+        self.assertEqual(deleted_ids, [deleted_id])
+
+    def test_limit(self):
+        token = self._get_token()
+        entity_ids = list(Entity.objects.order_by('pk').values_list(
+            'pk', flat=True))[:2]
+        self.assertEqual(len(entity_ids), 2)
+        for entity_id in entity_ids:
+            EntityChange.objects.create(entity_id=entity_id,
+                                        kind=EntityChange.CHANGED)
+        changed_ids, deleted_ids, token, more = get_entity_changes(token, 1)
+        self.assertEqual(changed_ids, entity_ids[:1])
+        self.assertTrue(more)
+        changed_ids, deleted_ids, token, more = get_entity_changes(token, 1)
+        self.assertEqual(changed_ids, entity_ids[1:])
+        self.assertFalse(more)
+
+    def test_transaction_changes(self):
+        token = self._get_token()
+        name = Name.objects.all()[0]
+        with transaction.atomic():
+            for display_form in ('First change', 'Second change'):
+                name.display_form = display_form
+                name.save()
+            # Nothing is recorded until the transaction is committed.
+            self.assertEqual(EntityChange.objects.filter(
+                pk__gt=token).count(), 0)
+        changes = EntityChange.objects.filter(pk__gt=token)
+        self.assertEqual(list(changes.values_list('entity_id', flat=True)),
+                         [name.assertion.entity_id])
+        token = self._get_token()
+        try:
+            with transaction.atomic():
+                name.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(get_entity_changes(token), ([], [], token, False))
+        # Changes made after those rolled back, and those of a
+        # savepoint that is rolled back, are recorded anew.
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    name.save()
+                    raise ValueError
+            except ValueError:
+                pass
+            name.save()
+        self.assertEqual(get_entity_changes(token)[0],
+                         [name.assertion.entity_id])
+
+    def test_prune(self):
+        token = self._get_token()
+        name = Name.objects.all()[0]
+        name.save()
+        EntityChange.objects.filter(pk__gt=token).update(
+            timestamp=timezone.now() - datetime.timedelta(days=2))
+        name.save()
+        call_command('prune_entity_changes', days=1, verbosity=0)
+        self.assertEqual(EntityChange.objects.filter(pk__gt=token).count(),
+                         1)
+        self.assertEqual(prune_entity_changes(), 0)
+
+    def test_safety_lag(self):
+        token = self._get_token()
+        name = Name.objects.all()[0]
+        name.save()
+        with override_settings(EATS_CHANGES_SAFETY_LAG=60):
+            # A change recorded within the lag is not yet included.
+            self.assertEqual(get_entity_changes(token),
+                             ([], [], token, False))
+            EntityChange.objects.filter(pk__gt=token).update(
+                timestamp=timezone.now() - datetime.timedelta(seconds=61))
+            changed_ids, deleted_ids, new_token, more = \
+                get_entity_changes(token)
+        self.assertEqual(changed_ids, [name.assertion.entity_id])
+        self.assertTrue(new_token > token)
+
+    def test_changed_entities(self):
+        relationship = EntityRelationship.objects.all()[0]
+        deleted_id = relationship.related_entity_id
+        relating_id = relationship.assertion.entity_id
+        token = self._get_token()
+        delete_entities([deleted_id])
+        until = get_entity_changes(token)[2]
+        # The deleted entity no longer exists to be exported.
+        self.assertEqual(list(get_changed_entities(token, until).values_list(
+            'pk', flat=True)), [relating_id])
+
+
+class AuthorityRecordSequenceTestCase (ImportedDataTestCase):
+
+    def test_initial_number(self):
+        authority = Authority.objects.all()[0]
+        for record_id in ('entity-000041', 'entity-000007', 'other-000099'):
+            AuthorityRecord(authority=authority,
+                            authority_system_id=record_id).save()
+        details = reserve_authority_record_details(authority, 1)
+        self.assertEqual(details[0]['id'], 'entity-000042')
+
+    def test_reserve_block(self):
+        authority = Authority.objects.all()[0]
+        first = reserve_authority_record_details(authority, 3)
+        second = reserve_authority_record_details(authority, 1)
+        ids = [details['id'] for details in first + second]
+        self.assertEqual(len(set(ids)), 4)
+        self.assertEqual(sorted(ids), ids)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Tests that the queries EATS runs most often are served by indexes.
+
+Each query is EXPLAINed against a generated dataset, and the test
+fails if the plan includes a sequential scan of one of the tables
+that grow with the data."""
+
+import re
+import unittest
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from eats.models import AuthorityRecord, Entity, EntityType, \
+    EntityTypeList, Name, PropertyAssertion, PropertyAssertionValidator, \
+    SearchName
+from eats.testsuites.models import ImportedDataTestCase
+from eats.views.main import create_search_query, get_record_search_queryset
+
+# Number of entities to generate, each with its own authority record,
+# Existence and EntityType assertions, and search name.
+DATASET_SIZE = 500
+
+# Tables that grow with the data, and which must therefore not be
+# read in full.
+LARGE_TABLES = ('eats_authorityrecord', 'eats_date', 'eats_entity',
+                'eats_entitytype', 'eats_existence', 'eats_name',
+                'eats_propertyassertion', 'eats_searchname')
+
+# Detail of an SQLite query plan step that reads a whole table.
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+SUPPORTED_VENDORS = ('postgresql', 'sqlite')
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(QueryPlanTestCase('test_main_view_queries'))
+    suite.addTest(QueryPlanTestCase('test_edit_view_queries'))
+    suite.addTest(QueryPlanTestCase('test_export_queries'))
+    return suite
+
+
+def get_postgresql_scanned_tables(sql, params):
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+    plans = [cursor.fetchone()[0][0]['Plan']]
+    tables = set()
+    while plans:
+        plan = plans.pop()
+        if plan['Node Type'] == 'Seq Scan':
+            tables.add(plan['Relation Name'])
+        plans.extend(plan.get('Plans', []))
+    return tables
+
+
+def get_sqlite_scanned_tables(sql, params):
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    tables = set()
+    for row in cursor.fetchall():
+        match = SQLITE_SCAN.match(row[-1])
+        if match:
+            tables.add(match.group(1))
+    return tables
+
+
+def get_scanned_tables(queryset):
+    """Return the set of names of the tables that are read in full
+    when queryset is evaluated."""
+    sql, params = queryset.query.sql_with_params()
+    if connection.vendor == 'postgresql':
+        return get_postgresql_scanned_tables(sql, params)
+    return get_sqlite_scanned_tables(sql, params)
+
+
+@unittest.skipUnless(connection.vendor in SUPPORTED_VENDORS,
+                     'Query plans are only checked on PostgreSQL and SQLite')
+class QueryPlanTestCase (ImportedDataTestCase):
+
+    def setUp(self):
+        super(QueryPlanTestCase, self).setUp()
+        self._generate_data()
+        cursor = connection.cursor()
+        cursor.execute('ANALYZE')
+        if connection.vendor == 'postgresql':
+            # The planner rightly prefers a sequential scan of a small
+            # table; disabling them shows whether an index could be
+            # used instead.
+            cursor.execute('SET enable_seqscan = off')
+
+    def tearDown(self):
+        if connection.vendor == 'postgresql':
+            connection.cursor().execute('RESET enable_seqscan')
+
+    def _generate_data(self):
+        name = Name.objects.all()[0]
+        self.authority = name.assertion.authority_record.authority
+        type_list = EntityTypeList.objects.filter(authority=self.authority)[0]
+        validator = PropertyAssertionValidator()
+        with transaction.atomic():
+            for number in range(DATASET_SIZE):
+                entity = Entity()
+                entity.save(authority=self.authority)
+                record = entity.get_authority_records()[0]
+                validator.add_existence(entity.id, record.id)
+                entity_type = EntityType(entity_type=type_list)
+                entity_type.save()
+                PropertyAssertion(
+                    entity=entity, authority_record=record,
+                    entity_type=entity_type, is_preferred=True).save(
+                        validator=validator)
+                SearchName.objects.create(
+                    entity=entity, name=name,
+                    name_form='GENERATED %06d' % number)
+        self.entity = entity
+        self.record = record
+
+    def _assertIndexed(self, queryset):
+        tables = get_scanned_tables(queryset).intersection(LARGE_TABLES)
+        self.assertFalse(tables, 'Sequential scan of %s in query: %s'
+                         % (', '.join(sorted(tables)), queryset.query))
+
+    def test_main_view_queries(self):
+        if connection.vendor == 'postgresql':
+            # Case insensitive pattern matching is only indexed on
+            # PostgreSQL.
+            self._assertIndexed(Entity.objects.filter(
+                create_search_query(['GENERATED', '000042'])))
+        self._assertIndexed(get_record_search_queryset(
+            self.authority.id, self.record.authority_system_id,
+            self.record.authority_system_url))
+        self._assertIndexed(self.entity.get_authority_records())
+
+    def test_edit_view_queries(self):
+        record_filter = Q(authority_system_id=self.record.authority_system_id)
+        record_filter |= Q(
+            authority_system_url=self.record.authority_system_url)
+        self._assertIndexed(AuthorityRecord.objects.filter(
+            authority=self.authority).filter(record_filter))
+        # PropertyAssertionValidator's check for existing Existences.
+        self._assertIndexed(PropertyAssertion.objects.filter(
+            existence__isnull=False, entity_id__in=[self.entity.id],
+            authority_record_id__in=[self.record.id]))
+
+    def test_export_queries(self):
+        assertion = self.entity.assertions.all()[0]
+        self._assertIndexed(PropertyAssertion.objects.filter(
+            entity=self.entity, existence__isnull=False))
+        self._assertIndexed(assertion.dates.all())
+        self._assertIndexed(self.entity.get_entity_types())
+        self._assertIndexed(self.record.get_entities())
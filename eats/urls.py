@@ -9,6 +9,10 @@ urlpatterns = [
     url(r'^(?P<entity_id>\d+)/xtm/', main.display_entity_xtm),
     url(r'^(?P<entity_id>\d+)/eac/(?P<authority_record_id>\d+)/',
         main.display_entity_eac),
+    url(r'^authority/(?P<authority_id>\d+)/xtm/$',
+        main.display_authority_xtm),
+    url(r'^authority/(?P<authority_id>\d+)/eac/$',
+        main.display_authority_eac),
     url(r'^search/$', main.search, name='search'),  # Human usable search
     url(r'^lookup/$', main.lookup),  # Machine usable search, used by clients
     url(r'^entities/types/$', main.entity_types),
@@ -17,16 +21,22 @@ urlpatterns = [
     url(r'^get_names/$', main.get_names),
     url(r'^get_primary_authority_records/$',
         main.get_primary_authority_records),
+    url(r'^changes/$', main.changes),  # Changes for mirroring clients
 
     # Human usable import from EATSML
     url(r'^edit/import/$', edit.import_eatsml),
     url(r'^edit/import/(?P<import_id>\d+)/$', edit.display_import),
+    url(r'^edit/import/(?P<import_id>\d+)/resume/$', edit.resume_import),
     url(r'^edit/import/(?P<import_id>\d+)/raw/$', edit.display_import_raw),
     url(r'^edit/import/(?P<import_id>\d+)/processed/$',
         edit.display_import_processed),
     url(r'^edit/export/eatsml/$', edit.export_eatsml),
     url(r'^edit/export/eatsml/base/$', edit.export_base_eatsml),
     url(r'^edit/export/eatsml/(?P<authority_id>\d+)/$', edit.export_eatsml),
+    url(r'^edit/export/job/(?P<job_id>\d+)/$', edit.display_job,
+        name='display_job'),
+    url(r'^edit/export/job/(?P<job_id>\d+)/download/$', edit.download_job,
+        name='download_job'),
     url(r'^edit/export/xslt/$', edit.export_xslt_list),
     url(r'^edit/export/xslt/(?P<xslt>[A-Za-z0-9_\-]+)/', edit.export_xslt),
     url(r'^edit/create_entity/$', edit.create_entity, name='create_entity'),
@@ -1,10 +1,11 @@
+import gzip
+import json
 import os.path
-from io import StringIO
-
-from lxml import etree
+import re
 
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponseRedirect, HttpResponse, Http404
+from django.http import FileResponse, HttpResponseRedirect, HttpResponse, \
+    HttpResponseBadRequest, Http404, JsonResponse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.urls import reverse
 from django.db import transaction
@@ -12,22 +13,32 @@ from django.db.models import Q
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
 from django.shortcuts import render
 from django.apps import apps
+from django.utils.cache import patch_vary_headers
 
 from eats.settings import app_name, app_path
 from eats.models import (
     Authority, AuthorityRecord, Date, Entity, EntityRelationshipType,
-    EntityTypeList, Name, NamePartType, NameRelationshipType, NameType,
-    PropertyAssertion, RegisteredImport, UserProfile)
+    EntityTypeList, Job, Name, NamePartType, NameRelationshipType, NameType,
+    PropertyAssertion, PropertyAssertionValidator, RegisteredImport,
+    UserProfile, delete_entities, get_changes_watermark)
 from eats.forms.edit import (
     AuthorityRecordCreateForm, AuthorityRecordSearchForm, DateForm,
     EntityNoteForm, EntityRelationshipForm, EntityRelationshipNoteForm,
     EntitySelectorForm, EntityTypeForm, ExistenceForm, GenericFormSet,
     ImportForm, NameForm, NameNoteForm, NamePartForm, NameRelationshipForm,
-    NameRelationshipFormSet, ReferenceForm)
-from eats.views.main import get_model_preferences, \
-    get_name_search_results, get_record_search_results, search
-from eats.eatsml.exporter import Exporter
-from eats.eatsml.importer import Importer
+    NameRelationshipFormSet, ReferenceForm, ResumeImportForm)
+from eats.views.main import get_changes_token, get_model_preferences, \
+    get_name_search_results, get_record_search_results, \
+    get_response_format, search, should_prune
+from eats.jobs import EXPORT_BASE_EATSML, EXPORT_EATSML, IMPORT_EATSML, \
+    NDJSON, enqueue_job, get_artifact_path, get_base_eatsml_parameters, \
+    get_job_progress, resume_import_job, spool_upload
+
+# Single byte range of an HTTP Range header.
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Accept-Encoding header of a client accepting gzip compressed content.
+ACCEPTS_GZIP_PATTERN = re.compile(r'\bgzip\b')
 
 
 class EATSAuthenticationException (Exception):
@@ -421,6 +432,8 @@ def delete_entity(request, entity_id):
         context_data = {
             'object_type': model_name,
             'object_value': entity_object,
+            'deletion_counts': sorted(
+                delete_entities([entity_object.id], dry_run=True).items()),
         }
         return render(request, 'eats/edit/confirm_delete.html', context_data)
 
@@ -640,6 +653,7 @@ def edit_entity(request, entity, editable_authorities):
             else:
                 form_data['errors'] = True
         if not form_data['errors']:
+            validator = PropertyAssertionValidator()
             for form in form_data['creations']:
                 new_property = form.save()
                 authority_record = form.cleaned_data['authority_record']
@@ -649,9 +663,9 @@ def edit_entity(request, entity, editable_authorities):
                            form.property_field: new_property,
                            'is_preferred': is_preferred}
                 assertion = PropertyAssertion(**kw_args)
-                assertion.save()
+                assertion.save(validator=validator)
             for assertion, form in form_data['saves']:
-                assertion.save()
+                assertion.save(validator=validator)
                 form.save()
             for form in form_data['inline_saves']:
                 form.save()
@@ -671,9 +685,9 @@ def edit_entity(request, entity, editable_authorities):
                     .exclude(pk=assertion.id)
                 for non_existence_assertion in assertions:
                     non_existence_assertion.authority_record = authority_record
-                    non_existence_assertion.save()
+                    non_existence_assertion.save(validator=validator)
                 assertion.authority_record = authority_record
-                assertion.save()
+                assertion.save(validator=validator)
             return HttpResponseRedirect(
                 reverse(edit_model_object, kwargs={'model_name': 'entity',
                                                    'object_id': entity.id}))
@@ -864,17 +878,52 @@ def edit_model_object(request, model_name, object_id):
 
 @login_required()
 def display_import(request, import_id):
-    """Display the details of an import."""
+    """Display the details of an import, and the status of the job
+    performing it."""
     import_object = get_object_or_404(RegisteredImport, pk=import_id)
-    context_data = {'import': import_object}
+    return render_import(request, import_object, ResumeImportForm())
+
+
+def render_import(request, import_object, resume_form):
+    """Return a response displaying import_object, with resume_form
+    if its job failed."""
+    context_data = {'import': import_object, 'job': None,
+                    'resume_form': None, 'imported_count': 0}
+    job = import_object.job
+    if job is not None:
+        context_data['job'] = get_job_status(job)
+        if job.status == Job.FAILED:
+            context_data['resume_form'] = resume_form
+            if job.checkpoint:
+                context_data['imported_count'] = json.loads(
+                    job.checkpoint)['count']
     return render(request, 'eats/edit/display_import.html', context_data)
 
 
+@login_required()
+def resume_import(request, import_id):
+    """Queue the resumption of a failed import from its last
+    checkpoint, with a POSTed fixed EATSML file."""
+    import_object = get_object_or_404(RegisteredImport, pk=import_id)
+    job = import_object.job
+    if job is None or job.status != Job.FAILED:
+        raise Http404
+    if request.method == 'POST':
+        resume_form = ResumeImportForm(request.POST, request.FILES)
+        if resume_form.is_valid():
+            resume_import_job(job, spool_upload(
+                request.FILES['import_file']))
+        else:
+            return render_import(request, import_object, resume_form)
+    return HttpResponseRedirect(reverse(
+        display_import, kwargs={'import_id': import_object.id}))
+
+
 @login_required()
 def display_import_raw(request, import_id):
     """Display the XML of the imported document."""
     import_object = get_object_or_404(RegisteredImport, pk=import_id)
-    return HttpResponse(import_object.raw_xml, content_type='text/xml')
+    return get_import_document_response(request, import_object.raw_document)
 
 
 @login_required()
@@ -882,45 +931,68 @@ def display_import_processed(request, import_id):
     """Display the XML of the imported document, annotated with the
     IDs of the created objects."""
     import_object = get_object_or_404(RegisteredImport, pk=import_id)
-    return HttpResponse(import_object.processed_xml, content_type='text/xml')
+    return get_import_document_response(request,
+                                        import_object.processed_document)
+
+
+def get_import_document_response(request, document):
+    """Return a response serving the gzip compressed XML document at
+    the path document, relative to MEDIA_ROOT.
+
+    The document is served compressed, with a gzip content encoding,
+    to clients that accept it, and is decompressed as it is sent to
+    those that do not.
+
+    """
+    if not document:
+        raise Http404
+    path = get_artifact_path(document)
+    if not os.path.exists(path):
+        raise Http404
+    if ACCEPTS_GZIP_PATTERN.search(request.META.get('HTTP_ACCEPT_ENCODING',
+                                                    '')):
+        response = get_file_response(request, path, 'text/xml',
+                                     os.path.basename(path)[:-3],
+                                     as_attachment=False)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = FileResponse(gzip.open(path, 'rb'),
+                                content_type='text/xml')
+        # FileResponse sets the length of the file it is given the
+        # path of, which is that of the compressed document.
+        del response['Content-Length']
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
 
 
 @login_required()
 def import_eatsml(request):
-    """Import POSTed EATSML file."""
+    """Queue an import of a POSTed EATSML file.
+
+    The file is spooled to disk and imported by a job, whose progress
+    is shown on the page displaying the import.
+
+    """
     if request.method == 'POST':
         import_form = ImportForm(request.POST, request.FILES)
         if import_form.is_valid():
-            eatsml_file = StringIO()
-            for chunk in request.FILES['import_file'].chunks():
-                eatsml_file.write(chunk)
-            eatsml_file.seek(0)
-            try:
-                raw_root, processed_root = Importer(request.user).import_file(
-                    eatsml_file)
-            except Exception as e:
-                transaction.rollback()
-                response = render(request,
-                                  '500.html', {'message': e})
-                response.status_code = 500
-                return response
+            path = spool_upload(request.FILES['import_file'])
             description = import_form.cleaned_data['description']
-            raw_xml = etree.tostring(raw_root, encoding='utf-8',
-                                     pretty_print=True)
-            processed_xml = etree.tostring(processed_root, encoding='utf-8',
-                                           pretty_print=True)
-            registered_import = RegisteredImport(importer=request.user,
-                                                 description=description,
-                                                 raw_xml=raw_xml,
-                                                 processed_xml=processed_xml)
-            registered_import.save()
-            transaction.commit()
+            parameters = {'path': path,
+                          'match': import_form.cleaned_data['match_records']}
+            # The job must not be run before the import refers to it.
+            with transaction.atomic():
+                job = enqueue_job(IMPORT_EATSML, request.user, parameters)
+                registered_import = RegisteredImport.objects.create(
+                    importer=request.user, description=description,
+                    job=job)
             return HttpResponseRedirect(reverse(
                 display_import, kwargs={'import_id': registered_import.id}))
     else:
         import_form = ImportForm()
     import_list = RegisteredImport.objects.values(
-        'id', 'importer__username', 'description', 'import_date')
+        'id', 'importer__username', 'description', 'import_date',
+        'job__status')
     paginator = Paginator(import_list, 100)
     try:
         page = int(request.GET.get('page', '1'))
@@ -935,40 +1007,169 @@ def import_eatsml(request):
 
 
 def export_eatsml(request, authority_id=None):
-    if authority_id is None:
-        entity_objects = Entity.objects.all()
-    else:
-        entity_objects = Entity.objects.filter(
-            assertions__authority_record__authority=authority_id).distinct()
-    try:
-        eatsml_root = Exporter().export_entities(entity_objects)
-    except Exception as e:
-        response = render(request, '500.html', {'message': str(e)})
-        response.status_code = 500
-        return response
-    xml = etree.tostring(eatsml_root, encoding='utf-8', pretty_print=True)
-    return HttpResponse(xml, content_type='text/xml')
+    """Queue an export of all entities, or those with an authority
+    record of the authority with authority_id.
+
+    If a since parameter is given, only those entities changed after
+    the change it identifies are exported, and the token of the last
+    change is returned in the X-EATS-Changes-Token header. Deleted
+    entities are listed by the changes view.
+
+    If NDJSON is requested, the entities are exported one JSON object
+    to a line rather than as EATSML. Otherwise, if the prune parameter
+    is given, the EATSML leaves out the infrastructure data that the
+    entities do not reference.
+
+    """
+    parameters = {'authority_id': None}
+    if authority_id is not None:
+        parameters['authority_id'] = int(authority_id)
+    if get_response_format(request, ['eatsml', 'ndjson']) == 'ndjson':
+        parameters['format'] = NDJSON
+    elif should_prune(request):
+        parameters['prune'] = True
+    token = None
+    if 'since' in request.GET:
+        since = get_changes_token(request)
+        if since is None:
+            return HttpResponseBadRequest('Invalid since token')
+        token = get_changes_watermark(since)
+        parameters.update({'since': since, 'until': token})
+    user = None
+    if request.user.is_authenticated:
+        user = request.user
+    job = enqueue_job(EXPORT_EATSML, user, parameters, reusable=True)
+    response = get_job_response(job)
+    if token is not None:
+        response['X-EATS-Changes-Token'] = token
+    patch_vary_headers(response, ['Accept'])
+    return response
 
 
 @login_required()
 def export_base_eatsml(request):
-    """Export the infrastructure elements of the EATS server."""
-    exporter = Exporter()
-    exporter.set_user(request.user)
+    """Queue an export of the infrastructure elements of the EATS
+    server, annotated for the user."""
     try:
-        eatsml_root = exporter.export_infrastructure(limited=True,
-                                                     annotated=True)
-    except Exception as e:
-        response = render(request, '500.html', {'message': str(e)})
-        response.status_code = 500
-        return response
-    xml = etree.tostring(eatsml_root, encoding='utf-8', pretty_print=True)
-    return HttpResponse(xml, content_type='text/xml')
+        parameters = get_base_eatsml_parameters(request.user)
+    except UserProfile.DoesNotExist:
+        raise Http404
+    job = enqueue_job(EXPORT_BASE_EATSML, request.user, parameters,
+                      reusable=True)
+    return get_job_response(job)
+
+
+def get_job_response(job):
+    """Return a response redirecting to the artifact of job if it is
+    complete, or otherwise describing its status."""
+    if job.status == Job.COMPLETE:
+        return HttpResponseRedirect(reverse('download_job', args=[job.id]))
+    response = JsonResponse(get_job_status(job), status=202)
+    response['Location'] = reverse('display_job', args=[job.id])
+    return response
+
+
+def get_job_status(job):
+    """Return a dictionary describing the status of job."""
+    status = {'id': job.id, 'kind': job.kind, 'status': job.status,
+              'message': job.message, 'download': None}
+    status.update(get_job_progress(job))
+    if job.status == Job.COMPLETE and job.artifact:
+        status['download'] = reverse('download_job', args=[job.id])
+    return status
+
+
+def get_user_job(request, job_id):
+    """Return the Job with job_id, raising Http404 if it does not
+    exist or belongs to another user."""
+    job = get_object_or_404(Job, pk=job_id)
+    if job.kind == EXPORT_BASE_EATSML and job.user_id != request.user.id:
+        raise Http404
+    if job.kind == IMPORT_EATSML and not request.user.is_authenticated:
+        raise Http404
+    return job
+
+
+def display_job(request, job_id):
+    """Display the status of a job, as JSON."""
+    return JsonResponse(get_job_status(get_user_job(request, job_id)))
+
+
+def download_job(request, job_id):
+    """Return the gzip compressed artifact of a complete job."""
+    job = get_user_job(request, job_id)
+    if job.status != Job.COMPLETE or not job.artifact:
+        raise Http404
+    path = get_artifact_path(job.artifact)
+    if not os.path.exists(path):
+        raise Http404
+    return get_file_response(request, path, 'application/gzip',
+                             os.path.basename(path))
+
+
+class FileRange (object):
+
+    """File-like object reading no more than length bytes from the
+    current position of file_object."""
+
+    def __init__(self, file_object, length):
+        self._file_object = file_object
+        self._remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file_object.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file_object.close()
+
+
+def get_file_response(request, path, content_type, filename,
+                      as_attachment=True):
+    """Return a response serving the file at path, as an attachment
+    unless as_attachment is False, or the single byte range of it
+    given in the request's Range header."""
+    size = os.path.getsize(path)
+    start, end = 0, size - 1
+    status = 200
+    match = RANGE_PATTERN.match(request.META.get('HTTP_RANGE', ''))
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+        else:
+            # A suffix range, of the last bytes of the file.
+            start = max(size - int(match.group(2)), 0)
+        if start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % (size)
+            return response
+        status = 206
+    file_object = open(path, 'rb')
+    file_object.seek(start)
+    response = FileResponse(FileRange(file_object, end - start + 1),
+                            as_attachment=as_attachment, filename=filename,
+                            content_type=content_type, status=status)
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    return response
 
 
 @login_required()
 def export_xslt_list(request):
-    """Export the list of XSLTs required for the EATSML client interface."""
+    """Export the list of XSLTs required for the EATSML client interface.
+
+    The XSLTs remove redundant data from exports; a client may instead
+    request exports with the prune parameter, which are already
+    without it.
+
+    """
     try:
         xml = open(os.path.join(app_path, 'eatsml/xslt_list.xml'))
     except IOError:
@@ -1,28 +1,41 @@
-import os.path
-
 from lxml import etree
 
 from django.contrib.sites.models import Site
-from django.shortcuts import render_to_response, render
-from django.http import HttpResponse, Http404
+from django.shortcuts import get_object_or_404, render_to_response, render
+from django.http import HttpResponse, HttpResponseBadRequest, Http404, \
+    JsonResponse, StreamingHttpResponse
 from django.template import RequestContext, Context, loader
 from django.views.generic import ListView
 from django.db.models import Q
+from django.utils.cache import patch_vary_headers
 
 import eats.names as namehandler
 from eats.models import (
     Authority, AuthorityRecord, Calendar, DatePeriod, DateType, Entity,
     EntityTypeList, Language, Name, NameType, Script, UserProfile,
-    get_default_object)
+    get_default_object, get_entity_changes)
 from eats.forms.main import SearchForm
-from eats.settings import app_path
 from eats.eatsml.exporter import Exporter
+from eats.eatsml.json_exporter import JSON_CONTENT_TYPE, \
+    NDJSON_CONTENT_TYPE, JSONExporter
+from eats.eatsml.transforms import EAC, EAC_GROUP, XTM, \
+    stream_authority_transform, transform_entity
+
+# Maximum number of recorded changes reported in one response from
+# the changes view.
+CHANGES_LIMIT = 10000
+
+# Formats a response may be negotiated in, and the media types
+# requesting each.
+RESPONSE_FORMATS = {
+    'html': ('text/html', 'application/xhtml+xml'),
+    'eatsml': ('text/xml', 'application/xml'),
+    'json': (JSON_CONTENT_TYPE,),
+    'ndjson': (NDJSON_CONTENT_TYPE,),
+}
 
-to_xtm_xslt = etree.parse(os.path.join(app_path, 'xsl/eatsml-to-xtm.xsl'))
-to_xtm_transform = etree.XSLT(to_xtm_xslt)
-to_eac_xslt = etree.parse(os.path.join(
-    app_path, 'xsl/eatsml-to-eac-individual.xsl'))
-to_eac_transform = etree.XSLT(to_eac_xslt)
+# Separators for compact JSON responses.
+COMPACT_JSON = {'separators': (',', ':')}
 
 
 def index(request):
@@ -69,12 +82,68 @@ def get_model_preferences(user):
     return preferences
 
 
+def get_response_format(request, formats):
+    """Return the name of the format, of those in formats, in which to
+    respond to request.
+
+    A format query parameter naming one of formats takes precedence;
+    otherwise the format of the media type with the highest quality
+    in the Accept header is used, and failing that, the first of
+    formats.
+
+    Arguments:
+    request -- HttpRequest object
+    formats -- list of keys of RESPONSE_FORMATS
+
+    """
+    response_format = request.GET.get('format')
+    if response_format in formats:
+        return response_format
+    response_format = formats[0]
+    best_quality = 0
+    for media_range in request.META.get('HTTP_ACCEPT', '').split(','):
+        parameters = media_range.split(';')
+        media_type = parameters[0].strip().lower()
+        quality = 1.0
+        for parameter in parameters[1:]:
+            name, sep, value = parameter.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        for name in formats:
+            if media_type in RESPONSE_FORMATS[name] and \
+                    quality > best_quality:
+                response_format = name
+                best_quality = quality
+    return response_format
+
+
+def should_prune(request):
+    """Return True if request asks, with a true prune query parameter,
+    for an EATSML export without the infrastructure data that its
+    entities do not reference."""
+    return request.GET.get('prune', '').lower() in ('1', 'true', 'yes')
+
+
+def get_json_response(data):
+    """Return a compact JSON response of data, which varies with the
+    Accept header."""
+    response = JsonResponse(data, json_dumps_params=COMPACT_JSON)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
 def display_entity(request, entity_id):
-    """Display entity details in HTML."""
+    """Display entity details in HTML, or in JSON if requested."""
     try:
         entity_object = Entity.objects.get(pk=int(entity_id))
     except Entity.DoesNotExist:
         raise Http404
+    if get_response_format(request, ['html', 'json']) == 'json':
+        return get_json_response(JSONExporter(for_read=True).export_entities(
+            [entity_object]))
     current_site = Site.objects.get_current()
     # QAZ: Hack to specify which, if any, authority records are suitable
     # for producing EAC-CPF.
@@ -87,7 +156,9 @@ def display_entity(request, entity_id):
         'entity': entity_object,
         'eac_authority_records': eac_authority_records,
         'site': current_site}
-    return render(request, 'eats/view/display_entity.html', context_data)
+    response = render(request, 'eats/view/display_entity.html', context_data)
+    patch_vary_headers(response, ['Accept'])
+    return response
 
 
 def display_entity_eatsml(request, entity_id):
@@ -97,7 +168,7 @@ def display_entity_eatsml(request, entity_id):
     except Entity.DoesNotExist:
         raise Http404
     try:
-        eatsml_root = Exporter().export_entities([entity_object])
+        eatsml_root = Exporter(for_read=True).export_entities([entity_object])
     except Exception as e:
         response = render_to_response('500.html', {'message': e.message},
                                       context_instance=RequestContext(request))
@@ -115,7 +186,7 @@ def display_entity_full_eatsml(request, entity_id):
     except Entity.DoesNotExist:
         raise Http404
     try:
-        eatsml_root = Exporter().export_entities(
+        eatsml_root = Exporter(for_read=True).export_entities(
             [entity_object], full_details=True)
     except Exception as e:
         response = render_to_response('500.html', {'message': e.message},
@@ -127,12 +198,8 @@ def display_entity_full_eatsml(request, entity_id):
     return HttpResponse(xml, content_type='text/xml')
 
 
-def display_entity_xtm(request, entity_id):
-    """Display entity details in XTM."""
-    try:
-        entity_object = Entity.objects.get(pk=int(entity_id))
-    except Entity.DoesNotExist:
-        raise Http404
+def get_base_psi_url(entity_object):
+    """Return the base URL of the PSIs of entities in XTM."""
     current_site = Site.objects.get_current()
     # QAZ: The following is a hack. There must be a proper way to get
     # the base URL. And in fact this base URL should really be part of
@@ -141,11 +208,17 @@ def display_entity_xtm(request, entity_id):
     if path[-1] == '/':
         path = path[:-1]
     path = path[:path.rfind('/') + 1]
-    base_psi_url = "'http://%s%s'" % (current_site.domain, path)
-    eatsml_root = Exporter().export_entities([entity_object])
-    xtm_tree = to_xtm_transform(eatsml_root, base_psi_url=base_psi_url)
-    xml = etree.tostring(xtm_tree.getroot(), encoding='utf-8',
-                         pretty_print=True)
+    return 'http://%s%s' % (current_site.domain, path)
+
+
+def display_entity_xtm(request, entity_id):
+    """Display entity details in XTM."""
+    try:
+        entity_object = Entity.objects.get(pk=int(entity_id))
+    except Entity.DoesNotExist:
+        raise Http404
+    xml = transform_entity(entity_object, XTM,
+                           base_psi_url=get_base_psi_url(entity_object))
     return HttpResponse(xml, content_type='text/xml')
 
 
@@ -163,16 +236,33 @@ def display_entity_eac(request, entity_id, authority_record_id):
     if authority_record not in entity.get_authority_records():
         raise Http404
     current_site = Site.objects.get_current()
-    eatsml_root = Exporter().export_entities([entity])
-    eac_tree = to_eac_transform(
-        eatsml_root, entity_id="'%s'" % entity_id,
-        authority_record_id="'%s'" % authority_record_id,
-        base_url="'%s'" % current_site.domain)
-    xml = etree.tostring(eac_tree.getroot(), encoding='utf-8',
-                         pretty_print=True)
+    xml = transform_entity(entity, EAC, entity_id=entity_id,
+                           authority_record_id=authority_record_id,
+                           base_url=current_site.domain)
     return HttpResponse(xml, content_type='text/xml')
 
 
+def display_authority_xtm(request, authority_id):
+    """Display the details of all of the entities of an authority as
+    a single XTM topic map."""
+    authority = get_object_or_404(Authority, pk=authority_id)
+    # Only the path leading to an entity's ID is used.
+    base_psi_url = get_base_psi_url(Entity())
+    chunks = stream_authority_transform(authority.id, XTM,
+                                        {'base_psi_url': base_psi_url})
+    return StreamingHttpResponse(chunks, content_type='text/xml')
+
+
+def display_authority_eac(request, authority_id):
+    """Display the EAC-CPF records of all of the entities of an
+    authority."""
+    authority = get_object_or_404(Authority, pk=authority_id)
+    current_site = Site.objects.get_current()
+    chunks = stream_authority_transform(authority.id, EAC_GROUP,
+                                        {'base_url': current_site.domain})
+    return StreamingHttpResponse(chunks, content_type='text/xml')
+
+
 def search(request):
     """View for HTML search form and results."""
     results = set([])
@@ -199,7 +289,12 @@ def search(request):
 
 
 def lookup(request):
-    """View for EATSML search results."""
+    """View for EATSML, or JSON if requested, search results.
+
+    The EATSML is pruned of unreferenced infrastructure data if the
+    prune parameter is given (see should_prune).
+
+    """
     results = set([])
     search_terms = request.GET.copy()
     name = search_terms.get('name', '')
@@ -211,8 +306,13 @@ def lookup(request):
     elif authority and (record_id or record_url):
         results = get_record_search_results(authority, record_id,
                                             record_url)
-    from eats.eatsml.exporter import Exporter
-    exporter = Exporter()
+    if get_response_format(request, ['eatsml', 'json']) == 'json':
+        exporter = JSONExporter(for_read=True)
+        exporter.set_user(request.user)
+        # Only an authenticated user has preferences to annotate with.
+        return get_json_response(exporter.export_entities(
+            list(results), annotated=request.user.is_authenticated))
+    exporter = Exporter(for_read=True, prune=should_prune(request))
     exporter.set_user(request.user)
     try:
         eatsml_root = exporter.export_entities(list(results), annotated=True)
@@ -222,7 +322,9 @@ def lookup(request):
         response.status_code = 500
         return response
     xml = etree.tostring(eatsml_root, encoding='utf-8', pretty_print=True)
-    return HttpResponse(xml, content_type='text/xml')
+    response = HttpResponse(xml, content_type='text/xml')
+    patch_vary_headers(response, ['Accept'])
+    return response
 
 
 def get_name_search_results(name):
@@ -271,6 +373,14 @@ def get_record_search_results(authority_id, record_id, record_url):
     """Return a list of Entity objects which are associated with the
     authority record defined by authority_id, record_id, and
     record_url."""
+    return set(get_record_search_queryset(authority_id, record_id,
+                                          record_url))
+
+
+def get_record_search_queryset(authority_id, record_id, record_url):
+    """Return a QuerySet of the Entity objects which are associated
+    with the authority record defined by authority_id, record_id, and
+    record_url."""
     queries = []
     if record_id:
         queries.append(
@@ -284,11 +394,9 @@ def get_record_search_results(authority_id, record_id, record_url):
             Qs = Qs | query
         else:
             Qs = query
-    results = set(
-        Entity.objects.filter(
-            Qs, assertions__authority_record__authority__pk=authority_id
-        ).distinct())
-    return results
+    return Entity.objects.filter(
+        Qs, assertions__authority_record__authority__pk=authority_id
+    ).distinct()
 
 
 def get_names(request):
@@ -340,3 +448,33 @@ def entities_by_type(request, entity_type_id):
                     'entity_count': len(entities),
                     'entity_type': entity_type}
     return render(request, 'eats/view/entities_by_type.html', context_data)
+
+
+def get_changes_token(request):
+    """Return the change token given as the since parameter of
+    request, or None if it is not a valid token."""
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return None
+    if since < 0:
+        return None
+    return since
+
+
+def changes(request):
+    """View listing, as JSON, the entities changed and deleted since
+    the change identified by the since parameter.
+
+    The response includes the token to pass as since in the next
+    request, and whether there are further changes beyond those
+    listed. Changes are kept only for the retention period (see the
+    prune_entity_changes command), so a client whose token is older
+    must fetch the entities afresh."""
+    since = get_changes_token(request)
+    if since is None:
+        return HttpResponseBadRequest('Invalid since token')
+    changed_ids, deleted_ids, token, more = get_entity_changes(
+        since, CHANGES_LIMIT)
+    return JsonResponse({'changed': changed_ids, 'deleted': deleted_ids,
+                         'token': token, 'more': more})